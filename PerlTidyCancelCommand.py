@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import sublime
+import sublime_plugin
+
+try:
+    from .perltidy.base import *
+except (Exception) as e:
+    from perltidy.base import *
+
+
+class PerlTidyCancelCommand(sublime_plugin.ApplicationCommand):
+
+    """Stop all in-flight perltidy runs, discarding their output."""
+
+    def run(self):
+        count = cancel_perltidy_processes()
+        if count:
+            sublime.status_message('PerlTidy: Cancelled {0} perltidy run(s)'.format(count))
+        else:
+            sublime.status_message('PerlTidy: Nothing to cancel')
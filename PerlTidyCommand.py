@@ -1,177 +1,833 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, unicode_literals
+import copy
+import os
 import sublime
 import sublime_plugin
+import threading
+import time
 
 try:
-    from .perltidy.helpers import *
+    from .perltidy.base import *
+    from .perltidy.cache import flush_perltidy_fingerprint_index
+    from .perltidy.diagnostics import PerlTidyDiagnostic, iter_perltidy_diagnostics
+    from .perltidy.diff import diff_hunks, map_offset
+    from .perltidy.git import get_git_head_text
+    from .perltidy.incremental import (find_changed_blocks, find_top_level_statements, get_perltidy_baseline,
+                                       load_perltidy_baseline, save_perltidy_baseline, set_perltidy_baseline)
+    from .perltidy.linehash import (clear_perltidy_row_index, diff_hunks_by_row_hashes, get_perltidy_row_index,
+                                    hash_rows, set_perltidy_row_index)
+    from .perltidy.worker import stop_perltidy_workers
 except (Exception) as e:
-    from perltidy.helpers import *
+    from perltidy.base import *
+    from perltidy.cache import flush_perltidy_fingerprint_index
+    from perltidy.diagnostics import PerlTidyDiagnostic, iter_perltidy_diagnostics
+    from perltidy.diff import diff_hunks, map_offset
+    from perltidy.git import get_git_head_text
+    from perltidy.incremental import (find_changed_blocks, find_top_level_statements, get_perltidy_baseline,
+                                      load_perltidy_baseline, save_perltidy_baseline, set_perltidy_baseline)
+    from perltidy.linehash import (clear_perltidy_row_index, diff_hunks_by_row_hashes, get_perltidy_row_index,
+                                   hash_rows, set_perltidy_row_index)
+    from perltidy.worker import stop_perltidy_workers
+
+
+# IDs of views currently being tidied in background.
+_views_in_progress = set()
+
+# Tidy on save: time of last tidy per view ID, IDs of views with a tidy
+# scheduled after rapid saves, and IDs of views saved after tidying.
+_views_tidied_on_save = {}
+_views_pending_tidy_on_save = set()
+_views_resaving = set()
+
+# Results of background perltidy runs waiting to be applied as tuples
+# (outputs, diffs, row_hashes), keyed by view ID. Passing them as command
+# arguments would copy them.
+_pending_results = {}
+
+# Change counts of views right after background results have been applied,
+# keyed by view ID. Results discarded as stale are not recorded.
+_applied_change_counts = {}
+
+# Diagnostics reporters in progress and phantom sets, keyed by view ID.
+_diagnostics_reporters = {}
+_phantom_sets = {}
+
+# Number of diagnostics annotated at once, before yielding to Sublime Text.
+DIAGNOSTICS_CHUNK_SIZE = 500
+
+# Maximum number of phantoms shown per view. All diagnostics get gutter icons
+# and regions.
+DIAGNOSTICS_MAX_PHANTOMS = 100
+
+
+# Number of characters read from a view at once, when streaming it through
+# perltidy.
+STREAMING_CHUNK_SIZE = 1024 * 1024
+
+
+# Warm up perltidy for all open windows, once the plugin has been loaded, so
+# the first tidy doesn't wait for perltidy discovery, perltidyrc lookup and
+# Perl::Tidy startup. See user setting "perltidy_worker_prewarm".
+def plugin_loaded():
+    sublime.set_timeout(warm_up_perltidy, 0)
+
+
+# Stop perltidy workers and save fingerprints of tidy texts, when plugin is
+# unloaded (Sublime Text 3 only).
+def plugin_unloaded():
+    stop_perltidy_workers()
+    flush_perltidy_fingerprint_index()
+
+
+# Warm up perltidy using settings and file of the active view of each window.
+def warm_up_perltidy():
+    for window in sublime.windows():
+        view = window.active_view()
+        if view is None:
+            continue
+
+        command = PerlTidyCommand(view)
+        command.load_settings()
+        if command.is_enabled() and command._perltidy_worker_prewarm:
+            command.warm_up(file_name=view.file_name())
+
+
+# Replace given regions (list of sublime.Region) in view with given outputs
+# (None for regions, which could not be tidied). Only changed lines are
+# replaced, back to front, so offsets of hunks not replaced yet remain valid
+# and folds, marks and bookmarks on unchanged lines are kept. If
+# "map_selection" is True, selections are mapped through the changes
+# afterwards. If given, "baseline" describes the perltidy configuration used
+# (see PerlTidyCommand.make_baseline()), and the row hashes of the resulting
+# text are remembered for incremental tidying, if all regions have been
+# tidied, and written to "baseline_dir" (if given). If
+# "streaming" is True, outputs are lists of chunks streamed from huge
+# regions, which are replaced as a whole instead, as diffing would copy them
+# several times. Chunks are released once inserted. Selections then
+# keep their rows and columns. If given, "diffs" are tuples (old, hunks) per
+# region as returned by diff_perltidy_outputs(), so regions need not be read
+# and diffed again, and "row_hashes" are the hashes of all rows of the view
+# after applying the outputs, which are remembered for diffing the next tidy.
+def apply_perltidy_outputs(view, edit, regions, outputs, map_selection=False, baseline=None, streaming=False,
+                           diffs=None, row_hashes=None, baseline_dir=None):
+    track_failed_regions(view, regions, outputs)
+    mapped_selection = [(region.a, region.b) for region in view.sel()]
+    changed = False
+
+    for i in reversed(range(len(regions))):
+        region, output = regions[i], outputs[i]
+        if output is None:
+            continue
+
+        if streaming:
+            rowcols = [(view.rowcol(a), view.rowcol(b)) for a, b in mapped_selection]
+            view.erase(edit, region)
+            point = region.begin()
+            for index in range(len(output)):
+                point += view.insert(edit, point, output[index])
+                output[index] = None
+            mapped_selection = [(text_point_in_line(view, *a), text_point_in_line(view, *b)) for a, b in rowcols]
+            changed = True
+            continue
+
+        if diffs is not None:
+            old, hunks = diffs[i]
+        else:
+            old = view.substr(region)
+            hunks = diff_hunks(old, output)
+        changed = changed or len(hunks) > 0
+
+        for begin, end, replacement in reversed(hunks):
+            view.replace(edit, sublime.Region(region.begin() + begin, region.begin() + end), replacement)
+
+        if map_selection:
+            mapped_selection = [(region.begin() + map_offset(old, hunks, a - region.begin()),
+                                 region.begin() + map_offset(old, hunks, b - region.begin()))
+                                if region.contains(a) and region.contains(b) else (a, b)
+                                for a, b in mapped_selection]
+
+    if map_selection and None not in outputs:
+        view.sel().clear()
+        for a, b in mapped_selection:
+            view.sel().add(sublime.Region(a, b))
+        view.show_at_center(view.sel()[0].begin())
+
+    if row_hashes is not None and None not in outputs:
+        set_perltidy_row_index(view.buffer_id(), row_hashes, view.change_count())
+    elif changed:
+        clear_perltidy_row_index(view.buffer_id())
+
+    if baseline is not None and None not in outputs:
+        # The row index is updated in place while editing, so remember a
+        # copy of its hashes.
+        if row_hashes is None:
+            row_hashes = hash_rows(view.substr(sublime.Region(0, view.size())))
+        set_perltidy_baseline(view.id(), row_hashes[:], baseline['args'], baseline['perltidyrc_fingerprint'],
+                              baseline['perltidy_version'])
+
+        # Remember row hashes across restarts, without blocking the UI.
+        if baseline_dir is not None and view.file_name() is not None:
+            thread = threading.Thread(target=save_perltidy_baseline, args=(view.id(), view.file_name(), baseline_dir))
+            thread.daemon = True
+            thread.start()
+
+
+# Diff outputs of perltidy against its inputs. Returns tuple (diffs,
+# row_hashes) for apply_perltidy_outputs(): "diffs" contains a tuple (input,
+# hunks) per input (None for inputs, which could not be tidied). If
+# "whole_view" is True, the only input is the entire view, and rows at its
+# beginning and end, which perltidy did not change, are skipped by comparing
+# row hashes (given in "old_hashes" or computed) first. "row_hashes" then are
+# the hashes of the rows of the output. Otherwise, if the entire "text" of the
+# view and "offsets" (tuples (begin, end)) of the inputs within it are given,
+# "row_hashes" are the hashes of the rows of the text with all outputs
+# applied, and None otherwise.
+def diff_perltidy_outputs(inputs, outputs, whole_view=False, old_hashes=None, text=None, offsets=None):
+    if whole_view and outputs[0] is not None:
+        row_hashes = hash_rows(outputs[0])
+        hunks = diff_hunks_by_row_hashes(inputs[0], outputs[0], old_hashes, row_hashes)
+        return [(inputs[0], hunks)], row_hashes
+
+    diffs = [(input, diff_hunks(input, output)) if output is not None else None
+             for input, output in zip(inputs, outputs)]
+
+    row_hashes = None
+    if text is not None and None not in outputs:
+        parts = []
+        position = 0
+        for (begin, end), output in zip(offsets, outputs):
+            parts.append(text[position:begin])
+            parts.append(output)
+            position = end
+        parts.append(text[position:])
+        row_hashes = hash_rows(''.join(parts))
+
+    return diffs, row_hashes
+
+
+# Return offset of given row and column in view, limiting column to the
+# length of the row.
+def text_point_in_line(view, row, col):
+    line = view.line(view.text_point(row, 0))
+    return min(line.begin() + col, line.end())
+
+
+# Yield text of given region in view in chunks of STREAMING_CHUNK_SIZE
+# characters. Raises PerlTidyAbortedError, if view is modified meanwhile.
+def iter_view_chunks(view, region, change_count):
+    for begin in range(region.begin(), region.end(), STREAMING_CHUNK_SIZE):
+        if view.change_count() != change_count:
+            raise PerlTidyAbortedError('view has been modified while tidying', PerlTidyAbortedError.CANCELLED)
+        yield view.substr(sublime.Region(begin, min(begin + STREAMING_CHUNK_SIZE, region.end())))
+
+
+# Remember regions, which could not be tidied, in view, so diagnostics can be
+# mapped to them after other regions have been replaced.
+def track_failed_regions(view, regions, outputs):
+    failed_regions = [region for region, output in zip(regions, outputs) if output is None]
+    view.add_regions('perltidy_failed', failed_regions, '', '', sublime.HIDDEN)
+
+
+# Remove all diagnostics annotations from view.
+def clear_perltidy_diagnostics(view):
+    _diagnostics_reporters.pop(view.id(), None)
+    view.erase_regions('perltidy_errors')
+    view.erase_regions('perltidy_warnings')
+
+    phantom_set = _phantom_sets.pop(view.id(), None)
+    if phantom_set is not None:
+        phantom_set.update([])
+
+
+# Escape text for use in minihtml.
+def escape_html(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+class PerlTidyDiagnosticsReporter(object):
+
+    """Annotates problems reported by perltidy in a view.
+
+    Error output is parsed lazily and annotated in chunks of
+    DIAGNOSTICS_CHUNK_SIZE diagnostics, yielding to Sublime Text in between,
+    so huge numbers of warnings don't block the editor. Errors and warnings
+    get gutter icons and underlined regions, and, on Sublime Text 3, phantoms
+    below the offending lines. A new report for a view supersedes any report
+    in progress.
+    """
+
+    def __init__(self, view, sources, phantoms=True):
+        self.view = view
+        self.sources = list(sources)
+        self.phantoms = phantoms and hasattr(sublime, 'PhantomSet')
+
+        self._diagnostics = None
+        self._origin = None
+        self._regions = {PerlTidyDiagnostic.ERROR: [], PerlTidyDiagnostic.WARNING: []}
+        self._phantoms = []
+
+    # Start annotating. "sources" are tuples (region, error_output), where
+    # line numbers within error output are relative to the region.
+    def start(self):
+        clear_perltidy_diagnostics(self.view)
+        _diagnostics_reporters[self.view.id()] = self
+        self._step()
+
+    def _step(self):
+        if _diagnostics_reporters.get(self.view.id()) is not self:
+            return
 
+        count = 0
+        while count < DIAGNOSTICS_CHUNK_SIZE:
+            if self._diagnostics is None:
+                if not self.sources:
+                    break
+                region, error_output = self.sources.pop(0)
+                self._origin = self.view.rowcol(region.begin())
+                self._diagnostics = iter_perltidy_diagnostics(error_output)
 
-DEFAULT_SETTINGS = {
-    'perltidy_enabled': True,
-    'perltidy_log_level': 0,
-    'perltidy_options': ['-pbp'],
-    'perltidy_options_take_precedence': False,
-    'perltidy_rc_paths': ['.perltidyrc', 'perltidyrc'],
-}
+            try:
+                diagnostic = next(self._diagnostics)
+            except (StopIteration) as e:
+                self._diagnostics = None
+                continue
 
+            if diagnostic.severity != PerlTidyDiagnostic.INFO:
+                self.add(diagnostic)
+                count += 1
 
-class PerlTidyCommand(sublime_plugin.TextCommand):
+        self.update()
 
-    _perltidy_cmd = None
-    _perltidy_log_level = None
-    _perltidy_options = None
-    _perltidy_rc_paths = None
+        if self._diagnostics is not None or self.sources:
+            sublime.set_timeout(self._step, 1)
+        else:
+            del _diagnostics_reporters[self.view.id()]
+
+    # Map diagnostic to view and remember its annotations.
+    def add(self, diagnostic):
+        row, column = self._origin
+        row += diagnostic.line - 1
+        if diagnostic.line > 1:
+            column = 0
+
+        line = self.view.line(self.view.text_point(row, 0))
+        begin = min(line.begin() + column + (diagnostic.column or 0), line.end())
+        region = sublime.Region(begin, line.end() if diagnostic.column is None else min(begin + 1, line.end()))
+        self._regions[diagnostic.severity].append(region)
+
+        if self.phantoms and len(self._phantoms) < DIAGNOSTICS_MAX_PHANTOMS:
+            content = '<body id="perltidy-diagnostic"><div class="{0}">PerlTidy {0}: {1}</div></body>'.format(
+                diagnostic.severity, escape_html(diagnostic.message))
+            self._phantoms.append(sublime.Phantom(sublime.Region(line.end()), content, sublime.LAYOUT_BELOW))
+
+    # Update annotations shown in view.
+    def update(self):
+        flags = getattr(sublime, 'DRAW_NO_FILL', 0) | getattr(sublime, 'DRAW_NO_OUTLINE', 0) | \
+            getattr(sublime, 'DRAW_SQUIGGLY_UNDERLINE', 0)
+
+        self.view.add_regions('perltidy_errors', self._regions[PerlTidyDiagnostic.ERROR],
+                              'invalid', 'circle', flags)
+        self.view.add_regions('perltidy_warnings', self._regions[PerlTidyDiagnostic.WARNING],
+                              'invalid.deprecated', 'dot', flags)
+
+        if self.phantoms and self._phantoms:
+            phantom_set = _phantom_sets.get(self.view.id())
+            if phantom_set is None:
+                phantom_set = _phantom_sets[self.view.id()] = sublime.PhantomSet(self.view, 'perltidy_diagnostics')
+            phantom_set.update(self._phantoms)
+
+
+# Animated status bar message, shown while tidying in background.
+class PerlTidyStatusSpinner(object):
+
+    FRAMES = ['[=   ]', '[ =  ]', '[  = ]', '[   =]', '[  = ]', '[ =  ]']
+
+    def __init__(self, view, message='PerlTidy: Tidying'):
+        self.view = view
+        self.message = message
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._tick(0)
+
+    # May be called from any thread.
+    def stop(self):
+        self._running = False
+
+    def _tick(self, frame):
+        if not self._running:
+            self.view.erase_status('perltidy')
+            return
 
-    # Try to locate perltidy and set self._perltidy_cmd.
-    def find_perltidy(self):
+        self.view.set_status('perltidy', '{0} {1}'.format(self.message, self.FRAMES[frame % len(self.FRAMES)]))
+        sublime.set_timeout(lambda: self._tick(frame + 1), 100)
 
-        # Determine perltidy command to run in the following order:
-        # 1. From user setting "perltidy_cmd"
-        # 2. Within PATH (search for "perltidy" or "perltidy.bat" on Windows)
-        # 3. From platform specific defaults
-        if self._perltidy_cmd is None:
-            cmd = None
 
-            try:
-                # 1. From user setting "perltidy_cmd", this may be either a
-                #    single string or a list, handle appropriately.
-                cmd = self.view.settings().get('perltidy_cmd')
-                if cmd is not None and type(cmd) is not list:
-                    cmd = [cmd]
-
-                if is_valid_perltidy_cmd(cmd, cmd_source='user', logger=self):
-                    raise StopIteration()
-
-                # 2. Within PATH (search for "perltidy" or "perltidy.bat" on
-                # Windows)
-                cmd = find_perltidy_in_path(logger=self)
-                if cmd is not None:
-                    raise StopIteration()
-
-                # 3. From platform specific defaults
-                cmd = find_perltidy_in_platform_default_paths(logger=self)
-                if cmd is not None:
-                    raise StopIteration()
-
-            except (StopIteration):
-                # Save command for later usage
-                self.log(1, 'Using perltidy: ' + pp(cmd))
-                self._perltidy_cmd = cmd
-            else:
-                pass
+class PerlTidyCommand(PerlTidyBase, sublime_plugin.TextCommand):
 
-        return self._perltidy_cmd
+    # Return view settings, which include project and user settings.
+    def get_settings(self):
+        return self.view.settings()
+
+    # Return folders of window containing the view.
+    def get_folders(self):
+        return self.view.window().folders()
 
     # Report to Sublime Text 2 whether PerlTidy is enabled, or not.
     def is_enabled(self):
         return self.view.settings().get('perltidy_enabled', DEFAULT_SETTINGS['perltidy_enabled'])
 
-    # Load PerlTidy settings from Sublime preferences.
-    def load_settings(self, reload=True):
-        settings = self.view.settings()
-
-        if reload or self._perltidy_log_level is None:
-            self._perltidy_log_level = settings.get('perltidy_log_level', DEFAULT_SETTINGS['perltidy_log_level'])
-        if reload or self._perltidy_options is None:
-            self._perltidy_options = settings.get('perltidy_options', DEFAULT_SETTINGS['perltidy_options'])
-        if reload or self._perltidy_options_take_precedence is None:
-            self._perltidy_options_take_precedence = settings.get(
-                'perltidy_options_take_precedence', DEFAULT_SETTINGS['perltidy_options_take_precedence'])
-        if reload or self._perltidy_rc_paths is None:
-            self._perltidy_rc_paths = settings.get('perltidy_rc_paths', DEFAULT_SETTINGS['perltidy_rc_paths'])
-        if reload and self._perltidy_cmd is not None:
-            self._perltidy_cmd = None           # will be set by find_perltidy()
-
-    # Simple logging.
-    def log(self, level, message):
-        if level <= self._perltidy_log_level:
-            print('PerlTidy: {0}'.format(message))
-
-    # Return current log level.
-    def log_level(self):
-        return self._perltidy_log_level
-
-    # Main entry point for Sublime Text.
-    def run(self, edit):
+    # Main entry point for Sublime Text. If "asynchronous" is not given, user
+    # setting "perltidy_async" decides, whether perltidy will be run in
+    # background. If "on_save" is True, the entire view is tidied before
+    # saving. In background, saving waits at most for the time budget given
+    # in user setting "perltidy_tidy_on_save_budget". If tidying takes
+    # longer, the result is applied afterwards and the view is saved again.
+    # The same happens instead of tidying before saving, if "resave" is True.
+    # If "changed_hunks" is True, only statements changed relative to git
+    # HEAD are tidied.
+    def run(self, edit, asynchronous=None, on_save=False, resave=False, changed_hunks=False):
+        # Check for tidies in progress before loading settings, as a
+        # background tidy of this view may still be running. Views with a
+        # tidy still queued may be tidied again, superseding the queued tidy.
+        if on_save and self.view.id() in _views_resaving:
+            return
+        if self.view.id() in _views_in_progress and not get_perltidy_scheduler().is_queued(self.view.id()):
+            if not on_save:
+                sublime.status_message('PerlTidy: Already tidying this view')
+            return
+
         self.load_settings()
+        self.start_timer()
+
+        if asynchronous is None:
+            asynchronous = self._perltidy_async
+
+        if on_save and not self.should_tidy_on_save():
+            return
 
         # Bailout, if we don't have a valid perltidy command to run.
-        if not self.find_perltidy():
-            sublime.error_message(
-                'PerlTidy: Cannot find perltidy in any directory given in environment variable ' +
-                'PATH, nor in platform specific default locations. Please setup your environment ' +
-                'variable PATH, so it contains perltidy, or specify perltidy location in user ' +
-                'setting "perltidy_cmd". Please refer to documentation at ' +
-                'https://github.com/vifo/SublimePerlTidy for details.')
+        with self.span('find_perltidy'):
+            cmd = self.find_perltidy()
+        if not cmd:
+            sublime.error_message(PERLTIDY_NOT_FOUND_MESSAGE)
+            return
+
+        # Check, if we have any non-empty regions and tidy them. If not, go
+        # ahead and tidy entire view and reposition cursor after tidying up.
+        regions = sorted([region for region in self.view.sel() if not region.empty()],
+                         key=lambda region: region.begin()) if not (on_save or changed_hunks) else []
+
+        args = self.build_perltidy_args(file_name=self.view.file_name())
+        map_selection = False
+        baseline = None
+
+        if regions:
+            descriptions = [self.describe_region(region, i) for i, region in enumerate(regions)]
+        else:
+            # When tidying changed hunks, only tidy top-level statements
+            # changed relative to git HEAD. The result need not be tidy as a
+            # whole, so it is not remembered for incremental tidying. In
+            # incremental mode, only tidy top-level blocks changed since the
+            # last tidy using the same arguments.
+            map_selection = True
+            regions = None
+            kind = 'Block'
+            if changed_hunks:
+                try:
+                    with self.span('git'):
+                        regions = self.find_changed_hunks()
+                except (PerlTidyAbortedError) as e:
+                    self.show_aborted(str(e))
+                    return
+                kind = 'Hunk'
+            elif self._perltidy_incremental:
+                baseline = self.make_baseline(args)
+                regions = self.find_changed_regions(baseline)
+
+            if regions is None:
+                regions = [sublime.Region(0, self.view.size())]
+                descriptions = [None]
+            elif not regions:
+                if changed_hunks:
+                    sublime.status_message('PerlTidy: Nothing changed relative to git HEAD')
+                elif not on_save:
+                    sublime.status_message('PerlTidy: Nothing changed since last tidy')
+                return
+            else:
+                self.log(1, 'Tidying {0} changed {1}(s) only'.format(len(regions), kind.lower()))
+                descriptions = [self.describe_region(region, i, kind) for i, region in enumerate(regions)]
+
+        # Stream huge views through perltidy in chunks instead of copying
+        # them, see user setting "perltidy_streaming_threshold". Sublime Text
+        # 2 doesn't support reading views from background threads, so tidy
+        # synchronously there. Tidying on save is limited in size by user
+        # setting "perltidy_tidy_on_save_max_size" already.
+        streaming = not on_save and len(regions) == 1 and self.should_stream(regions[0].size())
+
+        # Take a snapshot of everything needed for tidying, so tidying itself
+        # doesn't need to access the Sublime Text API.
+        # When tidying the entire view, rows perltidy did not change are
+        # found using row hashes of the view, kept up to date while editing.
+        # When tidying changed blocks only, the row hashes of the result are
+        # computed from the entire text of the view for the next tidy.
+        whole_view = len(regions) == 1 and regions[0].size() == self.view.size()
+        old_hashes = None
+        text = None
+
+        if streaming:
+            self.log(1, 'Streaming {0} characters through perltidy'.format(regions[0].size()))
+            inputs = [iter_view_chunks(self.view, regions[0], self.view.change_count())]
+            asynchronous = asynchronous and int(sublime.version() or 0) >= 3000
+            baseline = None
+        else:
+            with self.span('snapshot'):
+                inputs = [self.view.substr(region) for region in regions]
+                row_index = get_perltidy_row_index(self.view.buffer_id()) if whole_view else None
+                if row_index is not None and row_index.change_count == self.view.change_count():
+                    old_hashes = row_index.hashes[:]
+                if baseline is not None and not whole_view:
+                    text = self.view.substr(sublime.Region(0, self.view.size()))
+
+        if on_save and asynchronous:
+            budget = self._perltidy_tidy_on_save_budget if not resave else 0
+            self.tidy_in_background(regions, inputs, args, descriptions, map_selection, baseline,
+                                    edit=edit, budget=budget, on_save=True, whole_view=whole_view,
+                                    old_hashes=old_hashes, text=text)
+            return
+
+        if asynchronous:
+            self.tidy_in_background(regions, inputs, args, descriptions, map_selection, baseline, streaming=streaming,
+                                    whole_view=whole_view, old_hashes=old_hashes, text=text)
+            return
+
+        try:
+            outputs, errors = self.tidy_inputs(inputs, args, descriptions)
+        except (PerlTidyAbortedError) as e:
+            self.show_aborted(str(e))
             return
 
-        # Check, if we have any non-empty regions and tidy them.
-        regions_tidied = 0
-        for region in self.view.sel():
-            if not region.empty():
-                regions_tidied += 1
-                self.tidy_region(edit, region)
-
-        # If no regions have been tidied so far, go ahead and tidy entire
-        # view. Reposition cursor after tidying up.
-        if regions_tidied == 0:
-            cursor_pos = self.view.sel()[0]
-            if self.tidy_region(edit, sublime.Region(0, self.view.size())):
-                if cursor_pos.empty():
-                    self.view.sel().add(cursor_pos)
-                    if len(self.view.sel()) > 1:
-                        self.view.sel().subtract(self.view.sel()[1])
-                    self.view.show_at_center(self.view.sel()[0].begin())
-
-    # Build perltidy command to be run, including any options.
-    def build_perltidy_cmd(self):
-        cmd = []
-        cmd.extend(self._perltidy_cmd)
-
-        if not self._perltidy_options_take_precedence:
-            cmd.extend(self._perltidy_options)
-
-        # Check, if we have a perltidyrc in the current project and append to
-        # command.
-        perltidyrc_path = find_perltidyrc_in_project(
-            directories=self.view.window().folders(), perltidyrc_paths=self._perltidy_rc_paths, logger=self)
-        if perltidyrc_path is not None:
-            cmd.append('-pro=' + perltidyrc_path)
-
-        if self._perltidy_options_take_precedence:
-            cmd.extend(self._perltidy_options)
-
-        return cmd
-
-    # Tidy given region; returns True on success or False on perltidy runtime
-    # error.
-    def tidy_region(self, edit, region):
-
-        # Run perltidy.
-        success, output, error_output, error_hints = run_perltidy(
-            cmd=self.build_perltidy_cmd(), input=self.view.substr(region), logger=self)
-
-        if success:
-            self.view.replace(edit, region, output)
-            return True
-
-        if len(error_hints):
+        diffs, row_hashes = None, None
+        if not streaming:
+            with self.span('diff'):
+                diffs, row_hashes = diff_perltidy_outputs(inputs, outputs, whole_view, old_hashes, text,
+                                                          [(region.begin(), region.end()) for region in regions])
+
+        change_count = self.view.change_count()
+        with self.span('apply'):
+            apply_perltidy_outputs(self.view, edit, regions, outputs, map_selection, baseline, streaming,
+                                   diffs, row_hashes, self.get_baseline_dir())
+        self.finish_timer()
+
+        # Save view tidied after coalescing rapid saves.
+        if resave and self.view.change_count() != change_count and self.view.file_name() is not None:
+            _views_resaving.add(self.view.id())
+            try:
+                self.view.run_command('save')
+            finally:
+                _views_resaving.discard(self.view.id())
+
+        self.show_errors(errors, quiet=on_save)
+
+    # Check, whether view should be tidied on save: It must contain Perl code
+    # and must not exceed the size limit. Saves within the debounce interval
+    # after a tidy are coalesced into a single tidy afterwards.
+    def should_tidy_on_save(self):
+        view = self.view
+        view_id = view.id()
+
+        if view.score_selector(0, 'source.perl') <= 0:
+            return False
+
+        if view.size() > self._perltidy_tidy_on_save_max_size:
+            self.log(1, 'Not tidying on save, view exceeds {0} characters'.format(self._perltidy_tidy_on_save_max_size))
+            return False
+
+        delay = self.get_tidy_on_save_delay(_views_tidied_on_save.get(view_id, 0))
+        if delay > 0:
+            if view_id not in _views_pending_tidy_on_save:
+                _views_pending_tidy_on_save.add(view_id)
+
+                def tidy_later():
+                    _views_pending_tidy_on_save.discard(view_id)
+                    view.run_command('perl_tidy', {'on_save': True, 'resave': True})
+
+                sublime.set_timeout(tidy_later, delay)
+            return False
+
+        _views_tidied_on_save[view_id] = time.time()
+        return True
+
+    # Tidy given regions in background thread and apply results afterwards,
+    # unless view has been modified in the meantime. Background tidies of all
+    # views are run by the process-wide scheduler, limiting the number of
+    # concurrent tidies, superseding tidies still queued for the same view and
+    # preferring the focused view, see get_scheduler(). If "budget" is given,
+    # wait for the results up to "budget" seconds and apply them right away
+    # using "edit", if they are ready in time. If "on_save" is True, views are
+    # saved again after applying late results, and errors are reported in the
+    # status bar only. If "streaming" is True, inputs are streamed from the
+    # view, see apply_perltidy_outputs(). Outputs are diffed against inputs in
+    # background as well, see diff_perltidy_outputs() for "whole_view" and
+    # "old_hashes".
+    def tidy_in_background(self, regions, inputs, args, descriptions, map_selection, baseline=None,
+                           edit=None, budget=None, on_save=False, streaming=False, whole_view=False,
+                           old_hashes=None, text=None):
+        view = self.view
+        offsets = [(region.begin(), region.end()) for region in regions]
+        baseline_dir = self.get_baseline_dir()
+        change_count = view.change_count()
+        spinner = PerlTidyStatusSpinner(view)
+        state = {'late': budget is None or budget <= 0, 'result': None}
+        state_lock = threading.Lock()
+        done = threading.Event()
+        scheduler = self.get_scheduler()
+
+        # The job works on a copy of this command, as tidying this view again
+        # reloads settings and restarts the timer, while the job may still be
+        # running. Use as many perltidy workers as tidies may run concurrently.
+        job = copy.copy(self)
+        job.max_workers = scheduler.get_concurrency()
+
+        def finish(outputs, errors, diffs, row_hashes):
+            _views_in_progress.discard(view.id())
+
+            _applied_change_counts.pop(view.id(), None)
+            if [output for output in outputs if output is not None]:
+                _pending_results[view.id()] = (outputs, diffs, row_hashes)
+                with job.span('apply'):
+                    view.run_command('perl_tidy_apply', {
+                        'change_count': change_count,
+                        'regions': [[region.a, region.b] for region in regions],
+                        'map_selection': map_selection,
+                        'baseline': baseline,
+                        'baseline_dir': baseline_dir,
+                        'streaming': streaming,
+                    })
+            else:
+                track_failed_regions(view, regions, outputs)
+            job.finish_timer()
+
+            # Save tidied view, unless results have been discarded or the view
+            # has been modified otherwise since.
+            applied_change_count = _applied_change_counts.pop(view.id(), None)
+            if on_save and applied_change_count not in (None, change_count) and \
+                    view.change_count() == applied_change_count and view.file_name() is not None:
+                _views_resaving.add(view.id())
+                try:
+                    view.run_command('save')
+                finally:
+                    _views_resaving.discard(view.id())
+
+            job.show_errors(errors, quiet=on_save)
+
+        def tidy():
+            diffs, row_hashes = None, None
+            try:
+                outputs, errors = job.tidy_inputs(inputs, args, descriptions)
+                if not streaming:
+                    with job.span('diff'):
+                        diffs, row_hashes = diff_perltidy_outputs(inputs, outputs, whole_view, old_hashes, text,
+                                                                  offsets)
+            except (PerlTidyAbortedError) as e:
+                message = str(e)
+                sublime.set_timeout(lambda: job.show_aborted(message), 0)
+                outputs, errors = [None] * len(inputs), []
+            except (Exception) as e:
+                job.log(0, 'Unable to tidy in background: ' + repr(e))
+                outputs, errors = [None] * len(inputs), []
+            finally:
+                spinner.stop()
+
+            with state_lock:
+                state['result'] = (outputs, errors, diffs, row_hashes)
+                late = state['late']
+            done.set()
+
+            if late:
+                sublime.set_timeout(lambda: finish(outputs, errors, diffs, row_hashes), 0)
+
+        # The view stays in progress, if superseded by another tidy.
+        def superseded():
+            spinner.stop()
+
+        _views_in_progress.add(view.id())
+        spinner.start()
+
+        window = sublime.active_window()
+        focused = window is not None and window.active_view() is not None and window.active_view().id() == view.id()
+        if not scheduler.submit(view.id(), tidy, priority=1 if focused else 0, on_superseded=superseded):
+            _views_in_progress.discard(view.id())
+            spinner.stop()
+            sublime.status_message('PerlTidy: Too many tidies queued, see user setting '
+                                   '"perltidy_scheduler_max_queued"')
+            return
+
+        if state['late']:
+            return
+
+        # Wait for results within budget, otherwise apply them afterwards.
+        done.wait(budget)
+        with state_lock:
+            if state['result'] is None:
+                state['late'] = True
+                job.log(1, 'Tidying exceeds budget of {0}s, applying results afterwards'.format(budget))
+                return
+            outputs, errors, diffs, row_hashes = state['result']
+
+        _views_in_progress.discard(view.id())
+        with job.span('apply'):
+            apply_perltidy_outputs(view, edit, regions, outputs, map_selection, baseline, diffs=diffs,
+                                   row_hashes=row_hashes, baseline_dir=baseline_dir)
+        job.finish_timer()
+        job.show_errors(errors, quiet=on_save)
+
+    # Return perltidy configuration given perltidy arguments stand for, as
+    # passed to set_perltidy_baseline(). Row hashes remembered for incremental
+    # tidying are only valid for the same arguments, perltidyrc contents and
+    # perltidy version.
+    def make_baseline(self, args):
+        return {
+            'args': args,
+            'perltidyrc_fingerprint': get_perltidyrc_fingerprint(get_perltidyrc_paths_from_args(args)),
+            'perltidy_version': self.get_capabilities().version,
+        }
+
+    # Return regions of top-level blocks changed since the last tidy using
+    # given configuration (see make_baseline()), or None, if the view has not
+    # been tidied like this yet. Row hashes remembered for the view's file on
+    # disk are loaded on first use, so reopened files are tidied
+    # incrementally as well.
+    def find_changed_regions(self, baseline):
+        old = get_perltidy_baseline(self.view.id(), baseline['args'], baseline['perltidyrc_fingerprint'],
+                                    baseline['perltidy_version'])
+        file_name = self.view.file_name()
+        baseline_dir = self.get_baseline_dir()
+        if old is None and file_name is not None and baseline_dir is not None:
+            if load_perltidy_baseline(self.view.id(), file_name, baseline_dir, logger=self):
+                old = get_perltidy_baseline(self.view.id(), baseline['args'], baseline['perltidyrc_fingerprint'],
+                                            baseline['perltidy_version'])
+        if old is None:
+            return None
+
+        new = self.view.substr(sublime.Region(0, self.view.size()))
+        return [sublime.Region(begin, end) for begin, end in find_changed_blocks(old, new)]
+
+    # Return regions of top-level statements changed relative to git HEAD, or
+    # None, if the view's file is not tracked by git, so the entire view
+    # should be tidied. Raises PerlTidyAbortedError, if git has been stopped
+    # on timeout or cancellation.
+    def find_changed_hunks(self):
+        file_name = self.view.file_name()
+        if file_name is None:
+            return None
+
+        old = get_git_head_text(file_name, git_cmd=self._perltidy_git_cmd, logger=self)
+        if old is None:
+            self.log(1, 'Not tracked by git, tidying entire view')
+            return None
+
+        new = self.view.substr(sublime.Region(0, self.view.size()))
+        return [sublime.Region(begin, end) for begin, end in find_changed_blocks(old, new, find_top_level_statements)]
+
+    # Return human readable description of given region for error messages.
+    def describe_region(self, region, index, kind='Selection'):
+        first_row = self.view.rowcol(region.begin())[0] + 1
+        last_row = self.view.rowcol(region.end())[0] + 1
+        return '{0} {1} (lines {2}-{3})'.format(kind, index + 1, first_row, last_row)
+
+    # Report perltidy run stopped on timeout or cancellation.
+    def show_aborted(self, message):
+        self.log(0, 'Unable to tidy, ' + message)
+        sublime.status_message('PerlTidy: Unable to tidy, ' + message)
+
+    # Report errors given as list of tuples (description, error_output,
+    # error_hints). Description may be None, if tidying the entire view.
+    # Problems reported by perltidy are annotated in the view, unless disabled
+    # via user setting "perltidy_error_annotations", and error output is shown
+    # in an output panel reused across runs. If "quiet" is True, error output
+    # is only logged to the console instead. Without errors, annotations of
+    # previous runs are removed.
+    def show_errors(self, errors, quiet=False):
+        failed_regions = self.view.get_regions('perltidy_failed')
+        self.view.erase_regions('perltidy_failed')
+
+        if not errors:
+            clear_perltidy_diagnostics(self.view)
+            return
+
+        error_outputs = []
+        sources = []
+
+        for index, (description, error_output, error_hints) in enumerate(errors):
             for hint in error_hints:
                 self.log(0, hint)
 
-        if error_output:
-            error_output_view = self.view.window().new_file()
-            error_output_view.set_scratch(True)
-            error_output_view.set_name('PerlTidy: Error output')
-            error_output_view.run_command('perl_tidy_error_output', {'output': error_output})
+            # Errors correspond to regions, which could not be tidied.
+            if error_output and len(failed_regions) == len(errors):
+                sources.append((failed_regions[index], error_output))
+
+            if description is not None:
+                self.log(0, 'Unable to tidy ' + description)
+                if error_output:
+                    error_output = description + ':\n' + error_output
+
+            if error_output:
+                error_outputs.append(error_output)
+
+        if self._perltidy_error_annotations:
+            PerlTidyDiagnosticsReporter(self.view, sources).start()
+        else:
+            clear_perltidy_diagnostics(self.view)
+
+        if quiet:
+            for error_output in error_outputs:
+                self.log(0, error_output)
+            sublime.status_message('PerlTidy: Unable to tidy, see console for details')
+        elif error_outputs:
+            self.show_error_panel('\n'.join(error_outputs))
         else:
             sublime.error_message(
                 'PerlTidy: Unable to run perltidy. Please inspect console (hit Ctrl+` ' +
                 'or select View->Show Console from menu) for detailed diagnostic ' +
                 'messages, error output and hints.')
 
-        return False
+    # Show error output in output panel.
+    def show_error_panel(self, output):
+        window = self.view.window()
+        if hasattr(window, 'create_output_panel'):
+            panel = window.create_output_panel('perltidy_errors')
+        else:
+            panel = window.get_output_panel('perltidy_errors')
+
+        panel.run_command('perl_tidy_error_output', {'output': output})
+        window.run_command('show_panel', {'panel': 'output.perltidy_errors'})
+
+
+class PerlTidyApplyCommand(sublime_plugin.TextCommand):
+
+    """Apply results of a background perltidy run to the view."""
+
+    def run(self, edit, change_count, regions, map_selection=False, baseline=None, streaming=False,
+            baseline_dir=None):
+        outputs, diffs, row_hashes = _pending_results.pop(self.view.id(), ([None] * len(regions), None, None))
+
+        # Throw away stale results, if view has been modified, while perltidy
+        # was running.
+        regions = [sublime.Region(a, b) for a, b in regions]
+        if self.view.change_count() != change_count:
+            sublime.status_message('PerlTidy: View modified while tidying, result discarded')
+            track_failed_regions(self.view, regions, outputs)
+            return
+
+        apply_perltidy_outputs(self.view, edit, regions, outputs, map_selection, baseline, streaming, diffs, row_hashes,
+                               baseline_dir)
+        _applied_change_counts[self.view.id()] = self.view.change_count()
+
+
+# Sublime Text 2 doesn't call plugin_loaded().
+if int(sublime.version() or 0) < 3000:
+    plugin_loaded()
@@ -7,10 +7,10 @@ import sublime_plugin
 
 class PerlTidyErrorOutputCommand(sublime_plugin.TextCommand):
 
-    """Write error messages to PerlTidy error output buffer."""
+    """Write error messages to PerlTidy error output buffer, replacing previous ones."""
 
     def run(self, edit, output=''):
         final_output = "PerlTidy: Errors reported by perltidy during last run\n"
         final_output += "=====================================================\n"
         final_output += output
-        self.view.insert(edit, self.view.size(), final_output)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), final_output)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import sublime_plugin
+
+try:
+    from .perltidy.base import *
+    from .PerlTidyCommand import clear_perltidy_diagnostics
+    from .perltidy.incremental import clear_perltidy_baseline
+    from .perltidy.linehash import clear_perltidy_row_index, get_perltidy_row_index, hash_row
+    from .perltidy.perltidyrc import clear_perltidyrc_cache
+except (Exception) as e:
+    from perltidy.base import *
+    from PerlTidyCommand import clear_perltidy_diagnostics
+    from perltidy.incremental import clear_perltidy_baseline
+    from perltidy.linehash import clear_perltidy_row_index, get_perltidy_row_index, hash_row
+    from perltidy.perltidyrc import clear_perltidyrc_cache
+
+
+# Update row index of given view, if any, with given changes. Each change is a
+# tuple (begin, end, rows), replacing rows "begin" up to and including "end"
+# by "rows" + 1 rows, which are hashed from the view afterwards. Indexes, which
+# cannot be updated, are dropped.
+def update_row_index(view, changes):
+    index = get_perltidy_row_index(view.buffer_id())
+    if index is None or index.change_count == view.change_count():
+        return
+
+    # Ranges (first, last) of rows to be hashed, shifted by later changes.
+    modified = []
+    for begin, end, rows in changes:
+        if begin < 0 or end >= len(index.hashes):
+            clear_perltidy_row_index(view.buffer_id())
+            return
+
+        delta = rows - (end - begin)
+        shifted = []
+        for first, last in modified:
+            if first < begin:
+                shifted.append((first, min(last, begin - 1)))
+            if last > end:
+                shifted.append((max(first, end + 1) + delta, last + delta))
+        modified = shifted + [(begin, begin + rows)]
+        index.replace_rows(begin, end, [0] * (rows + 1))
+
+    if len(index.hashes) != view.rowcol(view.size())[0] + 1:
+        clear_perltidy_row_index(view.buffer_id())
+        return
+
+    for first, last in modified:
+        for row in range(first, last + 1):
+            index.hashes[row] = hash_row(view.substr(view.line(view.text_point(row, 0))))
+
+    index.change_count = view.change_count()
+
+
+# Guess changes made to given view from its only caret and the change of its
+# number of rows, i.e. for typing, pasting and deleting text. Returns list of
+# changes for update_row_index(), or None, if no guess can be made.
+def guess_row_changes(view, index):
+    selection = view.sel()
+    if len(selection) != 1 or not selection[0].empty():
+        return None
+
+    row = view.rowcol(selection[0].b)[0]
+    delta = view.rowcol(view.size())[0] + 1 - len(index.hashes)
+    if delta >= 0:
+        return [(row - delta, row - delta, delta)]
+    return [(row, row - delta, 0)]
+
+
+class PerlTidyEventListener(sublime_plugin.EventListener):
+
+    """Keeps PerlTidy's caches up to date with changes made within Sublime Text."""
+
+    # Tidy Perl views before saving, if enabled.
+    def on_pre_save(self, view):
+        settings = view.settings()
+        if settings.get('perltidy_tidy_on_save', DEFAULT_SETTINGS['perltidy_tidy_on_save']) and \
+                settings.get('perltidy_enabled', DEFAULT_SETTINGS['perltidy_enabled']):
+            view.run_command('perl_tidy', {'on_save': True})
+
+    # Drop cached perltidyrc resolutions, whenever a perltidyrc is saved, so
+    # newly created perltidyrc files are picked up immediately.
+    def on_post_save(self, view):
+        file_name = view.file_name()
+        if file_name is None:
+            return
+
+        perltidyrc_paths = view.settings().get('perltidy_rc_paths', DEFAULT_SETTINGS['perltidy_rc_paths'])
+        if os.path.basename(file_name) in [os.path.basename(p) for p in perltidyrc_paths or []]:
+            clear_perltidyrc_cache()
+
+    # Update row index of modified view (Sublime Text 2/3, see
+    # PerlTidyRowIndexListener for Sublime Text 4). As details about changes
+    # are not available, changes are guessed. Wrong guesses are harmless, as
+    # rows skipped based on row hashes are verified before being skipped.
+    def on_modified(self, view):
+        if hasattr(sublime_plugin, 'TextChangeListener'):
+            return
+
+        index = get_perltidy_row_index(view.buffer_id())
+        if index is None or index.change_count == view.change_count():
+            return
+
+        changes = guess_row_changes(view, index)
+        if changes is None:
+            clear_perltidy_row_index(view.buffer_id())
+        else:
+            update_row_index(view, changes)
+
+    # Tidy views gaining focus first, if their tidy is still queued.
+    def on_activated(self, view):
+        get_perltidy_scheduler().promote(view.id())
+
+    # Forget text remembered for incremental tidying and diagnostics of closed
+    # views.
+    def on_close(self, view):
+        clear_perltidy_baseline(view.id())
+        clear_perltidy_diagnostics(view)
+        clear_perltidy_row_index(view.buffer_id())
+
+
+if hasattr(sublime_plugin, 'TextChangeListener'):
+    class PerlTidyRowIndexListener(sublime_plugin.TextChangeListener):
+
+        """Keeps row indexes up to date with changes of buffers (Sublime Text 4 only)."""
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            return True
+
+        def on_text_changed(self, changes):
+            view = self.buffer.primary_view()
+            if view is not None:
+                update_row_index(view, [(change.a.row, change.b.row, change.str.count('\n')) for change in changes])
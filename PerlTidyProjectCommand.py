@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import multiprocessing
+import os
+import sublime
+import sublime_plugin
+import threading
+
+try:
+    from .perltidy.base import *
+    from .perltidy.project import PerlTidyFileResult, find_perl_files, tidy_files
+except (Exception) as e:
+    from perltidy.base import *
+    from perltidy.project import PerlTidyFileResult, find_perl_files, tidy_files
+
+
+class PerlTidyProjectCommand(PerlTidyBase, sublime_plugin.WindowCommand):
+
+    """Tidy all Perl files within the project folders of a window."""
+
+    # Return settings of active view (which include project settings), or
+    # global preferences, if there is no active view.
+    def get_settings(self):
+        view = self.window.active_view()
+        if view is not None:
+            return view.settings()
+        return sublime.load_settings('Preferences.sublime-settings')
+
+    # Return folders of window.
+    def get_folders(self):
+        return self.window.folders()
+
+    # Enable command only, if we have any project folders.
+    def is_enabled(self, dry_run=False):
+        return len(self.window.folders()) > 0 and \
+            self.get_settings().get('perltidy_enabled', DEFAULT_SETTINGS['perltidy_enabled'])
+
+    # Return output panel for results, creating it if necessary.
+    def get_output_panel(self):
+        if hasattr(self.window, 'create_output_panel'):
+            panel = self.window.create_output_panel('perltidy_project')
+        else:
+            panel = self.window.get_output_panel('perltidy_project')
+
+        self.window.run_command('show_panel', {'panel': 'output.perltidy_project'})
+        return panel
+
+    # Main entry point for Sublime Text. If "dry_run" is True, files will not
+    # be modified, but only listed, if they would change.
+    def run(self, dry_run=False):
+        self.load_settings()
+
+        # Bailout, if we don't have a valid perltidy command to run.
+        if not self.find_perltidy():
+            sublime.error_message(PERLTIDY_NOT_FOUND_MESSAGE)
+            return
+
+        settings = self.get_settings()
+        jobs = settings.get('perltidy_project_jobs', DEFAULT_SETTINGS['perltidy_project_jobs'])
+        extensions = settings.get('perltidy_project_extensions', DEFAULT_SETTINGS['perltidy_project_extensions'])
+        exclude_dirs = settings.get('perltidy_project_exclude_dirs', DEFAULT_SETTINGS['perltidy_project_exclude_dirs'])
+
+        if not jobs or jobs < 1:
+            try:
+                jobs = multiprocessing.cpu_count()
+            except (NotImplementedError) as e:
+                jobs = 1
+        self.max_workers = jobs
+
+        # Never touch files with unsaved modifications.
+        modified_files = set([os.path.realpath(view.file_name()) for view in self.window.views()
+                              if view.is_dirty() and view.file_name() is not None])
+
+        panel = self.get_output_panel()
+        folders = self.window.folders()
+        counts = {'done': 0}
+        counts_lock = threading.Lock()
+
+        def output(text):
+            sublime.set_timeout(lambda: panel.run_command(
+                'append', {'characters': text, 'force': True, 'scroll_to_end': True}), 0)
+
+        # Stop tidying further files, once cancelled via "PerlTidy: Cancel".
+        cancellations = get_perltidy_cancellations()
+
+        def tidy(path, input):
+            if get_perltidy_cancellations() != cancellations:
+                raise PerlTidyAbortedError('perltidy has been cancelled', PerlTidyAbortedError.CANCELLED)
+            return self.tidy_text(input, self.build_perltidy_args(file_name=path))
+
+        def report(result):
+            with counts_lock:
+                counts['done'] += 1
+                done = counts['done']
+
+            if result.status == PerlTidyFileResult.CHANGED:
+                output('{0}: {1}\n'.format('Would change' if dry_run else 'Changed', result.path))
+            elif result.status == PerlTidyFileResult.FAILED:
+                output('Failed: {0}\n    {1}\n'.format(result.path, result.message.replace('\n', '\n    ')))
+
+            if done % 20 == 0:
+                sublime.set_timeout(lambda: sublime.status_message(
+                    'PerlTidy: {0} files tidied'.format(done)), 0)
+
+        def find_files():
+            for path in find_perl_files(folders, extensions, exclude_dirs):
+                if os.path.realpath(path) in modified_files:
+                    output('Skipped (unsaved modifications): {0}\n'.format(path))
+                else:
+                    yield path
+
+        def work():
+            files = find_files()
+            summary = tidy_files(files, tidy, jobs=jobs, dry_run=dry_run, callback=report)
+            output('\n' + summary.format(dry_run=dry_run) + '\n')
+            self.log(1, summary.format(dry_run=dry_run))
+            sublime.set_timeout(lambda: sublime.status_message('PerlTidy: ' + summary.format(dry_run=dry_run)), 0)
+
+        output('PerlTidy: {0} project using {1} jobs{2}\n\n'.format(
+            'Checking' if dry_run else 'Tidying', jobs, ' (dry run)' if dry_run else ''))
+
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
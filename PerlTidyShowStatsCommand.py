@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import sublime
+import sublime_plugin
+
+try:
+    from .perltidy.base import *
+except (Exception) as e:
+    from perltidy.base import *
+
+
+class PerlTidyShowStatsCommand(sublime_plugin.WindowCommand):
+
+    """Show rolling timing statistics of recent tidy runs per stage and scheduler statistics."""
+
+    def run(self):
+        if hasattr(self.window, 'create_output_panel'):
+            panel = self.window.create_output_panel('perltidy_stats')
+        else:
+            panel = self.window.get_output_panel('perltidy_stats')
+
+        output = 'PerlTidy: Performance statistics of the last {0} runs\n\n'.format(PERLTIDY_TIMING_SAMPLES)
+        output += format_perltidy_timing_stats()
+        output += '\nBackground tidies: ' + get_perltidy_scheduler().format_stats()
+
+        view = self.window.active_view()
+        settings = view.settings() if view is not None else sublime.load_settings('Preferences.sublime-settings')
+        if not settings.get('perltidy_timings_enabled', DEFAULT_SETTINGS['perltidy_timings_enabled']):
+            output += '\nTimings are disabled, see user setting "perltidy_timings_enabled".\n'
+
+        panel.run_command('append', {'characters': output, 'force': True, 'scroll_to_end': False})
+        self.window.run_command('show_panel', {'panel': 'output.perltidy_stats'})
@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import math
+import os
+import sublime
+import threading
+import time
+
+from .capabilities import get_perltidy_capabilities
+from .cache import get_perltidy_fingerprint_index, get_perltidy_result_cache, make_perltidy_cache_key
+from .diff import split_lines
+from .helpers import *
+from .incremental import is_top_level_perl_code
+from .perltidyrc import get_effective_perltidy_args, resolve_perltidyrc
+from .worker import get_perltidy_worker_pool, run_perltidy_in_worker
+
+
+DEFAULT_SETTINGS = {
+    'perltidy_async': False,
+    'perltidy_cache_enabled': True,
+    'perltidy_cache_max_disk_size': 64 * 1024 * 1024,
+    'perltidy_cache_max_size': 16 * 1024 * 1024,
+    'perltidy_cache_persistent': False,
+    'perltidy_cpu_limit': 0,
+    'perltidy_enabled': True,
+    'perltidy_error_annotations': True,
+    'perltidy_fingerprints_enabled': True,
+    'perltidy_fingerprints_max_entries': 10000,
+    'perltidy_git_cmd': 'git',
+    'perltidy_incremental': False,
+    'perltidy_incremental_persistent': True,
+    'perltidy_log_level': 0,
+    'perltidy_memory_limit': 0,
+    'perltidy_normalize_options': False,
+    'perltidy_options': ['-pbp'],
+    'perltidy_options_take_precedence': False,
+    'perltidy_project_exclude_dirs': ['.git', '.hg', '.svn', '_build', 'blib', 'local', 'node_modules'],
+    'perltidy_project_extensions': ['.pl', '.pm', '.t', '.cgi', '.psgi', '.PL'],
+    'perltidy_project_jobs': 0,
+    'perltidy_rc_paths': ['.perltidyrc', 'perltidyrc'],
+    'perltidy_scheduler_concurrency': 0,
+    'perltidy_scheduler_max_queued': PERLTIDY_SCHEDULER_MAX_QUEUED,
+    'perltidy_streaming_threshold': 16 * 1024 * 1024,
+    'perltidy_tidy_on_save': False,
+    'perltidy_tidy_on_save_budget': 0.5,
+    'perltidy_tidy_on_save_debounce': 2.0,
+    'perltidy_tidy_on_save_max_size': 1024 * 1024,
+    'perltidy_timeout': 30,
+    'perltidy_timings_enabled': True,
+    'perltidy_timings_log_level': 1,
+    'perltidy_worker_enabled': True,
+    'perltidy_worker_idle_timeout': 300,
+    'perltidy_worker_pool_size': 1,
+    'perltidy_worker_prewarm': False,
+}
+
+
+PERLTIDY_NOT_FOUND_MESSAGE = (
+    'PerlTidy: Cannot find perltidy in any directory given in environment variable ' +
+    'PATH, nor in platform specific default locations. Please setup your environment ' +
+    'variable PATH, so it contains perltidy, or specify perltidy location in user ' +
+    'setting "perltidy_cmd". Please refer to documentation at ' +
+    'https://github.com/vifo/SublimePerlTidy for details.')
+
+
+# Discovered perltidy commands, keyed by user setting "perltidy_cmd" and PATH.
+_perltidy_cmds = {}
+
+
+# Drop all discovered perltidy commands, e.g. when settings change.
+def clear_perltidy_cmd_cache():
+    """Drops all perltidy commands memoized by PerlTidyBase.find_perltidy()."""
+
+    _perltidy_cmds.clear()
+
+
+class PerlTidyBase(object):
+
+    """Settings, perltidy discovery and tidying shared by all PerlTidy commands.
+
+    Subclasses must implement get_settings(), returning an object providing
+    get(key, default) for PerlTidy settings, and get_folders(), returning the
+    list of project folders used for locating perltidyrc files.
+    """
+
+    # Maximum number of perltidy workers used concurrently.
+    max_workers = 1
+
+    _perltidy_async = None
+    _perltidy_cache_enabled = None
+    _perltidy_cache_max_disk_size = None
+    _perltidy_cache_max_size = None
+    _perltidy_cache_persistent = None
+    _perltidy_cmd = None
+    _perltidy_cpu_limit = None
+    _perltidy_error_annotations = None
+    _perltidy_fingerprints_enabled = None
+    _perltidy_fingerprints_max_entries = None
+    _perltidy_folders = None
+    _perltidy_git_cmd = None
+    _perltidy_incremental = None
+    _perltidy_incremental_persistent = None
+    _perltidy_log_level = None
+    _perltidy_memory_limit = None
+    _perltidy_normalize_options = None
+    _perltidy_options = None
+    _perltidy_options_take_precedence = None
+    _perltidy_rc_paths = None
+    _perltidy_scheduler_concurrency = None
+    _perltidy_scheduler_max_queued = None
+    _perltidy_streaming_threshold = None
+    _perltidy_tidy_on_save_budget = None
+    _perltidy_tidy_on_save_debounce = None
+    _perltidy_tidy_on_save_max_size = None
+    _perltidy_timeout = None
+    _perltidy_timer = PerlTidyNullTimer()
+    _perltidy_timings_enabled = None
+    _perltidy_timings_log_level = None
+    _perltidy_worker_enabled = None
+    _perltidy_worker_idle_timeout = None
+    _perltidy_worker_pool_size = None
+    _perltidy_worker_prewarm = None
+
+    # Return settings object used for looking up PerlTidy settings.
+    def get_settings(self):
+        raise NotImplementedError()
+
+    # Return project folders.
+    def get_folders(self):
+        raise NotImplementedError()
+
+    # Try to locate perltidy and set self._perltidy_cmd.
+    def find_perltidy(self):
+
+        # Determine perltidy command to run in the following order:
+        # 1. From user setting "perltidy_cmd"
+        # 2. Within PATH (search for "perltidy" or "perltidy.bat" on Windows)
+        # 3. From platform specific defaults
+        #
+        # Discovered commands are memoized process-wide, keyed by user
+        # setting "perltidy_cmd" and PATH, and reused, as long as the perltidy
+        # executable still exists.
+        if self._perltidy_cmd is None:
+            setting = self.get_settings().get('perltidy_cmd')
+            key = (repr(setting), os.environ.get('PATH', ''))
+
+            cmd = _perltidy_cmds.get(key)
+            if cmd is not None:
+                if os.path.exists(cmd[0]):
+                    self.log(2, 'Using previously found perltidy: ' + pp(cmd))
+                    self._perltidy_cmd = cmd
+                    return cmd
+                del _perltidy_cmds[key]
+
+            try:
+                # 1. From user setting "perltidy_cmd", this may be either a
+                #    single string or a list, handle appropriately.
+                cmd = setting
+                if cmd is not None and type(cmd) is not list:
+                    cmd = [cmd]
+
+                if is_valid_perltidy_cmd(cmd, cmd_source='user', logger=self):
+                    raise StopIteration()
+
+                # 2. Within PATH (search for "perltidy" or "perltidy.bat" on
+                # Windows)
+                cmd = find_perltidy_in_path(logger=self)
+                if cmd is not None:
+                    raise StopIteration()
+
+                # 3. From platform specific defaults
+                cmd = find_perltidy_in_platform_default_paths(logger=self)
+                if cmd is not None:
+                    raise StopIteration()
+
+            except (StopIteration):
+                # Save command for later usage
+                self.log(1, 'Using perltidy: ' + pp(cmd))
+                self._perltidy_cmd = cmd
+                _perltidy_cmds[key] = cmd
+            else:
+                pass
+
+        return self._perltidy_cmd
+
+    # Load PerlTidy settings from Sublime preferences.
+    def load_settings(self, reload=True):
+        settings = self.get_settings()
+
+        if reload or self._perltidy_async is None:
+            self._perltidy_async = settings.get('perltidy_async', DEFAULT_SETTINGS['perltidy_async'])
+        if reload or self._perltidy_cache_enabled is None:
+            self._perltidy_cache_enabled = settings.get(
+                'perltidy_cache_enabled', DEFAULT_SETTINGS['perltidy_cache_enabled'])
+        if reload or self._perltidy_cache_max_disk_size is None:
+            self._perltidy_cache_max_disk_size = settings.get(
+                'perltidy_cache_max_disk_size', DEFAULT_SETTINGS['perltidy_cache_max_disk_size'])
+        if reload or self._perltidy_cache_max_size is None:
+            self._perltidy_cache_max_size = settings.get(
+                'perltidy_cache_max_size', DEFAULT_SETTINGS['perltidy_cache_max_size'])
+        if reload or self._perltidy_cache_persistent is None:
+            self._perltidy_cache_persistent = settings.get(
+                'perltidy_cache_persistent', DEFAULT_SETTINGS['perltidy_cache_persistent'])
+        if reload or self._perltidy_cpu_limit is None:
+            self._perltidy_cpu_limit = settings.get('perltidy_cpu_limit', DEFAULT_SETTINGS['perltidy_cpu_limit'])
+        if reload or self._perltidy_error_annotations is None:
+            self._perltidy_error_annotations = settings.get(
+                'perltidy_error_annotations', DEFAULT_SETTINGS['perltidy_error_annotations'])
+        if reload or self._perltidy_fingerprints_enabled is None:
+            self._perltidy_fingerprints_enabled = settings.get(
+                'perltidy_fingerprints_enabled', DEFAULT_SETTINGS['perltidy_fingerprints_enabled'])
+        if reload or self._perltidy_fingerprints_max_entries is None:
+            self._perltidy_fingerprints_max_entries = settings.get(
+                'perltidy_fingerprints_max_entries', DEFAULT_SETTINGS['perltidy_fingerprints_max_entries'])
+        if reload or self._perltidy_git_cmd is None:
+            self._perltidy_git_cmd = settings.get('perltidy_git_cmd', DEFAULT_SETTINGS['perltidy_git_cmd'])
+        if reload or self._perltidy_incremental is None:
+            self._perltidy_incremental = settings.get(
+                'perltidy_incremental', DEFAULT_SETTINGS['perltidy_incremental'])
+        if reload or self._perltidy_incremental_persistent is None:
+            self._perltidy_incremental_persistent = settings.get(
+                'perltidy_incremental_persistent', DEFAULT_SETTINGS['perltidy_incremental_persistent'])
+        if reload or self._perltidy_log_level is None:
+            self._perltidy_log_level = settings.get('perltidy_log_level', DEFAULT_SETTINGS['perltidy_log_level'])
+        if reload or self._perltidy_memory_limit is None:
+            self._perltidy_memory_limit = settings.get(
+                'perltidy_memory_limit', DEFAULT_SETTINGS['perltidy_memory_limit'])
+        if reload or self._perltidy_normalize_options is None:
+            self._perltidy_normalize_options = settings.get(
+                'perltidy_normalize_options', DEFAULT_SETTINGS['perltidy_normalize_options'])
+        if reload or self._perltidy_options is None:
+            self._perltidy_options = settings.get('perltidy_options', DEFAULT_SETTINGS['perltidy_options'])
+        if reload or self._perltidy_options_take_precedence is None:
+            self._perltidy_options_take_precedence = settings.get(
+                'perltidy_options_take_precedence', DEFAULT_SETTINGS['perltidy_options_take_precedence'])
+        if reload or self._perltidy_rc_paths is None:
+            self._perltidy_rc_paths = settings.get('perltidy_rc_paths', DEFAULT_SETTINGS['perltidy_rc_paths'])
+        if reload or self._perltidy_scheduler_concurrency is None:
+            self._perltidy_scheduler_concurrency = settings.get(
+                'perltidy_scheduler_concurrency', DEFAULT_SETTINGS['perltidy_scheduler_concurrency'])
+        if reload or self._perltidy_scheduler_max_queued is None:
+            self._perltidy_scheduler_max_queued = settings.get(
+                'perltidy_scheduler_max_queued', DEFAULT_SETTINGS['perltidy_scheduler_max_queued'])
+        if reload or self._perltidy_streaming_threshold is None:
+            self._perltidy_streaming_threshold = settings.get(
+                'perltidy_streaming_threshold', DEFAULT_SETTINGS['perltidy_streaming_threshold'])
+        if reload or self._perltidy_tidy_on_save_budget is None:
+            self._perltidy_tidy_on_save_budget = settings.get(
+                'perltidy_tidy_on_save_budget', DEFAULT_SETTINGS['perltidy_tidy_on_save_budget'])
+        if reload or self._perltidy_tidy_on_save_debounce is None:
+            self._perltidy_tidy_on_save_debounce = settings.get(
+                'perltidy_tidy_on_save_debounce', DEFAULT_SETTINGS['perltidy_tidy_on_save_debounce'])
+        if reload or self._perltidy_tidy_on_save_max_size is None:
+            self._perltidy_tidy_on_save_max_size = settings.get(
+                'perltidy_tidy_on_save_max_size', DEFAULT_SETTINGS['perltidy_tidy_on_save_max_size'])
+        if reload or self._perltidy_timeout is None:
+            self._perltidy_timeout = settings.get('perltidy_timeout', DEFAULT_SETTINGS['perltidy_timeout'])
+        if reload or self._perltidy_timings_enabled is None:
+            self._perltidy_timings_enabled = settings.get(
+                'perltidy_timings_enabled', DEFAULT_SETTINGS['perltidy_timings_enabled'])
+        if reload or self._perltidy_timings_log_level is None:
+            self._perltidy_timings_log_level = settings.get(
+                'perltidy_timings_log_level', DEFAULT_SETTINGS['perltidy_timings_log_level'])
+        if reload or self._perltidy_worker_enabled is None:
+            self._perltidy_worker_enabled = settings.get(
+                'perltidy_worker_enabled', DEFAULT_SETTINGS['perltidy_worker_enabled'])
+        if reload or self._perltidy_worker_idle_timeout is None:
+            self._perltidy_worker_idle_timeout = settings.get(
+                'perltidy_worker_idle_timeout', DEFAULT_SETTINGS['perltidy_worker_idle_timeout'])
+        if reload or self._perltidy_worker_pool_size is None:
+            self._perltidy_worker_pool_size = settings.get(
+                'perltidy_worker_pool_size', DEFAULT_SETTINGS['perltidy_worker_pool_size'])
+        if reload or self._perltidy_worker_prewarm is None:
+            self._perltidy_worker_prewarm = settings.get(
+                'perltidy_worker_prewarm', DEFAULT_SETTINGS['perltidy_worker_prewarm'])
+        if reload or self._perltidy_folders is None:
+            self._perltidy_folders = self.get_folders()
+        if reload and self._perltidy_cmd is not None:
+            self._perltidy_cmd = None           # will be set by find_perltidy()
+
+    # Simple logging.
+    def log(self, level, message):
+        if level <= self._perltidy_log_level:
+            print('PerlTidy: {0}'.format(message))
+
+    # Return current log level.
+    def log_level(self):
+        return self._perltidy_log_level
+
+    # Start timing stages of a new tidy run, if enabled.
+    def start_timer(self):
+        self._perltidy_timer = PerlTidyTimer() if self._perltidy_timings_enabled else PerlTidyNullTimer()
+        return self._perltidy_timer
+
+    # Return context manager timing given stage of current tidy run.
+    def span(self, stage):
+        return self._perltidy_timer.span(stage)
+
+    # Log and record stage times of current tidy run.
+    def finish_timer(self):
+        self._perltidy_timer.finish(self, self._perltidy_timings_log_level)
+        self._perltidy_timer = PerlTidyNullTimer()
+
+    # Build perltidy command to be run, including any options. See
+    # build_perltidy_args() for "file_name".
+    def build_perltidy_cmd(self, file_name=None):
+        cmd = []
+        cmd.extend(self._perltidy_cmd)
+        cmd.extend(self.build_perltidy_args(file_name=file_name))
+
+        return cmd
+
+    # Build perltidy arguments (options and perltidyrc) to be passed to
+    # perltidy. If "file_name" is given, project folders containing this file
+    # will be searched for perltidyrc files first. Unless disabled, the
+    # perltidyrc is parsed and merged with the options, resulting in a single,
+    # normalized list of effective options, see get_effective_perltidy_args().
+    def build_perltidy_args(self, file_name=None):
+        # Check, if we have a perltidyrc in the current project, searching
+        # upward from the file's directory.
+        with self.span('perltidyrc'):
+            perltidyrc_path = resolve_perltidyrc(file_name, directories=self._perltidy_folders or [],
+                                                 perltidyrc_paths=self._perltidy_rc_paths, logger=self)
+
+            if self._perltidy_normalize_options:
+                args = get_effective_perltidy_args(perltidyrc_path, self._perltidy_options, logger=self)
+                if args is not None:
+                    return args
+
+        args = []
+
+        if not self._perltidy_options_take_precedence:
+            args.extend(self._perltidy_options)
+
+        if perltidyrc_path is not None:
+            args.append('-pro=' + perltidyrc_path)
+
+        if self._perltidy_options_take_precedence:
+            args.extend(self._perltidy_options)
+
+        return args
+
+    # Do everything needed before tidying a file ahead of time: discover
+    # perltidy, resolve perltidyrc and build the perltidy command for given
+    # file (all memoized), then probe perltidy capabilities and start
+    # "perltidy_worker_pool_size" workers in background. Returns tuple (cmd,
+    # thread), or None, if perltidy cannot be found.
+    def warm_up(self, file_name=None):
+        if not self.find_perltidy():
+            return None
+
+        cmd = self.build_perltidy_cmd(file_name=file_name)
+
+        def warm_up_in_background():
+            self.get_capabilities()
+            if self._perltidy_worker_enabled and self._perltidy_worker_pool_size > 0:
+                pool = get_perltidy_worker_pool(self._perltidy_cmd, idle_timeout=self._perltidy_worker_idle_timeout,
+                                                logger=self, memory_limit=self._perltidy_memory_limit)
+                pool.prewarm(self._perltidy_worker_pool_size)
+
+        thread = threading.Thread(target=warm_up_in_background)
+        thread.daemon = True
+        thread.start()
+        return cmd, thread
+
+    # Return result cache to use, or None, if caching is disabled.
+    def get_result_cache(self):
+        if not self._perltidy_cache_enabled:
+            return None
+
+        cache_dir = None
+        if self._perltidy_cache_persistent and hasattr(sublime, 'cache_path'):
+            cache_dir = os.path.join(sublime.cache_path(), 'PerlTidy', 'results')
+
+        return get_perltidy_result_cache(
+            max_size=self._perltidy_cache_max_size, cache_dir=cache_dir,
+            max_disk_size=self._perltidy_cache_max_disk_size, logger=self)
+
+    # Return index of fingerprints of tidy texts to use, or None, if
+    # disabled.
+    def get_fingerprint_index(self):
+        if not self._perltidy_fingerprints_enabled:
+            return None
+
+        path = None
+        if hasattr(sublime, 'cache_path'):
+            path = os.path.join(sublime.cache_path(), 'PerlTidy', 'fingerprints')
+
+        return get_perltidy_fingerprint_index(
+            max_entries=self._perltidy_fingerprints_max_entries, path=path, logger=self)
+
+    # Return directory remembering row hashes of files as of their last tidy
+    # for incremental tidying, or None, if they are not to be remembered.
+    def get_baseline_dir(self):
+        if self._perltidy_incremental_persistent and hasattr(sublime, 'cache_path'):
+            return os.path.join(sublime.cache_path(), 'PerlTidy', 'baselines')
+        return None
+
+    # Return process-wide scheduler for tidying views in background, limited
+    # as given by user settings "perltidy_scheduler_*".
+    def get_scheduler(self):
+        return get_perltidy_scheduler(concurrency=self._perltidy_scheduler_concurrency,
+                                      max_queued=self._perltidy_scheduler_max_queued, logger=self)
+
+    # Return capabilities of perltidy, probed once and remembered in the
+    # Sublime Text cache directory (if available).
+    def get_capabilities(self):
+        path = None
+        if hasattr(sublime, 'cache_path'):
+            path = os.path.join(sublime.cache_path(), 'PerlTidy', 'capabilities.json')
+
+        with self.span('capabilities'):
+            return get_perltidy_capabilities(self._perltidy_cmd, path=path, logger=self)
+
+    # Run perltidy on given input. Returns input as is, if it is known to be
+    # tidy already, or cached output, if the same input has been tidied with
+    # the same perltidy, options and perltidyrc before. Returns tuple
+    # (success, output, error_output, error_hints). Input may also be given as
+    # iterable of chunks, which is streamed through perltidy, returning output
+    # as list of chunks, see run_perltidy_streaming().
+    def tidy_text(self, input, args=None):
+        if args is None:
+            args = self.build_perltidy_args()
+
+        if not isinstance(input, string_types):
+            return self.stream_perltidy(args, input)
+
+        cache = self.get_result_cache()
+        index = self.get_fingerprint_index()
+
+        if cache is not None or index is not None:
+            with self.span('cache'):
+                cmd = self._perltidy_cmd + args
+                perltidyrc_fingerprint = get_perltidyrc_fingerprint(get_perltidyrc_paths_from_args(args))
+                perltidy_version = self.get_capabilities().version
+
+                def make_cache_key(text):
+                    return make_perltidy_cache_key(text, cmd, perltidyrc_fingerprint, perltidy_version)
+
+                cache_key = make_cache_key(input)
+                if index is not None and index.contains(cache_key):
+                    self.log(1, 'Input is tidy already, skipping perltidy')
+                    return True, input, '', []
+
+                output = cache.get(cache_key) if cache is not None else None
+
+            if output is not None:
+                return True, output, '', []
+
+        result = self.execute_perltidy(args, input)
+
+        if result[0] and (cache is not None or index is not None):
+            with self.span('cache'):
+                if cache is not None:
+                    cache.put(cache_key, result[1])
+                if index is not None:
+                    index.add(cache_key if result[1] == input else make_cache_key(result[1]))
+
+        return result
+
+    # Run perltidy with given arguments on given input. Uses a persistent
+    # perltidy worker, if enabled and available, and falls back to running
+    # perltidy directly otherwise.
+    def execute_perltidy(self, args, input):
+        if self._perltidy_worker_enabled:
+            with self.span('worker'):
+                result = run_perltidy_in_worker(
+                    cmd=self._perltidy_cmd, args=args, input=input, idle_timeout=self._perltidy_worker_idle_timeout,
+                    max_workers=self.max_workers, logger=self, timeout=self._perltidy_timeout,
+                    memory_limit=self._perltidy_memory_limit, capabilities=self.get_capabilities())
+            if result is not None:
+                return result
+
+        return run_perltidy(cmd=self._perltidy_cmd + args, input=input, logger=self,
+                            capabilities=self.get_capabilities(), timer=self._perltidy_timer, timeout=self._perltidy_timeout,
+                            cpu_limit=self._perltidy_cpu_limit, memory_limit=self._perltidy_memory_limit)
+
+    # Check, whether input of given size should be streamed through perltidy
+    # instead of being copied, see user setting "perltidy_streaming_threshold".
+    def should_stream(self, size):
+        threshold = self._perltidy_streaming_threshold
+        return bool(threshold) and size >= threshold and self.get_capabilities().supports_streaming()
+
+    # Return number of milliseconds to wait before tidying on save, given the
+    # time of the last tidy on save (see user setting
+    # "perltidy_tidy_on_save_debounce"), or 0 to tidy right away. Fractions of
+    # milliseconds are rounded up, so the delayed tidy does not fire before
+    # the debounce interval has passed.
+    def get_tidy_on_save_delay(self, last_tidied, now=None):
+        if now is None:
+            now = time.time()
+        remaining = float(self._perltidy_tidy_on_save_debounce) - (now - last_tidied)
+        if remaining <= 0:
+            return 0
+        return int(math.ceil(round(remaining * 1000, 3)))
+
+    # Stream input given as iterable of chunks through perltidy. Result cache,
+    # fingerprints and workers are bypassed, as they need the entire input at
+    # once.
+    def stream_perltidy(self, args, chunks):
+        return run_perltidy_streaming(cmd=self._perltidy_cmd + args, chunks=chunks, logger=self,
+                                      timer=self._perltidy_timer, timeout=self._perltidy_timeout,
+                                      cpu_limit=self._perltidy_cpu_limit, memory_limit=self._perltidy_memory_limit)
+
+    # Tidy given inputs using given perltidy arguments. Tries a single
+    # perltidy run for all inputs consisting of complete top-level statements
+    # first (see is_top_level_perl_code()), so neither affects the indentation
+    # or alignment of another. Other inputs, or all inputs, if this fails, are
+    # tidied on their own, so we can tell, which input is at fault.
+    # "descriptions" are used for reporting errors. Returns tuple (outputs,
+    # errors), where outputs contains None for each input, which could not be
+    # tidied, and errors is a list of tuples (description, error_output,
+    # error_hints). Raises PerlTidyAbortedError, if perltidy has been stopped
+    # on timeout or cancellation, without trying inputs one by one.
+    def tidy_inputs(self, inputs, args, descriptions):
+        outputs = [None] * len(inputs)
+        pending = list(range(len(inputs)))
+
+        if len(inputs) > 1:
+            batch = [i for i in pending if is_top_level_perl_code(split_lines(inputs[i]))]
+            if len(batch) > 1:
+                input, separator = join_perltidy_regions([inputs[i] for i in batch])
+                success, output, error_output, error_hints = self.tidy_text(input, args)
+                batch_outputs = None
+                if success:
+                    batch_outputs = split_perltidy_regions(output, separator, len(batch), [inputs[i] for i in batch])
+                if batch_outputs is not None:
+                    for i, output in zip(batch, batch_outputs):
+                        outputs[i] = output
+                    pending = [i for i in pending if i not in batch]
+                else:
+                    self.log(1, 'Unable to tidy {0} regions at once, tidying regions one by one'.format(len(batch)))
+            if pending:
+                self.log(2, 'Tidying {0} of {1} regions one by one'.format(len(pending), len(inputs)))
+
+        errors = []
+
+        for i in pending:
+            success, output, error_output, error_hints = self.tidy_text(inputs[i], args)
+            if success:
+                outputs[i] = output
+            else:
+                errors.append((descriptions[i], error_output, error_hints))
+
+        return outputs, errors
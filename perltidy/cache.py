@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import codecs
+import hashlib
+import os
+import os.path
+import tempfile
+import threading
+
+from .helpers import PerlTidyNullLogger
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None                  # Python 2.6, result cache unavailable
+
+
+# Compute cache key for a perltidy run.
+def make_perltidy_cache_key(input, cmd, perltidyrc_fingerprint=None, perltidy_version=None):
+    """Returns cache key (hex digest) for a perltidy run.
+
+    The key covers everything affecting perltidy output: the input text, the
+    final perltidy command including all arguments in "cmd", the fingerprint
+    of any perltidyrc files used (see get_perltidyrc_fingerprint()) and the
+    perltidy version.
+    """
+
+    digest = hashlib.sha1()
+
+    for part in list(cmd) + [perltidyrc_fingerprint or '', perltidy_version or '']:
+        digest.update(part.encode('utf-8') + b'\0')
+
+    digest.update(input.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PerlTidyResultCache(object):
+
+    """Content-addressed cache for perltidy output with LRU eviction.
+
+    Entries are kept in memory up to a budget of "max_size" bytes (measured
+    in bytes of UTF-8 encoded output). If "cache_dir" is given, entries are
+    persisted to disk in this directory as well, bounded by "max_disk_size"
+    bytes.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024, cache_dir=None, max_disk_size=64 * 1024 * 1024,
+                 logger=PerlTidyNullLogger()):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+        self.logger = logger
+
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+        # Tuples (output, size) by key, least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Total size of entries in "cache_dir" as of "_disk_size_dir", or
+        # None, if not known yet. Kept up to date while writing entries, so
+        # the directory is only scanned when entries need to be evicted.
+        self._disk_size = None
+        self._disk_size_dir = None
+
+    # Return cached output for given key or None.
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry              # mark as recently used
+        output = entry[0] if entry is not None else None
+
+        if output is None:
+            output = self._load(key)
+            if output is not None:
+                self._store(key, output, len(output.encode('utf-8')))
+
+        with self._lock:
+            if output is None:
+                self.misses += 1
+                message = 'Result cache miss ({0})'.format(self._stats())
+            else:
+                self.hits += 1
+                message = 'Result cache hit ({0})'.format(self._stats())
+        self.logger.log(1, message)
+
+        return output
+
+    # Store output for given key.
+    def put(self, key, output):
+        data = output.encode('utf-8')
+        self._store(key, output, len(data))
+        self._save(key, data)
+
+    # Drop all entries from memory (and from disk, if "disk" is True).
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+        if disk and self.cache_dir is not None:
+            for filename, filepath in self._disk_entries():
+                self._unlink(filepath)
+            with self._lock:
+                self._disk_size = None
+
+    # Return human readable cache statistics.
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        return 'hits: {0}, misses: {1}, entries: {2}, size: {3} bytes'.format(
+            self.hits, self.misses, len(self._entries), self.size)
+
+    def _store(self, key, output, size):
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self._entries[key] = (output, size)
+            self.size += size
+
+            # Evict least recently used entries.
+            while self.size > self.max_size:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[1]
+                self.logger.log(2, 'Result cache evicted: ' + evicted_key)
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+
+        filepath = os.path.join(self.cache_dir, key)
+        try:
+            with codecs.open(filepath, 'rb', encoding='utf-8') as fh:
+                output = fh.read()
+            os.utime(filepath, None)                    # mark as recently used
+            return output
+        except (EnvironmentError, UnicodeDecodeError) as e:
+            return None
+
+    def _save(self, key, data):
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            return
+
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            # Write to temporary file first, so concurrent readers never see
+            # partial entries.
+            fh, temp_filepath = tempfile.mkstemp(dir=cache_dir, prefix='.tmp')
+            try:
+                os.write(fh, data)
+            finally:
+                os.close(fh)
+
+            filepath = os.path.join(cache_dir, key)
+            try:
+                replaced_size = os.stat(filepath).st_size
+            except (EnvironmentError) as e:
+                replaced_size = 0
+            self._unlink(filepath)
+            os.rename(temp_filepath, filepath)
+        except (EnvironmentError) as e:
+            self.logger.log(1, 'Unable to write result cache entry: ' + repr(e))
+            return
+
+        with self._lock:
+            if self._disk_size is not None and self._disk_size_dir == cache_dir:
+                self._disk_size += len(data) - replaced_size
+                if self._disk_size <= self.max_disk_size:
+                    return
+
+        self._evict_disk(cache_dir)
+
+    def _disk_entries(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+
+        try:
+            filenames = os.listdir(cache_dir)
+        except (EnvironmentError) as e:
+            return []
+
+        return [(f, os.path.join(cache_dir, f)) for f in filenames]
+
+    # Scan given cache directory for its total size and remove least recently
+    # used entries exceeding "max_disk_size".
+    def _evict_disk(self, cache_dir):
+        entries = []
+        total_size = 0
+
+        for filename, filepath in self._disk_entries(cache_dir):
+            try:
+                st = os.stat(filepath)
+            except (EnvironmentError) as e:
+                continue
+            entries.append((st.st_mtime, st.st_size, filepath))
+            total_size += st.st_size
+
+        # Remove least recently used entries first.
+        entries.sort()
+        while total_size > self.max_disk_size and entries:
+            mtime, size, filepath = entries.pop(0)
+            self._unlink(filepath)
+            total_size -= size
+
+        with self._lock:
+            self._disk_size = total_size
+            self._disk_size_dir = cache_dir
+
+    def _unlink(self, filepath):
+        try:
+            os.unlink(filepath)
+        except (EnvironmentError) as e:
+            pass
+
+
+# Process-wide result cache shared by all views.
+_perltidy_result_cache = None
+
+
+# Return process-wide result cache, (re)configured with given parameters.
+def get_perltidy_result_cache(max_size=16 * 1024 * 1024, cache_dir=None, max_disk_size=64 * 1024 * 1024,
+                              logger=PerlTidyNullLogger()):
+    """Returns the process-wide PerlTidyResultCache, or None, if unavailable."""
+
+    global _perltidy_result_cache
+
+    if OrderedDict is None:
+        return None
+
+    if _perltidy_result_cache is None:
+        _perltidy_result_cache = PerlTidyResultCache(max_size=max_size, logger=logger)
+
+    cache = _perltidy_result_cache
+    cache.cache_dir = cache_dir
+    cache.max_disk_size = max_disk_size
+    cache.logger = logger
+
+    if cache.max_size != max_size:
+        cache.max_size = max_size
+        cache.clear()
+
+    return cache
+
+
+class PerlTidyFingerprintIndex(object):
+
+    """Bounded set of fingerprints of texts known to be tidy.
+
+    Fingerprints are cache keys as returned by make_perltidy_cache_key() of
+    perltidy output, so they cover perltidy command, options, perltidyrc
+    contents and perltidy version as well: texts with a known fingerprint
+    need not be tidied again. At most "max_entries" fingerprints are kept,
+    evicting least recently used ones. If "path" is given, the index is
+    loaded from this file on first use and saved back (delayed by
+    "save_delay" seconds after changes, or when calling flush()), so it
+    survives restarts.
+    """
+
+    def __init__(self, max_entries=10000, path=None, save_delay=2.0, logger=PerlTidyNullLogger()):
+        self.max_entries = max_entries
+        self.path = path
+        self.save_delay = save_delay
+        self.logger = logger
+
+        self._entries = None
+        self._lock = threading.Lock()
+        self._save_timer = None
+
+    # Return, whether text with given fingerprint is known to be tidy.
+    def contains(self, key):
+        with self._lock:
+            entries = self._load()
+            if key not in entries:
+                return False
+            entries[key] = entries.pop(key)             # mark as recently used
+            return True
+
+    # Remember text with given fingerprint as tidy.
+    def add(self, key):
+        with self._lock:
+            entries = self._load()
+            entries.pop(key, None)
+            entries[key] = True
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+            if self.path is not None and self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    # Save pending changes right away, e.g. before exiting.
+    def flush(self):
+        with self._lock:
+            timer = self._save_timer
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    # Drop all fingerprints (from disk as well).
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+        self.save()
+
+    # Write index to disk, one fingerprint per line, least recently used
+    # first.
+    def save(self):
+        with self._lock:
+            self._save_timer = None
+            if self.path is None or self._entries is None:
+                return
+            data = ''.join([key + '\n' for key in self._entries]).encode('ascii')
+
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            fh, temp_filepath = tempfile.mkstemp(dir=directory, prefix='.tmp')
+            os.write(fh, data)
+            os.close(fh)
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            os.rename(temp_filepath, self.path)
+        except (EnvironmentError) as e:
+            self.logger.log(1, 'Unable to write fingerprint index: ' + repr(e))
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+
+        self._entries = OrderedDict()
+        if self.path is None:
+            return self._entries
+
+        try:
+            with open(self.path, 'rb') as fh:
+                keys = fh.read().decode('ascii').split()
+        except (EnvironmentError, UnicodeDecodeError) as e:
+            keys = []
+
+        for key in keys[-self.max_entries:]:
+            self._entries[key] = True
+
+        self.logger.log(2, 'Loaded {0} fingerprints from {1}'.format(len(self._entries), self.path))
+        return self._entries
+
+
+# Process-wide fingerprint index shared by all views.
+_perltidy_fingerprint_index = None
+
+
+# Return process-wide fingerprint index, (re)configured with given parameters.
+def get_perltidy_fingerprint_index(max_entries=10000, path=None, logger=PerlTidyNullLogger()):
+    """Returns the process-wide PerlTidyFingerprintIndex, or None, if unavailable."""
+
+    global _perltidy_fingerprint_index
+
+    if OrderedDict is None:
+        return None
+
+    if _perltidy_fingerprint_index is None or _perltidy_fingerprint_index.path != path:
+        _perltidy_fingerprint_index = PerlTidyFingerprintIndex(max_entries=max_entries, path=path, logger=logger)
+
+    index = _perltidy_fingerprint_index
+    index.max_entries = max_entries
+    index.logger = logger
+    return index
+
+
+# Save pending changes of process-wide fingerprint index, if any.
+def flush_perltidy_fingerprint_index():
+    if _perltidy_fingerprint_index is not None:
+        _perltidy_fingerprint_index.flush()
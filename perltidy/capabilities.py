@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Probing of perltidy versions and capabilities.
+
+Each perltidy command is probed once for its version, its startup time and
+the options it supports (via "--dump-long-names"), so tidying can use the
+fastest I/O mode supported by the installed perltidy instead of assuming a
+recent one. Results are kept in memory and, if a path is given, on disk, keyed
+by the perltidy command as well as size and modification time of the perltidy
+script/executable, so later sessions need not probe again.
+"""
+
+from __future__ import print_function, unicode_literals
+import json
+import os
+import os.path
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+from .helpers import (PERLTIDY_PROBED_OPTIONS, PerlTidyCapabilities, PerlTidyNullLogger, get_subprocess_args, pp,
+                      subprocess_safe_args)
+
+
+# Maximum number of perltidy commands remembered on disk.
+PERLTIDY_CAPABILITIES_MAX_ENTRIES = 32
+
+
+# Run perltidy with given arguments. Returns tuple (output, seconds taken), or
+# (None, None), if perltidy could not be run.
+def run_perltidy_probe(cmd, args, logger=PerlTidyNullLogger()):
+    subprocess_args = get_subprocess_args()
+    cmd_final, subprocess_args = subprocess_safe_args(list(cmd) + args, subprocess_args)
+
+    try:
+        started = time.time()
+        p = subprocess.Popen(cmd_final, **subprocess_args)
+        output, error_output = p.communicate()
+        return output.decode('utf-8', 'replace'), time.time() - started
+    except (EnvironmentError) as e:
+        logger.log(1, 'Unable to probe perltidy: ' + repr(e))
+        return None, None
+
+
+# Probe perltidy command for its capabilities.
+def probe_perltidy_capabilities(cmd, logger=PerlTidyNullLogger()):
+    """Returns PerlTidyCapabilities of perltidy command given in "cmd".
+
+    Runs perltidy twice: "perltidy -v" for its version and startup time and
+    "perltidy --dump-long-names" for the options it supports.
+    """
+
+    capabilities = PerlTidyCapabilities()
+
+    output, elapsed = run_perltidy_probe(cmd, ['-npro', '-v'], logger=logger)
+    if output is not None:
+        m = re.search(r'This is perltidy, v?(\S+)', output)
+        if m:
+            capabilities.version = m.group(1)
+        capabilities.startup_time = elapsed
+
+    output, elapsed = run_perltidy_probe(cmd, ['-npro', '--dump-long-names'], logger=logger)
+    if output is not None:
+        names = set(re.findall(r'^([a-z][a-z0-9-]*)(?:[=:!+].*)?$', output, re.MULTILINE))
+        if names:
+            capabilities.options = dict([(option, option in names) for option in PERLTIDY_PROBED_OPTIONS])
+
+    logger.log(1, 'Probed perltidy {0}: version {1}, startup time {2}, options {3}'.format(
+        pp(cmd), pp(capabilities.version),
+        '{0:.0f}ms'.format(capabilities.startup_time * 1000) if capabilities.startup_time is not None else '<None>',
+        pp(capabilities.options and sorted([k for k, v in capabilities.options.items() if v]))))
+    return capabilities
+
+
+# Return key identifying given perltidy command and the current state of its
+# script/executable.
+def make_perltidy_capabilities_key(cmd):
+    """Returns key for perltidy command "cmd", or None, if perltidy cannot be stat()ed."""
+
+    try:
+        st = os.stat(cmd[-1])
+    except (EnvironmentError, IndexError) as e:
+        return None
+
+    return json.dumps([list(cmd), st.st_size, int(st.st_mtime)])
+
+
+# Probed capabilities by key, capabilities loaded from disk by path and lock
+# guarding both.
+_perltidy_capabilities = {}
+_perltidy_capabilities_files = {}
+_perltidy_capabilities_lock = threading.Lock()
+
+
+# Return capabilities of given perltidy command, probing it, if necessary.
+def get_perltidy_capabilities(cmd, path=None, logger=PerlTidyNullLogger()):
+    """Returns PerlTidyCapabilities of perltidy command "cmd".
+
+    Capabilities are probed once per command and state of its
+    script/executable (size and modification time), and remembered in
+    memory and, if "path" is given, in this JSON file on disk.
+    """
+
+    key = make_perltidy_capabilities_key(cmd)
+
+    # Commands, which cannot be stat()ed, are probed once per process.
+    memory_key = key if key is not None else json.dumps(list(cmd))
+
+    with _perltidy_capabilities_lock:
+        capabilities = _perltidy_capabilities.get(memory_key)
+        if capabilities is not None:
+            return capabilities
+
+        entries = load_perltidy_capabilities(path, logger) if key is not None else {}
+        if key in entries:
+            logger.log(2, 'Using capabilities of perltidy {0} from {1}'.format(pp(cmd), path))
+            capabilities = PerlTidyCapabilities.from_dict(entries[key])
+        else:
+            capabilities = probe_perltidy_capabilities(cmd, logger=logger)
+
+            # Don't remember failed probes on disk, these may be temporary.
+            if key is not None and capabilities.version is not None and path is not None:
+                entries[key] = capabilities.to_dict()
+                entries[key]['probed_at'] = time.time()
+                save_perltidy_capabilities(path, entries, logger)
+
+        _perltidy_capabilities[memory_key] = capabilities
+
+    return capabilities
+
+
+# Load capabilities from given file (once per process).
+def load_perltidy_capabilities(path, logger=PerlTidyNullLogger()):
+    """Returns dict of capabilities stored in JSON file "path", mapping keys to dicts."""
+
+    if path is None:
+        return {}
+
+    if path not in _perltidy_capabilities_files:
+        try:
+            with open(path, 'rb') as fh:
+                entries = json.loads(fh.read().decode('utf-8'))
+            if not isinstance(entries, dict):
+                entries = {}
+        except (EnvironmentError, ValueError) as e:
+            entries = {}
+
+        logger.log(2, 'Loaded capabilities of {0} perltidy commands from {1}'.format(len(entries), path))
+        _perltidy_capabilities_files[path] = entries
+
+    return _perltidy_capabilities_files[path]
+
+
+# Write capabilities to given file.
+def save_perltidy_capabilities(path, entries, logger=PerlTidyNullLogger()):
+    # Forget least recently probed commands.
+    while len(entries) > PERLTIDY_CAPABILITIES_MAX_ENTRIES:
+        del entries[min(entries, key=lambda key: entries[key].get('probed_at', 0))]
+
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fh, temp_filepath = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        os.write(fh, json.dumps(entries, indent=2, sort_keys=True).encode('utf-8'))
+        os.close(fh)
+
+        if os.path.exists(path):
+            os.unlink(path)
+        os.rename(temp_filepath, path)
+    except (EnvironmentError) as e:
+        logger.log(1, 'Unable to write perltidy capabilities: ' + repr(e))
+
+
+# Forget all probed capabilities (in memory only).
+def clear_perltidy_capabilities():
+    with _perltidy_capabilities_lock:
+        _perltidy_capabilities.clear()
+        _perltidy_capabilities_files.clear()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Command line interface for tidying Perl files outside of Sublime Text.
+
+Uses the same perltidy discovery, perltidyrc resolution, option precedence
+and caching as the Sublime Text commands, so formatting may be checked on CI
+exactly like in the editor:
+
+    python -m perltidy --check lib/ t/ script.pl
+"""
+
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import sys
+import threading
+
+try:
+    import sublime
+except (ImportError) as e:
+    from . import sublime_stub as sublime
+    sys.modules['sublime'] = sublime
+
+from .base import *
+from .cache import flush_perltidy_fingerprint_index
+from .project import PerlTidyFileResult, find_perl_files, tidy_files
+from .worker import stop_perltidy_workers
+
+
+class PerlTidyCli(PerlTidyBase):
+
+    """Tidy Perl files given on the command line."""
+
+    def __init__(self, settings, folders, log_level=0):
+        self.settings = settings
+        self.folders = folders
+        self.cli_log_level = log_level
+
+    def get_settings(self):
+        return self.settings
+
+    def get_folders(self):
+        return self.folders
+
+    # Log to stderr, so results on stdout remain parseable.
+    def log(self, level, message):
+        if level <= self._perltidy_log_level:
+            sys.stderr.write('PerlTidy: {0}\n'.format(message))
+
+    def load_settings(self, reload=True):
+        PerlTidyBase.load_settings(self, reload)
+        self._perltidy_log_level = max(self._perltidy_log_level, self.cli_log_level)
+
+
+# Load PerlTidy settings from given JSON file. Sublime Text project files are
+# supported as well, using their "settings".
+def load_settings_file(path):
+    """Returns dict of settings read from JSON file "path"."""
+
+    with open(path, 'rb') as fh:
+        settings = json.loads(fh.read().decode('utf-8'))
+
+    if 'folders' in settings and 'settings' in settings:
+        settings = settings['settings']
+
+    return settings
+
+
+# Expand given files and directories into Perl files to tidy.
+def find_files(paths, extensions, exclude_dirs):
+    """Yields files given in "paths" and Perl files within directories given in "paths"."""
+
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in find_perl_files([path], extensions, exclude_dirs):
+                yield file_name
+        else:
+            yield path
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m perltidy',
+        description='Tidy Perl files using perltidy like the PerlTidy Sublime Text plugin does.')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='Perl files or directories to tidy')
+    parser.add_argument('--check', action='store_true',
+                        help='do not modify files, exit with status 1 if any file would change')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of files tidied concurrently (default: number of CPUs)')
+    parser.add_argument('--settings', metavar='FILE',
+                        help='JSON file with PerlTidy settings, i.e. a .sublime-project file')
+    parser.add_argument('--perltidy', metavar='CMD', help='perltidy command (overrides setting "perltidy_cmd")')
+    parser.add_argument('--folder', action='append', metavar='DIR',
+                        help='project folder for locating perltidyrc files (default: current directory)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print summary')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='increase log level')
+    return parser.parse_args(argv)
+
+
+# Main entry point. Returns exit status: 0 on success, 1 if files would
+# change when checking, 2 if any file could not be tidied.
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    settings = dict(DEFAULT_SETTINGS)
+    if args.settings:
+        settings.update(load_settings_file(args.settings))
+    if args.perltidy:
+        settings['perltidy_cmd'] = args.perltidy
+
+    folders = [os.path.abspath(folder) for folder in args.folder or [os.getcwd()]]
+    cli = PerlTidyCli(settings, folders, log_level=args.verbose)
+    cli.load_settings()
+
+    if not cli.find_perltidy():
+        sys.stderr.write(PERLTIDY_NOT_FOUND_MESSAGE + '\n')
+        return 2
+
+    jobs = args.jobs
+    if jobs < 1:
+        try:
+            jobs = multiprocessing.cpu_count()
+        except (NotImplementedError) as e:
+            jobs = 1
+    cli.max_workers = jobs
+
+    output_lock = threading.Lock()
+
+    def tidy(path, input):
+        return cli.tidy_text(input, cli.build_perltidy_args(file_name=path))
+
+    # Print results as soon as each file has been tidied.
+    def report(result):
+        if result.status == PerlTidyFileResult.CHANGED:
+            line = '{0}: {1}\n'.format('Would change' if args.check else 'Changed', result.path)
+        elif result.status == PerlTidyFileResult.FAILED:
+            line = 'Failed: {0}\n    {1}\n'.format(result.path, result.message.replace('\n', '\n    '))
+        elif args.verbose:
+            line = 'Unchanged: {0}\n'.format(result.path)
+        else:
+            return
+
+        with output_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    files = find_files(args.paths, settings['perltidy_project_extensions'], settings['perltidy_project_exclude_dirs'])
+    # perltidy runs in its own process group, so stop it on interrupts.
+    try:
+        summary = tidy_files(files, tidy, jobs=jobs, dry_run=args.check, callback=report)
+    except (KeyboardInterrupt) as e:
+        cancel_perltidy_processes()
+        raise
+    finally:
+        stop_perltidy_workers()
+        flush_perltidy_fingerprint_index()
+
+    if not args.quiet:
+        sys.stdout.write(summary.format(dry_run=args.check) + '\n')
+
+    if summary.files(PerlTidyFileResult.FAILED):
+        return 2
+    if args.check and summary.files(PerlTidyFileResult.CHANGED):
+        return 1
+    return 0
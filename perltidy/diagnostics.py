@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Parsing of perltidy error output into structured diagnostics.
+
+perltidy reports problems in its error output (".ERR" file or stderr) like
+this, where numbered lines either carry a message (separated by a tab) or echo
+the offending code line (separated by a space), followed by a marker line
+pointing at the offending column:
+
+    3:	Unexpected '}' ... perhaps a missing ';' before it?
+    5: sub foo {
+              ^
+    Final nesting depth of '{'s is 1
+    The most recent un-matched '{' is on line 5
+"""
+
+from __future__ import print_function, unicode_literals
+import re
+
+
+# Numbered lines: messages ("<line>:<tab><message>") or code echoes
+# ("<line>: <code>").
+NUMBERED_LINE_RE = re.compile(r'^(\d+):(\t| ?)(.*)$')
+
+# Marker lines pointing at a column of the preceding code echo.
+MARKER_LINE_RE = re.compile(r'^ *[-~]*\^')
+
+# References to lines within unnumbered messages.
+LINE_REFERENCE_RE = re.compile(r'\bline (\d+)\b')
+
+# Messages considered errors. All others are warnings.
+ERROR_MESSAGE_RE = re.compile(
+    r'error|un-?matched|unbalanced|unexpected|missing|stray|giving up|final nesting depth|' +
+    r'not terminated|can\'t find|unable to', re.IGNORECASE)
+
+# Messages not indicating problems.
+INFO_MESSAGE_RE = re.compile(r'^(?:To save a full \.LOG file|perltidy version|##)')
+
+
+class PerlTidyDiagnostic(object):
+
+    """Problem reported by perltidy.
+
+    "line" is 1-based and relative to the input passed to perltidy, "column" is
+    0-based or None, if unknown. "severity" is one of ERROR, WARNING or INFO.
+    """
+
+    ERROR = 'error'
+    WARNING = 'warning'
+    INFO = 'info'
+
+    def __init__(self, line, column, severity, message):
+        self.line = line
+        self.column = column
+        self.severity = severity
+        self.message = message
+
+    def __eq__(self, other):
+        return isinstance(other, PerlTidyDiagnostic) and \
+            (self.line, self.column, self.severity, self.message) == \
+            (other.line, other.column, other.severity, other.message)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'PerlTidyDiagnostic({0!r}, {1!r}, {2!r}, {3!r})'.format(
+            self.line, self.column, self.severity, self.message)
+
+
+# Return severity of given message.
+def get_message_severity(message):
+    if INFO_MESSAGE_RE.match(message):
+        return PerlTidyDiagnostic.INFO
+    if ERROR_MESSAGE_RE.search(message):
+        return PerlTidyDiagnostic.ERROR
+    return PerlTidyDiagnostic.WARNING
+
+
+# Parse perltidy error output lazily.
+def iter_perltidy_diagnostics(error_output):
+    """Yields PerlTidyDiagnostic for each problem reported in "error_output".
+
+    Lines are parsed one at a time as diagnostics are consumed, so callers
+    may process huge error outputs in chunks. Code echoes followed by marker
+    lines provide the column of the preceding diagnostic for the same line.
+    Unnumbered messages referring to a line ("... on line 5") are reported
+    for that line, all other unnumbered lines are ignored.
+    """
+
+    pending = None          # diagnostic, whose column may still follow
+    echo = None             # (line, length of prefix) of last code echo
+
+    for match in re.finditer(r'[^\n]*\n|[^\n]+$', error_output):
+        text = match.group(0).rstrip('\r\n')
+
+        if echo is not None and MARKER_LINE_RE.match(text):
+            line, prefix_length = echo
+            echo = None
+            column = max(text.index('^') - prefix_length, 0)
+
+            if pending is not None and pending.line == line and pending.column is None:
+                pending.column = column
+            else:
+                if pending is not None:
+                    yield pending
+                pending = PerlTidyDiagnostic(line, column, PerlTidyDiagnostic.ERROR, 'Syntax error')
+            continue
+
+        # A code echo not followed by a marker line is a regular message.
+        if echo is not None:
+            line, prefix_length = echo
+            echo = None
+            if pending is not None:
+                yield pending
+            message = echo_text.strip()
+            pending = PerlTidyDiagnostic(line, None, get_message_severity(message), message)
+
+        m = NUMBERED_LINE_RE.match(text)
+        if m:
+            line = int(m.group(1))
+            if m.group(2) != '\t':
+                echo = (line, len(m.group(1)) + 1 + len(m.group(2)))
+                echo_text = m.group(3)
+                continue
+
+            message = m.group(3).strip()
+            if not message:
+                continue
+            if pending is not None:
+                yield pending
+            pending = PerlTidyDiagnostic(line, None, get_message_severity(message), message)
+            continue
+
+        m = LINE_REFERENCE_RE.search(text)
+        if m:
+            message = text.strip()
+            if pending is not None:
+                yield pending
+            pending = PerlTidyDiagnostic(int(m.group(1)), None, get_message_severity(message), message)
+
+    if echo is not None:
+        if pending is not None:
+            yield pending
+        message = echo_text.strip()
+        pending = PerlTidyDiagnostic(echo[0], None, get_message_severity(message), message)
+
+    if pending is not None:
+        yield pending
+
+
+# Parse perltidy error output at once.
+def parse_perltidy_diagnostics(error_output):
+    """Returns list of PerlTidyDiagnostic for problems reported in "error_output"."""
+
+    return list(iter_perltidy_diagnostics(error_output))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import bisect
+import difflib
+
+
+# Split text into lines, keeping line endings. Unlike str.splitlines(), only
+# splits on LF, which is the only line ending used within Sublime Text
+# buffers.
+def split_lines(text):
+    """Returns list of lines in "text", each including its trailing LF (if any)."""
+
+    lines = text.split('\n')
+    result = [line + '\n' for line in lines[:-1]]
+    if lines[-1]:
+        result.append(lines[-1])
+    return result
+
+
+# Maximum number of line pairs to compare using difflib.SequenceMatcher, which
+# takes quadratic time when most lines have changed.
+MAX_SEQUENCE_MATCHER_COST = 250000
+
+
+# Compute changed line ranges between two lists of lines.
+def diff_line_ranges(old_lines, new_lines):
+    """Returns list of tuples (i1, i2, j1, j2), each replacing old_lines[i1:i2] with new_lines[j1:j2].
+
+    Ranges are sorted and do not overlap. Either range may be empty, for pure
+    insertions and deletions respectively. Large inputs are split at lines
+    occurring exactly once in both inputs first (like patience diff), so
+    diffing takes roughly linear time even if most lines have changed.
+    """
+
+    ranges = []
+    spans = [(0, len(old_lines), 0, len(new_lines))]
+
+    while spans:
+        i1, i2, j1, j2 = spans.pop()
+
+        # Skip common leading and trailing lines before diffing, this is
+        # where most of the lines end up in, when tidying mostly tidy code.
+        while i1 < i2 and j1 < j2 and old_lines[i1] == new_lines[j1]:
+            i1 += 1
+            j1 += 1
+        while i1 < i2 and j1 < j2 and old_lines[i2 - 1] == new_lines[j2 - 1]:
+            i2 -= 1
+            j2 -= 1
+
+        if i1 == i2 and j1 == j2:
+            continue
+
+        if i1 == i2 or j1 == j2 or (i2 - i1) * (j2 - j1) <= MAX_SEQUENCE_MATCHER_COST:
+            ranges.extend(_sequence_matcher_ranges(old_lines, new_lines, i1, i2, j1, j2))
+            continue
+
+        anchors = _unique_line_anchors(old_lines, new_lines, i1, i2, j1, j2)
+        if not anchors:
+            ranges.append((i1, i2, j1, j2))
+            continue
+
+        # Diff spans between anchors, keeping ranges sorted.
+        bounds = [(i1 - 1, j1 - 1)] + anchors + [(i2, j2)]
+        for k in range(len(bounds) - 1, 0, -1):
+            spans.append((bounds[k - 1][0] + 1, bounds[k][0], bounds[k - 1][1] + 1, bounds[k][1]))
+
+    return ranges
+
+
+def _sequence_matcher_ranges(old_lines, new_lines, i1, i2, j1, j2):
+    try:
+        matcher = difflib.SequenceMatcher(None, old_lines[i1:i2], new_lines[j1:j2], autojunk=False)
+    except (TypeError) as e:
+        matcher = difflib.SequenceMatcher(None, old_lines[i1:i2], new_lines[j1:j2])     # Python < 2.7.1
+
+    return [(i1 + a1, i1 + a2, j1 + b1, j1 + b2)
+            for tag, a1, a2, b1, b2 in matcher.get_opcodes() if tag != 'equal']
+
+
+# Return longest increasing sequence of pairs (i, j) of lines occurring once
+# in old_lines[i1:i2] and new_lines[j1:j2] each.
+def _unique_line_anchors(old_lines, new_lines, i1, i2, j1, j2):
+    old_counts = {}
+    for i in range(i1, i2):
+        old_counts[old_lines[i]] = i if old_lines[i] not in old_counts else -1
+
+    new_counts = {}
+    for j in range(j1, j2):
+        if old_counts.get(new_lines[j], -1) >= 0:
+            new_counts[new_lines[j]] = j if new_lines[j] not in new_counts else -1
+
+    pairs = sorted([(old_counts[line], j) for line, j in new_counts.items() if j >= 0])
+
+    # Longest increasing subsequence of j (patience sorting).
+    tails = []
+    tail_indices = []
+    predecessors = []
+    for index, (i, j) in enumerate(pairs):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[position] = j
+            tail_indices[position] = index
+        predecessors.append(tail_indices[position - 1] if position > 0 else -1)
+
+    anchors = []
+    index = tail_indices[-1] if tail_indices else -1
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = predecessors[index]
+
+    return anchors[::-1]
+
+
+# Compute changed hunks between old and new text on a line basis.
+def diff_hunks(old, new):
+    """Returns list of hunks, which transform text "old" into text "new".
+
+    Each hunk is a tuple (begin, end, replacement), where "begin" and "end"
+    are offsets into "old" and "replacement" is the text replacing this span.
+    Hunks are sorted by offset and do not overlap, so applying them back to
+    front keeps offsets of hunks not applied yet valid.
+    """
+
+    if old == new:
+        return []
+
+    old_lines = split_lines(old)
+    new_lines = split_lines(new)
+
+    # Offsets of lines within "old".
+    offsets = [0]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    return [(offsets[i1], offsets[i2], ''.join(new_lines[j1:j2]))
+            for i1, i2, j1, j2 in diff_line_ranges(old_lines, new_lines)]
+
+
+def _indentation(line):
+    return len(line) - len(line.lstrip(' \t'))
+
+
+# Map offset in old text to the corresponding offset in new text.
+def map_offset(old, hunks, offset):
+    """Returns offset in new text corresponding to "offset" in text "old".
+
+    "hunks" must have been computed by diff_hunks(). Offsets outside of any
+    hunk are shifted accordingly. Offsets within a hunk are mapped to the
+    same line within the replacement (if it has enough lines) and to the
+    same position relative to the line's indentation, since tidying mostly
+    changes indentation and whitespace.
+    """
+
+    delta = 0
+
+    for begin, end, replacement in hunks:
+        if offset < begin:
+            break
+
+        if offset >= end:
+            delta += len(replacement) - (end - begin)
+            continue
+
+        # Determine row and column within old hunk.
+        old_hunk = old[begin:end]
+        relative = offset - begin
+        row = old_hunk.count('\n', 0, relative)
+        line_begin = old_hunk.rfind('\n', 0, relative) + 1
+        line_end = old_hunk.find('\n', line_begin)
+        old_line = old_hunk[line_begin:line_end if line_end >= 0 else len(old_hunk)]
+        column = relative - line_begin
+
+        # Find corresponding row and column within new hunk.
+        new_lines = replacement.split('\n')
+        if replacement.endswith('\n'):
+            new_lines.pop()
+        if not new_lines:
+            return begin + delta
+
+        row = min(row, len(new_lines) - 1)
+        new_line = new_lines[row]
+
+        old_indentation = _indentation(old_line)
+        new_indentation = _indentation(new_line)
+        if column >= old_indentation:
+            column = new_indentation + column - old_indentation
+        else:
+            column = min(column, new_indentation)
+        column = min(column, len(new_line))
+
+        return begin + delta + sum([len(line) + 1 for line in new_lines[:row]]) + column
+
+    return offset + delta
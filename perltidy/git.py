@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""Access to files as committed to git, for tidying changed hunks only.
+
+Only plain, local git commands are used, so this works offline and without
+any git bindings installed.
+"""
+
+from __future__ import print_function, unicode_literals
+import os.path
+import subprocess
+
+from .helpers import (PerlTidyAbortedError, PerlTidyNullLogger, PerlTidyProcessWatch, get_subprocess_args, pp,
+                      subprocess_safe_args)
+
+
+# Seconds to wait for git, before giving up.
+GIT_TIMEOUT = 10
+
+
+# Return text of given file as committed to HEAD of its git repository.
+def get_git_head_text(file_name, git_cmd='git', logger=PerlTidyNullLogger(), timeout=GIT_TIMEOUT):
+    """Returns text of file "file_name" as of git HEAD, or None.
+
+    Runs "git show HEAD:./<file>" within the directory of the file. Returns
+    None, if git cannot be run, the file is not within a git repository, the
+    repository has no commits yet or the file is not tracked in HEAD. Line
+    endings are normalized to LF, like within Sublime Text buffers. Raises
+    PerlTidyAbortedError, if git does not finish within "timeout" seconds or
+    has been stopped by cancel_perltidy_processes().
+    """
+
+    directory, name = os.path.split(file_name)
+
+    subprocess_args = get_subprocess_args()
+    subprocess_args['cwd'] = directory or None
+    cmd, subprocess_args = subprocess_safe_args([git_cmd, 'show', 'HEAD:./' + name], subprocess_args)
+
+    logger.log(2, 'Running git: ' + pp(cmd))
+    try:
+        p = subprocess.Popen(cmd, **subprocess_args)
+        with PerlTidyProcessWatch(p, timeout=timeout, logger=logger) as watch:
+            output, error_output = p.communicate()
+    except (EnvironmentError) as e:
+        logger.log(1, 'Unable to run git: ' + repr(e))
+        return None
+
+    if watch.reason == PerlTidyAbortedError.TIMEOUT:
+        raise PerlTidyAbortedError('git did not finish within {0}s'.format(timeout), watch.reason)
+    if watch.reason is not None:
+        raise PerlTidyAbortedError('git has been cancelled', watch.reason)
+
+    if p.returncode != 0:
+        logger.log(1, 'No git HEAD revision of {0}: {1}'.format(
+            file_name, error_output.decode('utf-8', 'replace').strip()))
+        return None
+
+    return output.decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n')
@@ -2,13 +2,27 @@
 
 from __future__ import print_function, unicode_literals
 import codecs
+import contextlib
+import hashlib
+import multiprocessing
 import os
 import os.path
 import sys
 import re
+import signal
 import sublime
 import subprocess
 import tempfile
+import threading
+import time
+import uuid
+
+from collections import deque
+
+try:
+    import resource
+except (ImportError) as e:
+    resource = None
 
 
 # Support Python 2.6/Python 3.x at same time with workarounds taken from
@@ -41,6 +55,21 @@ class PerlTidyRuntimeError(Exception):
         self.value = value
 
 
+class PerlTidyAbortedError(PerlTidyRuntimeError):
+
+    """perltidy run stopped due to timeout or cancellation, output discarded."""
+
+    CANCELLED = 'cancelled'
+    TIMEOUT = 'timeout'
+
+    def __init__(self, value, reason):
+        self.value = value
+        self.reason = reason
+
+    def __str__(self):
+        return self.value
+
+
 class PerlTidyNullLogger:
 
     def log(self, level, message):
@@ -50,6 +79,439 @@ class PerlTidyNullLogger:
         return 0
 
 
+class PerlTidyNullTimer:
+
+    def span(self, stage):
+        return _perltidy_null_span
+
+    def add(self, stage, seconds):
+        pass
+
+    def finish(self, logger, level):
+        pass
+
+
+class PerlTidyNullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_perltidy_null_span = PerlTidyNullSpan()
+
+
+class PerlTidyTimer(object):
+
+    """Records wall time of each stage of a single tidy run.
+
+    Use "with timer.span('stage'):" to time a stage. Stages may be entered
+    multiple times, times are added up. finish() logs a one-line breakdown and
+    adds all stage times to the rolling statistics returned by
+    get_perltidy_timing_stats(). Use PerlTidyNullTimer, if timing is disabled.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self.seconds = {}
+
+    def span(self, stage):
+        return PerlTidySpan(self, stage)
+
+    def add(self, stage, seconds):
+        if stage not in self.seconds:
+            self.stages.append(stage)
+            self.seconds[stage] = 0.0
+        self.seconds[stage] += seconds
+
+    # Return one-line breakdown of stage times.
+    def format(self):
+        parts = ['{0} {1:.1f}ms'.format(stage, self.seconds[stage] * 1000) for stage in self.stages]
+        parts.append('total {0:.1f}ms'.format((time.time() - self.started) * 1000))
+        return ', '.join(parts)
+
+    # Log breakdown at given level and record stage times.
+    def finish(self, logger, level):
+        if logger.log_level() >= level:
+            logger.log(level, 'Timings: ' + self.format())
+        self.add('total', time.time() - self.started)
+
+        for stage in self.stages:
+            record_perltidy_timing(stage, self.seconds[stage])
+
+
+class PerlTidySpan(object):
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.stage, time.time() - self.started)
+        return False
+
+
+# Number of most recent samples per stage kept for timing statistics.
+PERLTIDY_TIMING_SAMPLES = 100
+
+_perltidy_timings = {}
+_perltidy_timings_order = []
+_perltidy_timings_lock = threading.Lock()
+
+
+# Add a sample for given stage to the rolling timing statistics.
+def record_perltidy_timing(stage, seconds):
+    with _perltidy_timings_lock:
+        if stage not in _perltidy_timings:
+            _perltidy_timings[stage] = deque(maxlen=PERLTIDY_TIMING_SAMPLES)
+            _perltidy_timings_order.append(stage)
+        _perltidy_timings[stage].append(seconds)
+
+
+# Return rolling timing statistics.
+def get_perltidy_timing_stats():
+    """Returns list of tuples (stage, samples, p50, p95, max) with times in seconds.
+
+    Statistics cover the most recent PERLTIDY_TIMING_SAMPLES samples per
+    stage, in order of first appearance of each stage.
+    """
+
+    stats = []
+
+    with _perltidy_timings_lock:
+        for stage in _perltidy_timings_order:
+            samples = sorted(_perltidy_timings[stage])
+            stats.append((stage, len(samples), samples[int(0.50 * (len(samples) - 1))],
+                          samples[int(0.95 * (len(samples) - 1))], samples[-1]))
+
+    return stats
+
+
+# Format rolling timing statistics as table.
+def format_perltidy_timing_stats():
+    """Returns rolling timing statistics formatted as human readable table."""
+
+    stats = get_perltidy_timing_stats()
+    if not stats:
+        return 'No timings recorded yet.\n'
+
+    lines = ['{0:<16} {1:>8} {2:>10} {3:>10} {4:>10}'.format('Stage', 'Samples', 'p50 (ms)', 'p95 (ms)', 'max (ms)')]
+    for stage, samples, p50, p95, maximum in stats:
+        lines.append('{0:<16} {1:>8} {2:>10.1f} {3:>10.1f} {4:>10.1f}'.format(
+            stage, samples, p50 * 1000, p95 * 1000, maximum * 1000))
+
+    return '\n'.join(lines) + '\n'
+
+
+# Drop all rolling timing statistics.
+def clear_perltidy_timing_stats():
+    with _perltidy_timings_lock:
+        _perltidy_timings.clear()
+        del _perltidy_timings_order[:]
+
+
+# Processes of in-flight perltidy runs, which may be stopped on timeout or
+# cancellation, and number of cancellations so far.
+_perltidy_watches = set()
+_perltidy_watches_lock = threading.Lock()
+_perltidy_cancellations = [0]
+
+
+class PerlTidyProcessWatch(object):
+
+    """Stops a perltidy process (group) on timeout or cancellation.
+
+    Used as context manager around communicating with the process. If the
+    process has been stopped, "reason" is set to PerlTidyAbortedError.TIMEOUT
+    or PerlTidyAbortedError.CANCELLED, and error() returns the exception to
+    raise instead of using any (partial) output.
+    """
+
+    def __init__(self, process, timeout=0, logger=PerlTidyNullLogger()):
+        self.process = process
+        self.timeout = timeout
+        self.logger = logger
+        self.reason = None
+
+        self._timer = None
+
+    def __enter__(self):
+        with _perltidy_watches_lock:
+            _perltidy_watches.add(self)
+
+        if self.timeout and self.timeout > 0:
+            self._timer = threading.Timer(self.timeout, self.stop, [PerlTidyAbortedError.TIMEOUT])
+            self._timer.daemon = True
+            self._timer.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        with _perltidy_watches_lock:
+            _perltidy_watches.discard(self)
+
+        return False
+
+    # Stop process for given reason.
+    def stop(self, reason):
+        if self.reason is None:
+            self.reason = reason
+        self.logger.log(1, 'Stopping perltidy process {0} ({1})'.format(self.process.pid, reason))
+        kill_perltidy_process(self.process)
+
+    # Return PerlTidyAbortedError describing, why the process was stopped.
+    def error(self):
+        if self.reason == PerlTidyAbortedError.TIMEOUT:
+            return PerlTidyAbortedError(
+                'perltidy timed out after {0}s, see user setting "perltidy_timeout"'.format(self.timeout), self.reason)
+        return PerlTidyAbortedError('perltidy has been cancelled', self.reason)
+
+
+# Kill given process along with any processes it has spawned.
+def kill_perltidy_process(process):
+    """Kills "process" and its process group (POSIX) or process tree (Windows)."""
+
+    try:
+        if sublime.platform() == 'windows':
+            subprocess.Popen(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                             **get_subprocess_args()).communicate()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (EnvironmentError) as e:
+        pass
+
+    # Process may not be a process group leader or taskkill may have failed,
+    # so kill process itself in any case.
+    try:
+        if process.poll() is None:
+            process.kill()
+    except (EnvironmentError) as e:
+        pass
+
+
+# Stop all in-flight perltidy runs.
+def cancel_perltidy_processes():
+    """Stops all in-flight perltidy processes and returns their number.
+
+    Runs affected raise PerlTidyAbortedError. Callers running perltidy for
+    multiple files may check get_perltidy_cancellations() to stop as well.
+    """
+
+    with _perltidy_watches_lock:
+        watches = list(_perltidy_watches)
+        _perltidy_cancellations[0] += 1
+
+    for watch in watches:
+        watch.stop(PerlTidyAbortedError.CANCELLED)
+
+    return len(watches)
+
+
+# Return number of cancellations so far.
+def get_perltidy_cancellations():
+    return _perltidy_cancellations[0]
+
+
+# Return number of CPUs, or 1, if unknown.
+def get_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except (NotImplementedError) as e:
+        return 1
+
+
+# Default maximum number of queued tidy jobs.
+PERLTIDY_SCHEDULER_MAX_QUEUED = 64
+
+
+class PerlTidyScheduler(object):
+
+    """Runs tidy jobs of multiple views in background threads with bounded concurrency.
+
+    At most "concurrency" jobs (defaults to the number of CPUs) run at once,
+    further jobs are queued, up to "max_queued" jobs. Each job has a key (i.e.
+    view ID): a job submitted for a key, for which a job is still queued,
+    supersedes the queued job. Queued jobs with higher priority (i.e. of the
+    focused view) run first, others in order of submission. Numbers of jobs
+    submitted, started, superseded and rejected as well as the highest queue
+    length and the time spent waiting in the queue are kept as backpressure
+    statistics, see get_stats().
+    """
+
+    def __init__(self, concurrency=0, max_queued=PERLTIDY_SCHEDULER_MAX_QUEUED, logger=PerlTidyNullLogger()):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.logger = logger
+
+        self._queue = []
+        self._running = 0
+        self._sequence = 0
+        self._backlog = False           # whether jobs had to be queued
+        self._stats = {'submitted': 0, 'started': 0, 'superseded': 0, 'rejected': 0, 'max_queued': 0,
+                       'wait_total': 0.0, 'wait_max': 0.0}
+        self._lock = threading.Lock()
+
+    # Return maximum number of jobs run at once.
+    def get_concurrency(self):
+        if self.concurrency and self.concurrency > 0:
+            return self.concurrency
+        return get_cpu_count()
+
+    # Submit job for given key.
+    def submit(self, key, run, priority=0, on_superseded=None):
+        """Runs callable "run" in a background thread, once fewer than get_concurrency() jobs run.
+
+        Returns False, if the job has been rejected, since "max_queued" jobs
+        are queued already, and True otherwise. If the job is superseded
+        before it has been started, "on_superseded" is called instead.
+        """
+
+        job = {'key': key, 'run': run, 'priority': priority, 'on_superseded': on_superseded,
+               'submitted_at': time.time()}
+        superseded = []
+
+        with self._lock:
+            self._stats['submitted'] += 1
+
+            superseded = [queued for queued in self._queue if queued['key'] == key]
+            if superseded:
+                self._queue = [queued for queued in self._queue if queued['key'] != key]
+                self._stats['superseded'] += len(superseded)
+            elif len(self._queue) >= self.max_queued > 0:
+                self._stats['rejected'] += 1
+                self.logger.log(1, 'Rejecting tidy job {0}, {1} jobs queued already'.format(key, len(self._queue)))
+                return False
+
+            self._sequence += 1
+            job['sequence'] = self._sequence
+            self._queue.append(job)
+            self._stats['max_queued'] = max(self._stats['max_queued'], len(self._queue))
+            jobs = self._take_jobs()
+
+            if not jobs:
+                self._backlog = True
+                self.logger.log(1, 'Queued tidy job {0}: {1} running, {2} queued'.format(
+                    key, self._running, len(self._queue)))
+
+        for queued in superseded:
+            self.logger.log(1, 'Tidy job {0} has been superseded'.format(key))
+            if queued['on_superseded'] is not None:
+                queued['on_superseded']()
+
+        self._start(jobs)
+        return True
+
+    # Raise priority of job queued for given key, i.e. when its view gains
+    # focus. Returns True, if such a job is queued.
+    def promote(self, key, priority=1):
+        with self._lock:
+            for job in self._queue:
+                if job['key'] == key:
+                    job['priority'] = max(job['priority'], priority)
+                    return True
+        return False
+
+    # Return, whether a job is queued (but not running) for given key.
+    def is_queued(self, key):
+        with self._lock:
+            return len([job for job in self._queue if job['key'] == key]) > 0
+
+    # Return backpressure statistics.
+    def get_stats(self):
+        """Returns dict of statistics, including numbers of jobs currently "running" and "queued"."""
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = self._running
+            stats['queued'] = len(self._queue)
+        return stats
+
+    # Format backpressure statistics as human readable text.
+    def format_stats(self):
+        stats = self.get_stats()
+        return ('Jobs: {running} running, {queued} queued (max. {max_queued}); {submitted} submitted, '
+                '{started} started, {superseded} superseded, {rejected} rejected; queue wait: {0:.1f}ms average, '
+                '{1:.1f}ms max\n').format(stats['wait_total'] * 1000 / max(stats['started'], 1),
+                                          stats['wait_max'] * 1000, **stats)
+
+    # Dequeue jobs to be started now, highest priority first. Must be called
+    # with lock held.
+    def _take_jobs(self):
+        jobs = []
+        while self._queue and self._running < self.get_concurrency():
+            job = min(self._queue, key=lambda job: (-job['priority'], job['sequence']))
+            self._queue.remove(job)
+            self._running += 1
+            self._stats['started'] += 1
+
+            waited = time.time() - job['submitted_at']
+            self._stats['wait_total'] += waited
+            self._stats['wait_max'] = max(self._stats['wait_max'], waited)
+            jobs.append(job)
+
+        return jobs
+
+    def _start(self, jobs):
+        for job in jobs:
+            thread = threading.Thread(target=self._run, args=(job,))
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, job):
+        try:
+            job['run']()
+        except (Exception) as e:
+            self.logger.log(0, 'Tidy job {0} failed: {1}'.format(job['key'], repr(e)))
+        finally:
+            with self._lock:
+                self._running -= 1
+                jobs = self._take_jobs()
+                drained = self._backlog and not self._running
+                if drained:
+                    self._backlog = False
+
+            # Log backpressure statistics, once a backlog has been worked off.
+            if drained:
+                self.logger.log(1, 'All queued tidy jobs done. ' + self.format_stats().strip())
+            self._start(jobs)
+
+
+# Process-wide scheduler.
+_perltidy_scheduler = None
+_perltidy_scheduler_lock = threading.Lock()
+
+
+# Return process-wide scheduler for tidy jobs.
+def get_perltidy_scheduler(concurrency=None, max_queued=None, logger=None):
+    """Returns the process-wide PerlTidyScheduler, updated with any limits and logger given."""
+
+    global _perltidy_scheduler
+
+    with _perltidy_scheduler_lock:
+        if _perltidy_scheduler is None:
+            _perltidy_scheduler = PerlTidyScheduler()
+        scheduler = _perltidy_scheduler
+
+    if concurrency is not None:
+        scheduler.concurrency = concurrency
+    if max_queued is not None:
+        scheduler.max_queued = max_queued
+    if logger is not None:
+        scheduler.logger = logger
+    return scheduler
+
+
 # Convert absolute file path in Windows notation to Cygwin notation.
 def cygwin_path_from_windows_path(filepath=None):
     """Returns filepath in Cygwin notation.
@@ -169,6 +631,137 @@ def find_perltidyrc_in_project(directories=[], perltidyrc_paths=[], logger=PerlT
     return perltidyrc_path
 
 
+# Return perltidyrc files perltidy will look for on its own, if no perltidyrc
+# has been given explicitly via "-pro=...".
+def get_perltidy_default_rc_paths():
+    """Returns list of perltidyrc paths perltidy itself checks by default.
+
+    These will be used by perltidy, unless a perltidyrc has been specified
+    explicitly, and must therefore be taken into account, when deciding,
+    whether perltidy output may be reused.
+    """
+
+    paths = []
+
+    if 'PERLTIDY' in os.environ:
+        paths.append(os.environ['PERLTIDY'])
+
+    paths.append(os.path.abspath('.perltidyrc'))
+
+    home = os.path.expanduser('~')
+    if home != '~':
+        paths.append(os.path.join(home, '.perltidyrc'))
+
+    if sublime.platform() != 'windows':
+        paths.extend(['/usr/local/etc/perltidyrc', '/etc/perltidyrc'])
+
+    return paths
+
+
+# Return perltidyrc files used by perltidy when called with given arguments.
+def get_perltidyrc_paths_from_args(args):
+    """Returns list of perltidyrc paths perltidy will use for arguments given in "args".
+
+    Honors "-pro=..."/"--profile=..." and "-npro"/"--noprofile". Falls back to
+    get_perltidy_default_rc_paths(), if no perltidyrc has been given.
+    """
+
+    perltidyrc_paths = []
+
+    for arg in args:
+        if arg in ['-npro', '--noprofile']:
+            return []
+
+        m = re.match(r'^--?(?:pro|profile)=(.+)$', arg)
+        if m:
+            perltidyrc_paths = [m.group(1)]
+
+    if perltidyrc_paths:
+        return perltidyrc_paths
+
+    return get_perltidy_default_rc_paths()
+
+
+# Return fingerprint for given perltidyrc files, which changes whenever any of
+# these files is created, modified or removed.
+def get_perltidyrc_fingerprint(perltidyrc_paths):
+    """Returns hex digest of contents of all files given in "perltidyrc_paths".
+
+    Nonexistant files are accounted for as well, so creating a perltidyrc
+    file later on will change the fingerprint.
+    """
+
+    digest = hashlib.sha1()
+
+    for perltidyrc_path in perltidyrc_paths:
+        digest.update(perltidyrc_path.encode('utf-8') + b'\0')
+        try:
+            with open(perltidyrc_path, 'rb') as fh:
+                digest.update(fh.read())
+        except (EnvironmentError) as e:
+            digest.update(b'<none>')
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+# Return keyword arguments for subprocess.Popen() used for running perltidy.
+def get_subprocess_args(new_process_group=False, cpu_limit=0, memory_limit=0):
+    """Returns dictionary of keyword arguments for subprocess.Popen().
+
+    All standard streams will be piped. On Windows, the console window of the
+    child process will be hidden. On POSIX, the child process is started in a
+    new process group, if "new_process_group" is True, so it may be killed
+    along with its children, and limited to "cpu_limit" seconds of CPU time
+    and "memory_limit" MB of address space, if given.
+    """
+
+    subprocess_args = {
+        'bufsize': -1,
+        'shell': False,
+        'stdin': subprocess.PIPE,
+        'stdout': subprocess.PIPE,
+        'stderr': subprocess.PIPE,
+    }
+
+    # Hide console window on Windows.
+    if sublime.platform() == 'windows':
+        subprocess_args['startupinfo'] = subprocess.STARTUPINFO()
+        subprocess_args[
+            'startupinfo'].dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+    # Setup process group and resource limits on POSIX. Running Python code
+    # in the child via "preexec_fn" is not safe in the presence of threads, so
+    # new sessions are started by subprocess itself where supported (Python
+    # 3.2 and later), and resource limits are computed up front, leaving
+    # nothing but setrlimit() calls to the child.
+    elif new_process_group or cpu_limit or memory_limit:
+        setsid = new_process_group and not PY3
+        if new_process_group and PY3:
+            subprocess_args['start_new_session'] = True
+
+        limits = []
+        if resource is not None:
+            if cpu_limit:
+                limits.append(get_resource_limit(resource.RLIMIT_CPU, int(cpu_limit)))
+            if memory_limit:
+                limits.append(get_resource_limit(resource.RLIMIT_AS, int(memory_limit * 1024 * 1024)))
+
+        if setsid or limits:
+            def preexec():
+                if setsid:
+                    os.setsid()
+                for limit, value in limits:
+                    try:
+                        resource.setrlimit(limit, value)
+                    except (ValueError, EnvironmentError) as e:
+                        pass
+
+            subprocess_args['preexec_fn'] = preexec
+
+    return subprocess_args
+
+
 # Return, whether string can be encoded in ASCII without losing information.
 def is_ascii_safe_string(input):
     """Returns True, if string passed in "input" can be safely encoded in ASCII, False otherwise."""
@@ -219,6 +812,136 @@ def is_valid_perltidy_cmd(cmd, cmd_source=None, logger=PerlTidyNullLogger()):
     return False
 
 
+# Join multiple regions of Perl code into a single perltidy input.
+def join_perltidy_regions(inputs):
+    """Returns tuple (input, separator) for tidying all strings in "inputs" at once.
+
+    Regions are separated by full-line comments containing a unique token,
+    which perltidy will leave alone (apart from indentation and blank lines).
+    Use split_perltidy_regions() with the returned separator to split the
+    perltidy output back into regions.
+    """
+
+    separator = 'PerlTidy-region-separator-' + uuid.uuid4().hex
+    parts = []
+
+    for input in inputs:
+        parts.append(input)
+        if not input.endswith('\n'):
+            parts.append('\n')
+        parts.append('# ' + separator + '\n')
+
+    return ''.join(parts), separator
+
+
+# Split perltidy output of regions joined by join_perltidy_regions().
+def split_perltidy_regions(output, separator, count, inputs=None):
+    """Returns list of "count" outputs split from perltidy "output" at "separator".
+
+    Returns None, if the number of regions found does not match "count",
+    i.e. because perltidy treated a separator as part of a string or heredoc.
+    If the joined "inputs" are given, outputs keep the trailing blank lines
+    of their inputs.
+    """
+
+    parts = re.compile(r'^[ \t]*# ' + re.escape(separator) + r'[ \t]*(?:\n|\Z)', re.MULTILINE).split(output)
+    if len(parts) != count + 1 or parts[-1].strip():
+        return None
+
+    # perltidy may insert or remove blank lines before the separator
+    # comments, so normalize trailing newlines.
+    if inputs is None:
+        inputs = [''] * count
+    return [part.rstrip('\n') + '\n' * max(len(input) - len(input.rstrip('\n')), 1) if part.strip() else ''
+            for part, input in zip(parts[:-1], inputs)]
+
+
+# First perltidy version supporting "-utf8" (aka "--character-encoding=utf8").
+PERLTIDY_UTF8_MIN_VERSION = 20120701
+
+
+# Check, if given perltidy version supports "-utf8".
+def perltidy_supports_utf8(version):
+    """Returns False, if perltidy "version" is known not to support "-utf8", True otherwise.
+
+    Unknown versions (None or non-date versions) are assumed to support it.
+    """
+
+    m = re.match(r'(\d{8})', version or '')
+    if m is None:
+        return True
+
+    return int(m.group(1)) >= PERLTIDY_UTF8_MIN_VERSION
+
+
+# Long names of perltidy options, which are relevant for running perltidy.
+PERLTIDY_PROBED_OPTIONS = [
+    'assert-tidy',
+    'character-encoding',
+    'output-line-ending',
+    'standard-error-output',
+    'standard-output',
+]
+
+
+class PerlTidyCapabilities(object):
+
+    """Version, supported options and startup time of a perltidy command.
+
+    "options" maps long option names given in PERLTIDY_PROBED_OPTIONS to
+    whether they are supported, or is None, if options are unknown.
+    "startup_time" is the time in seconds "perltidy -v" took. Capabilities
+    default to those of a recent perltidy. See capabilities module for
+    probing.
+    """
+
+    # I/O modes for passing input to perltidy.
+    PIPE = 'pipe'
+    PIPE_UTF8 = 'pipe_utf8'
+    TEMP_FILES = 'temp_files'
+
+    def __init__(self, version=None, options=None, startup_time=None):
+        self.version = version
+        self.options = options
+        self.startup_time = startup_time
+
+    # Return, whether perltidy supports option with given long name. Without
+    # probed options, perltidy is assumed to be recent enough, except for
+    # "-utf8", which depends on the version. "-utf8" is not a long name, but
+    # an abbreviation of "--character-encoding=utf8", so it is supported along
+    # with "--character-encoding".
+    def supports(self, option):
+        if option == 'utf8':
+            if self.options is not None and 'character-encoding' in self.options:
+                return self.options['character-encoding']
+            return perltidy_supports_utf8(self.version)
+        if self.options is not None and option in self.options:
+            return self.options[option]
+        return True
+
+    # Return fastest I/O mode for passing input to perltidy.
+    def get_io_mode(self, ascii_only):
+        """Returns PIPE for ASCII input, PIPE_UTF8, if perltidy supports "-utf8", or TEMP_FILES."""
+
+        if ascii_only:
+            return self.PIPE
+        if self.supports('utf8'):
+            return self.PIPE_UTF8
+        return self.TEMP_FILES
+
+    # Check, whether input may be streamed through perltidy, which requires
+    # passing UTF-8 via pipes and LF line endings in output.
+    def supports_streaming(self):
+        return self.supports('utf8') and self.supports('output-line-ending')
+
+    def to_dict(self):
+        return {'version': self.version, 'options': self.options, 'startup_time': self.startup_time}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(version=data.get('version'), options=data.get('options'), startup_time=data.get('startup_time'))
+
+
 # Pretty print given string for diagnostic output.
 def pp(string):
     """Return a pretty printed representation of string for debugging/logging purposes."""
@@ -238,12 +961,21 @@ def pp(string):
 
 # Tidy given region; returns True on success or False on perltidy runtime
 # error.
-def run_perltidy(cmd, input, logger=PerlTidyNullLogger()):
+def run_perltidy(cmd, input, logger=PerlTidyNullLogger(), capabilities=PerlTidyCapabilities(),
+                 timer=PerlTidyNullTimer(), timeout=0, cpu_limit=0, memory_limit=0):
     """Run perltidy using given "cmd" and "input".
 
     Runs perltidy specified by "cmd" and passes data given in "input" to
-    perltidy. Returns following tuple: (success, output, error_output,
-    error_hints).
+    perltidy, using the fastest I/O mode and options supported according to
+    "capabilities" (see PerlTidyCapabilities): non-ASCII input is passed via
+    pipes using "-utf8", if supported, otherwise temporary files are used.
+    Stages are timed using "timer". Returns following tuple: (success,
+    output, error_output, error_hints).
+
+    perltidy is stopped, if it runs longer than "timeout" seconds or is
+    cancelled via cancel_perltidy_processes(), raising PerlTidyAbortedError.
+    On POSIX, perltidy is limited to "cpu_limit" seconds of CPU time and
+    "memory_limit" MB of memory, if given.
     """
 
     if type(cmd) is not list:
@@ -254,114 +986,106 @@ def run_perltidy(cmd, input, logger=PerlTidyNullLogger()):
             'Argument "input" passed to run_perltidy() must be a string')
 
     # Prepare arguments for subprocess call.
-    subprocess_args = {
-        'bufsize': -1,
-        'shell': False,
-        'stdin': subprocess.PIPE,
-        'stdout': subprocess.PIPE,
-        'stderr': subprocess.PIPE,
-    }
-
-    # Hide console window on Windows.
-    if sublime.platform() == 'windows':
-        subprocess_args['startupinfo'] = subprocess.STARTUPINFO()
-        subprocess_args[
-            'startupinfo'].dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    subprocess_args = get_subprocess_args(new_process_group=True, cpu_limit=cpu_limit, memory_limit=memory_limit)
 
     cmd_final = []
     cmd_final.extend(cmd)
 
     # Ensure, that perltidy always returns LF line endings, so we match the
-    # internal buffer line endings.
-    cmd_final.append('-ole=unix')
-
-    # Check, if the data to be tidied has any non-ASCII characters. If yes,
-    # prepare temporary files for input and output with UTF-8 encoding, and
-    # spool the input to file. Adjust perltidy call, so data will be read and
-    # written from/to temporary files.
-    use_temporary_files = False
+    # internal buffer line endings. Line endings are converted after running
+    # perltidy versions not supporting "-ole".
+    convert_line_endings = not capabilities.supports('output-line-ending')
+    if not convert_line_endings:
+        cmd_final.append('-ole=unix')
+
+    # Encode input once. If it has any non-ASCII characters (i.e. it grows
+    # when encoding), pass it to perltidy as UTF-8 via pipes, telling
+    # perltidy about the encoding. Only perltidy versions not supporting
+    # "-utf8" need the input to be spooled to and read back from temporary
+    # files with UTF-8 encoding.
+    input_bytes = input.encode('utf-8')
+    io_mode = capabilities.get_io_mode(len(input_bytes) == len(input))
+    use_temporary_files = io_mode == PerlTidyCapabilities.TEMP_FILES
 
-    if is_ascii_safe_string(input):
-        input = input.encode('ascii')       # convert input from str to bytes
-    else:
-        use_temporary_files = True
+    if io_mode == PerlTidyCapabilities.PIPE_UTF8:
+        cmd_final.append('-utf8')
+    if not use_temporary_files:
+        input = input_bytes
 
     if use_temporary_files:
         # Create temporary files for input/output and reopen them with
         # codecs.open, so we can specify an encoding for the files. At least
         # with Python 2.6, there seems to be no other option.
-        perltidy_input_fh, perltidy_input_filepath = tempfile.mkstemp()
-        perltidy_output_fh, perltidy_output_filepath = tempfile.mkstemp()
-        os.close(perltidy_input_fh)
-        os.close(perltidy_output_fh)
-
-        with codecs.open(perltidy_input_filepath, 'w+b', encoding='utf-8') as fh:
-            fh.write(input)
-        input = None
-
-        cmd_final.append('-nst')
+        with timer.span('temp_files'):
+            perltidy_input_fh, perltidy_input_filepath = tempfile.mkstemp()
+            perltidy_output_fh, perltidy_output_filepath = tempfile.mkstemp()
+            os.close(perltidy_input_fh)
+            os.close(perltidy_output_fh)
+
+            with codecs.open(perltidy_input_filepath, 'w+b', encoding='utf-8') as fh:
+                fh.write(input)
+            input = None
+
+        if capabilities.supports('standard-output'):
+            cmd_final.append('-nst')
         cmd_final.append(perltidy_input_filepath)
         cmd_final.append('-o=' + perltidy_output_filepath)
 
-    # If running under Python 2.x, ensure that neither cmd_final nor
-    # subprocess_args contain unicode keys or values (convert to str).
-    # Otherwise we get a nice exception from subprocess.Popen().
-    if PY2:
-        cmd_final = map(lambda x: str(x) if isinstance(x, unicode) else x, cmd_final)
-        subprocess_args_final = {}
-
-        for k in subprocess_args.keys():
-            if isinstance(k, unicode):
-                subprocess_args_final[str(k)] = subprocess_args[k]
-            else:
-                subprocess_args_final[k] = subprocess_args[k]
-
-        subprocess_args = subprocess_args_final
+    cmd_final, subprocess_args = subprocess_safe_args(cmd_final, subprocess_args)
 
     # Show time!
     success, output, error_output, error_hints = False, None, None, []
     logger.log(1, 'Running command: ' + pp(cmd_final))
 
-    orig_cygwin_environ = None
-    orig_lang_environ = None
+    watch = None
 
     try:
-        # On Windows, ensure, that we have CYGWIN environment variables set,
-        # even if we don't known, whether we actually are using Cygwin.
-        if sublime.platform() == 'windows':
-            if 'CYGWIN' in os.environ and not re.match(r'\bnodosfilewarning\b', os.environ['CYGWIN']):
-                orig_cygwin_environ = os.environ['CYGWIN']
-                os.environ['CYGWIN'] += ' nodosfilewarning'
-            else:
-                os.environ['CYGWIN'] = 'nodosfilewarning'
-
-            if 'LANG' in os.environ:
-                orig_lang_environ = os.environ['LANG']
-            os.environ['LANG'] = 'C'
+        with timer.span('spawn'):
+            with perltidy_environment():
+                p = subprocess.Popen(cmd_final, **subprocess_args)
 
-        p = subprocess.Popen(cmd_final, **subprocess_args)
-
-        output, error_output = p.communicate(input)
+        with timer.span('communicate'):
+            with PerlTidyProcessWatch(p, timeout=timeout, logger=logger) as watch:
+                output, error_output = p.communicate(input)
         logger.log(2, 'Command exited with code: {0}'.format(p.returncode))
 
+        # Discard any partial output, if perltidy has been stopped.
+        if watch.reason is not None:
+            raise watch.error()
+
         # If we're using temporary files for I/O, load output from output file
         # and cleanup temporary files. Otherwise decode pipe output from bytes
         # to str.
         if use_temporary_files:
-            with codecs.open(perltidy_output_filepath, 'rb', encoding='utf-8') as fh:
-                output = fh.read()
+            with timer.span('temp_files'):
+                with codecs.open(perltidy_output_filepath, 'rb', encoding='utf-8') as fh:
+                    output = fh.read()
         else:
             output = output.decode('utf-8')
 
+        if convert_line_endings:
+            output = output.replace('\r\n', '\n').replace('\r', '\n')
+
         # Decode error output (if any), otherwise clear it and set success.
+        # perltidy killed by a signal (i.e. on exceeding its CPU limit) may
+        # leave truncated output without any error output.
         if error_output:
             error_output = error_output.decode('utf-8')
+        elif p.returncode < 0:
+            error_output = 'perltidy was terminated by signal {0}\n'.format(-p.returncode)
+            if cpu_limit or memory_limit:
+                error_hints.append('perltidy may have exceeded user setting "perltidy_cpu_limit" or ' +
+                                   '"perltidy_memory_limit".')
         else:
             success = True
             error_output = ''
 
     # Handle OS errors. Check, if we can give the user some hints.
     except (WindowsError, EnvironmentError) as e:
+        # Writing to perltidy may fail, if it has been stopped.
+        if watch is not None and watch.reason is not None:
+            raise watch.error()
+
         logger.log(0, 'Unable to run perltidy: ' + pp(cmd_final))
         logger.log(0, 'Error was: ' + repr(e))
 
@@ -383,23 +1107,197 @@ def run_perltidy(cmd, input, logger=PerlTidyNullLogger()):
     finally:
         # Cleanup.
         if use_temporary_files and not get_perltidy_env_flag('keep_temp_files'):
-            os.unlink(perltidy_input_filepath)
-            os.unlink(perltidy_output_filepath)
+            for filepath in [perltidy_input_filepath, perltidy_output_filepath]:
+                try:
+                    os.unlink(filepath)
+                except (EnvironmentError) as e:
+                    logger.log(1, 'Unable to remove temporary file {0}: {1}'.format(filepath, repr(e)))
 
-        if sublime.platform() == 'windows':
+    return success, output, error_output, error_hints
 
-            # Restore environment variables.
-            if orig_cygwin_environ is None:
-                del os.environ['CYGWIN']
-            else:
-                os.environ['CYGWIN'] = orig_cygwin_environ
 
-            if orig_lang_environ is None:
-                del os.environ['LANG']
+# Number of bytes read from perltidy's standard output at once, when
+# streaming.
+PERLTIDY_STREAM_READ_SIZE = 64 * 1024
+
+
+# Tidy input given in chunks, streaming it through perltidy.
+def run_perltidy_streaming(cmd, chunks, logger=PerlTidyNullLogger(), timer=PerlTidyNullTimer(), timeout=0,
+                           cpu_limit=0, memory_limit=0):
+    """Run perltidy using given "cmd" on input given as iterable "chunks" of strings.
+
+    Like run_perltidy(), but never holds the entire input: chunks are encoded
+    and written to perltidy one at a time from a separate thread, while
+    output is read in blocks of PERLTIDY_STREAM_READ_SIZE bytes and decoded
+    incrementally. Output is returned as list of decoded chunks instead of a
+    single string, as joining them would need a second copy, so peak memory
+    use stays close to a single copy of the output. perltidy must support
+    "-utf8" and "-ole", see PerlTidyCapabilities.supports_streaming().
+    Exceptions raised while iterating "chunks" stop perltidy,
+    PerlTidyAbortedError is re-raised. Returns tuple (success, output,
+    error_output, error_hints).
+    """
+
+    if type(cmd) is not list:
+        raise ValueError(
+            'Argument "cmd" passed to run_perltidy_streaming() must be a list')
+
+    subprocess_args = get_subprocess_args(new_process_group=True, cpu_limit=cpu_limit, memory_limit=memory_limit)
+    cmd_final, subprocess_args = subprocess_safe_args(cmd + ['-ole=unix', '-utf8'], subprocess_args)
+
+    logger.log(1, 'Streaming through command: ' + pp(cmd_final))
+
+    pieces = []
+    error_pieces = []
+    write_errors = []
+    error_hints = []
+
+    # Feed chunks to perltidy. Stops perltidy, if chunks cannot be produced.
+    def write_input():
+        try:
+            for chunk in chunks:
+                p.stdin.write(chunk.encode('utf-8'))
+        except (Exception) as e:
+            write_errors.append(e)
+            if not isinstance(e, EnvironmentError):
+                kill_perltidy_process(p)
+        finally:
+            try:
+                p.stdin.close()
+            except (EnvironmentError) as e:
+                pass
+
+    def read_error_output():
+        error_pieces.append(p.stderr.read())
+
+    try:
+        with timer.span('spawn'):
+            with perltidy_environment():
+                p = subprocess.Popen(cmd_final, **subprocess_args)
+    except (EnvironmentError) as e:
+        logger.log(0, 'Unable to run perltidy: ' + pp(cmd_final))
+        logger.log(0, 'Error was: ' + repr(e))
+        return False, None, None, error_hints
+
+    with timer.span('communicate'):
+        with PerlTidyProcessWatch(p, timeout=timeout, logger=logger) as watch:
+            threads = [threading.Thread(target=write_input), threading.Thread(target=read_error_output)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            while True:
+                data = p.stdout.read(PERLTIDY_STREAM_READ_SIZE)
+                if not data:
+                    break
+                pieces.append(decoder.decode(data))
+            pieces.append(decoder.decode(b'', True))
+            p.stdout.close()
+
+            for thread in threads:
+                thread.join()
+            p.wait()
+    logger.log(2, 'Command exited with code: {0}'.format(p.returncode))
+
+    # Discard any partial output, if perltidy or producing chunks has been
+    # stopped.
+    if watch.reason is not None:
+        raise watch.error()
+    for e in write_errors:
+        if isinstance(e, PerlTidyAbortedError):
+            raise e
+
+    error_output = b''.join(error_pieces).decode('utf-8', 'replace')
+    if error_output:
+        return False, None, error_output, error_hints
+
+    if p.returncode < 0:
+        error_output = 'perltidy was terminated by signal {0}\n'.format(-p.returncode)
+        if cpu_limit or memory_limit:
+            error_hints.append('perltidy may have exceeded user setting "perltidy_cpu_limit" or ' +
+                               '"perltidy_memory_limit".')
+        return False, None, error_output, error_hints
+
+    if write_errors:
+        return False, None, 'Unable to pass input to perltidy: {0!r}\n'.format(write_errors[0]), error_hints
+
+    return True, pieces, '', error_hints
+
+
+# Setup environment for spawning perltidy. On Windows, ensure, that we have
+# CYGWIN environment variables set, even if we don't known, whether we
+# actually are using Cygwin, and restore them afterwards.
+@contextlib.contextmanager
+def perltidy_environment():
+    if sublime.platform() != 'windows':
+        yield
+        return
+
+    orig_cygwin_environ = None
+    orig_lang_environ = None
+
+    if 'CYGWIN' in os.environ and not re.match(r'\bnodosfilewarning\b', os.environ['CYGWIN']):
+        orig_cygwin_environ = os.environ['CYGWIN']
+        os.environ['CYGWIN'] += ' nodosfilewarning'
+    else:
+        os.environ['CYGWIN'] = 'nodosfilewarning'
+
+    if 'LANG' in os.environ:
+        orig_lang_environ = os.environ['LANG']
+    os.environ['LANG'] = 'C'
+
+    try:
+        yield
+    finally:
+        # Restore environment variables.
+        if orig_cygwin_environ is None:
+            del os.environ['CYGWIN']
+        else:
+            os.environ['CYGWIN'] = orig_cygwin_environ
+
+        if orig_lang_environ is None:
+            del os.environ['LANG']
+        else:
+            os.environ['LANG'] = orig_lang_environ
+
+
+# Return tuple (limit, (soft, hard)) for lowering the soft limit of given
+# resource to given value in child processes via resource.setrlimit(). Limits
+# exceeding the hard limit of the current process are capped.
+def get_resource_limit(limit, value):
+    try:
+        soft, hard = resource.getrlimit(limit)
+    except (ValueError, EnvironmentError) as e:
+        hard = resource.RLIM_INFINITY
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    return limit, (value, hard)
+
+
+# Make command and subprocess arguments safe for subprocess.Popen().
+def subprocess_safe_args(cmd, subprocess_args):
+    """Returns tuple (cmd, subprocess_args) suitable for subprocess.Popen().
+
+    If running under Python 2.x, ensures, that neither "cmd" nor
+    "subprocess_args" contain unicode keys or values (converts them to str).
+    Otherwise we get a nice exception from subprocess.Popen(). Under Python
+    3.x, both arguments are returned unchanged.
+    """
+
+    if PY2:
+        cmd = [str(x) if isinstance(x, unicode) else x for x in cmd]
+        subprocess_args_final = {}
+
+        for k in subprocess_args.keys():
+            if isinstance(k, unicode):
+                subprocess_args_final[str(k)] = subprocess_args[k]
             else:
-                os.environ['LANG'] = orig_lang_environ
+                subprocess_args_final[k] = subprocess_args[k]
 
-    return success, output, error_output, error_hints
+        subprocess_args = subprocess_args_final
+
+    return cmd, subprocess_args
 
 
 # Returns given PerlTidy environment flag. Used for test suite support.
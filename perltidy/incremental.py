@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import bisect
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from .diff import diff_line_ranges, split_lines
+from .helpers import PerlTidyNullLogger, string_types
+from .linehash import dump_row_hashes, hash_rows, load_row_hashes
+
+
+# First line of a top-level sub or package declaration.
+TOP_LEVEL_BLOCK_RE = re.compile(r'(?:sub|package)\s+[A-Za-z_:\']')
+
+# Here-document operators, capturing the terminator.
+HEREDOC_RE = re.compile(r'<<(~?)(?:\s*"([^"\n]*)"|\s*\'([^\'\n]*)\'|([A-Za-z_]\w*))')
+
+# Quoted strings and escaped characters, which may contain braces or "#".
+QUOTED_RE = re.compile(r'\\.|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+
+# Comments. "$#array" and "s#...#...#" are not comments.
+COMMENT_RE = re.compile(r'(?:^|(?<=[\s;{}()]))#.*')
+
+# Code continuing the preceding statement, i.e. "} else {" or chained
+# operators.
+CONTINUATION_RE = re.compile(r'(?:else|elsif|continue|until|while|and|or|xor)\b|(?:\|\||&&|//|->|[-+*/.,?:;=)\]}])')
+
+
+# Find lines starting top-level blocks in Perl code.
+def find_top_level_blocks(lines):
+    """Returns sorted list of indices of lines in "lines" starting a top-level block.
+
+    Line 0 always starts a block. Further blocks start at top-level "sub" or
+    "package" declarations at column 0 (including comments directly above
+    them), which are preceded by a blank line, so perltidy tidies each block
+    the same regardless of its surroundings. Blocks extend up to the next
+    block. The scan is deliberately conservative: once it gets confused by
+    unbalanced braces, POD, here-documents or __END__/__DATA__, no further
+    blocks are reported, so tidying falls back to larger blocks.
+    """
+
+    blocks = [0]
+    depth = 0
+    in_pod = False
+    heredocs = []
+
+    for index, line in enumerate(lines):
+        if heredocs:
+            indent, terminator = heredocs[0]
+            if (line.strip() if indent else line.rstrip('\r\n')) == terminator:
+                heredocs.pop(0)
+            continue
+
+        if in_pod:
+            if line.startswith('=cut'):
+                in_pod = False
+            continue
+
+        if re.match(r'=[A-Za-z]', line):
+            in_pod = True
+            continue
+
+        if re.match(r'__(?:END|DATA)__\b', line):
+            break
+
+        if depth == 0 and index > 0 and TOP_LEVEL_BLOCK_RE.match(line):
+            begin = index
+            while begin > 0 and lines[begin - 1].startswith('#'):
+                begin -= 1
+            if begin > blocks[-1] and (begin == 0 or not lines[begin - 1].strip()):
+                blocks.append(begin)
+
+        for match in HEREDOC_RE.finditer(line):
+            heredocs.append((match.group(1) == '~', match.group(2) or match.group(3) or match.group(4)))
+
+        code = COMMENT_RE.sub('', QUOTED_RE.sub('', line))
+        depth += code.count('{') - code.count('}')
+        if depth < 0:
+            break
+
+    return blocks
+
+
+# Find lines starting top-level statements in Perl code.
+def find_top_level_statements(lines):
+    """Returns sorted list of indices of lines in "lines" starting a top-level statement.
+
+    Line 0 always starts a statement. Further statements start on the line
+    following the end of a statement at nesting depth 0, i.e. a line ending
+    in ";" or a closing brace, unless the next line of code continues it
+    ("} else {", chained operators). Blank lines, comments and POD in
+    between belong to the following statement, here-documents to the
+    statement introducing them. Like find_top_level_blocks(), the scan stops
+    reporting statements once it gets confused.
+    """
+
+    return _scan_top_level_statements(lines)[0]
+
+
+# Check, if Perl code consists of complete top-level statements only.
+def is_top_level_perl_code(lines):
+    """Returns True, if "lines" consist of complete top-level statements only.
+
+    That is, the scan of find_top_level_statements() gets through all lines
+    without getting confused, all braces, parens and brackets are balanced,
+    the first line of code does not continue a preceding statement and the
+    last statement is terminated, i.e. no POD, here-document or statement
+    continues beyond the last line. Code like this may be tidied
+    together with other code without either affecting the other.
+    """
+
+    return _scan_top_level_statements(lines)[1]
+
+
+# Scan Perl code for top-level statements. Returns tuple (statements,
+# complete), see find_top_level_statements() and is_top_level_perl_code().
+def _scan_top_level_statements(lines):
+    statements = [0]
+    depth = 0
+    in_pod = False
+    heredocs = []
+    pending = None          # line following the end of the last statement
+    started = False         # whether any code has been seen yet
+    continued = False       # whether the first line of code continues a statement
+    terminated = True       # whether the last line of code ends a statement
+
+    for index, line in enumerate(lines):
+        if heredocs:
+            indent, terminator = heredocs[0]
+            if (line.strip() if indent else line.rstrip('\r\n')) == terminator:
+                heredocs.pop(0)
+                if not heredocs and pending is not None:
+                    pending = index + 1
+            continue
+
+        if in_pod:
+            if line.startswith('=cut'):
+                in_pod = False
+            continue
+
+        if re.match(r'=[A-Za-z]', line):
+            in_pod = True
+            continue
+
+        if re.match(r'__(?:END|DATA)__\b', line):
+            return statements, False
+
+        code = COMMENT_RE.sub('', QUOTED_RE.sub('', line)).strip()
+        if not code:
+            continue
+
+        if pending is not None:
+            if pending > statements[-1] and not CONTINUATION_RE.match(code):
+                statements.append(pending)
+            pending = None
+        elif not started and CONTINUATION_RE.match(code):
+            continued = True
+        started = True
+
+        for match in HEREDOC_RE.finditer(line):
+            heredocs.append((match.group(1) == '~', match.group(2) or match.group(3) or match.group(4)))
+
+        depth += len(re.findall(r'[{(\[]', code)) - len(re.findall(r'[})\]]', code))
+        if depth < 0:
+            return statements, False
+        terminated = depth == 0 and code.endswith((';', '}'))
+        if terminated:
+            pending = index + 1
+
+    return statements, not continued and terminated and not heredocs and not in_pod
+
+
+# Determine top-level blocks of Perl code, which have changed.
+def find_changed_blocks(old, new, find_blocks=find_top_level_blocks):
+    """Returns list of tuples (begin, end) of offsets into "new" of top-level blocks changed compared to "old".
+
+    "old" is the text as of the last tidy, or the hashes of its rows (see
+    hash_rows()), as rows are compared by their hashes. Blocks are
+    determined by "find_blocks", see find_top_level_blocks() and
+    find_top_level_statements(). Adjacent changed blocks are merged. Returns
+    an empty list, if nothing changed.
+    """
+
+    if old == new:
+        return []
+
+    old_hashes = hash_rows(old) if isinstance(old, string_types) else old
+    new_hashes = hash_rows(new)
+    new_lines = split_lines(new)
+    if not new_lines or old_hashes == new_hashes:
+        return []
+
+    blocks = find_blocks(new_lines)
+    changed = set()
+
+    # Row indices equal line indices, but for the empty last row of texts
+    # ending in a line ending, which belongs to the last line.
+    for i1, i2, j1, j2 in diff_line_ranges(old_hashes, new_hashes):
+        if j1 == j2:
+            # Lines have been removed in between two lines, both of which
+            # may be part of different blocks.
+            first, last = max(j1 - 1, 0), j1
+        else:
+            first, last = j1, j2 - 1
+        first, last = min(first, len(new_lines) - 1), min(last, len(new_lines) - 1)
+
+        first_block = bisect.bisect_right(blocks, first) - 1
+        last_block = bisect.bisect_right(blocks, last) - 1
+        changed.update(range(first_block, last_block + 1))
+
+    # Offsets of lines within "new".
+    offsets = [0]
+    for line in new_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    ranges = []
+    for block in sorted(changed):
+        begin = offsets[blocks[block]]
+        end = offsets[blocks[block + 1]] if block + 1 < len(blocks) else offsets[-1]
+        if ranges and ranges[-1][1] == begin:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((begin, end))
+
+    return ranges
+
+
+# Maximum number of files with row hashes remembered on disk, see
+# save_perltidy_baseline().
+PERLTIDY_BASELINES_MAX_FILES = 1000
+
+# Tuples (args, perltidyrc_fingerprint, perltidy_version, row_hashes) of
+# views as of their last successful tidy, keyed by view ID. Row hashes take
+# 8 bytes per row, see hash_rows().
+_perltidy_baselines = {}
+_perltidy_baselines_lock = threading.Lock()
+
+
+# Remember row hashes of view with given ID after tidying using given
+# perltidy arguments, perltidyrc (see get_perltidyrc_fingerprint()) and
+# perltidy version.
+def set_perltidy_baseline(view_id, row_hashes, args, perltidyrc_fingerprint=None, perltidy_version=None):
+    with _perltidy_baselines_lock:
+        _perltidy_baselines[view_id] = (list(args), perltidyrc_fingerprint, perltidy_version, row_hashes)
+
+
+# Return row hashes of view with given ID as of its last tidy using given
+# perltidy arguments, perltidyrc and perltidy version, or None.
+def get_perltidy_baseline(view_id, args, perltidyrc_fingerprint=None, perltidy_version=None):
+    with _perltidy_baselines_lock:
+        baseline = _perltidy_baselines.get(view_id)
+    if baseline is None or baseline[:3] != (list(args), perltidyrc_fingerprint, perltidy_version):
+        return None
+    return baseline[3]
+
+
+# Forget row hashes of view with given ID, i.e. when view has been closed.
+def clear_perltidy_baseline(view_id):
+    with _perltidy_baselines_lock:
+        _perltidy_baselines.pop(view_id, None)
+
+
+# Return path of file remembering row hashes of given file within given
+# directory.
+def get_perltidy_baseline_path(file_name, directory):
+    return os.path.join(directory, hashlib.sha1(file_name.encode('utf-8')).hexdigest())
+
+
+# Write row hashes of view with given ID as of its last tidy to given
+# directory, keyed by its file name.
+def save_perltidy_baseline(view_id, file_name, directory, logger=PerlTidyNullLogger()):
+    """Writes the baseline of "view_id" to a file within "directory", see load_perltidy_baseline().
+
+    The file consists of a line of JSON containing the file name, the
+    perltidy arguments, perltidyrc fingerprint and perltidy version, followed
+    by the serialized row hashes. Only the PERLTIDY_BASELINES_MAX_FILES most
+    recently written files are kept.
+    """
+
+    with _perltidy_baselines_lock:
+        baseline = _perltidy_baselines.get(view_id)
+    if baseline is None:
+        return
+
+    args, perltidyrc_fingerprint, perltidy_version, row_hashes = baseline
+    header = json.dumps({'file_name': file_name, 'args': args, 'perltidyrc_fingerprint': perltidyrc_fingerprint,
+                         'perltidy_version': perltidy_version}) + '\n'
+    data = header.encode('utf-8') + dump_row_hashes(row_hashes)
+
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Write to temporary file first, so readers never see partial files.
+        fh, temp_filepath = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        os.write(fh, data)
+        os.close(fh)
+
+        path = get_perltidy_baseline_path(file_name, directory)
+        if os.path.exists(path):
+            os.unlink(path)
+        os.rename(temp_filepath, path)
+    except (EnvironmentError) as e:
+        logger.log(1, 'Unable to write row hashes: ' + repr(e))
+        return
+
+    logger.log(2, 'Saved {0} row hashes of {1}'.format(len(row_hashes), file_name))
+    _evict_perltidy_baselines(directory)
+
+
+# Load row hashes of given file written by save_perltidy_baseline() from given
+# directory as baseline of view with given ID. Returns True, if loaded.
+def load_perltidy_baseline(view_id, file_name, directory, logger=PerlTidyNullLogger()):
+    path = get_perltidy_baseline_path(file_name, directory)
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        header, data = data.split(b'\n', 1)
+        header = json.loads(header.decode('utf-8'))
+    except (EnvironmentError, ValueError) as e:
+        return False
+
+    row_hashes = load_row_hashes(data)
+    if row_hashes is None or header.get('file_name') != file_name or not isinstance(header.get('args'), list):
+        logger.log(1, 'Ignoring invalid row hashes in ' + path)
+        return False
+
+    set_perltidy_baseline(view_id, row_hashes, header['args'], header.get('perltidyrc_fingerprint'),
+                          header.get('perltidy_version'))
+    logger.log(2, 'Loaded {0} row hashes of {1}'.format(len(row_hashes), file_name))
+    return True
+
+
+# Remove least recently written files with row hashes from given directory,
+# keeping PERLTIDY_BASELINES_MAX_FILES files.
+def _evict_perltidy_baselines(directory):
+    try:
+        filenames = [f for f in os.listdir(directory) if not f.startswith('.')]
+    except (EnvironmentError) as e:
+        return
+
+    if len(filenames) <= PERLTIDY_BASELINES_MAX_FILES:
+        return
+
+    entries = []
+    for filename in filenames:
+        filepath = os.path.join(directory, filename)
+        try:
+            entries.append((os.stat(filepath).st_mtime, filepath))
+        except (EnvironmentError) as e:
+            continue
+
+    entries.sort()
+    for mtime, filepath in entries[:len(entries) - PERLTIDY_BASELINES_MAX_FILES]:
+        try:
+            os.unlink(filepath)
+        except (EnvironmentError) as e:
+            pass
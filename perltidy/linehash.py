@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Hashes of rows of views, for cheaply finding common leading and trailing rows.
+
+Rows are lines without their line endings, numbered like within Sublime Text
+(a text ending in LF has an empty last row). Indexes of row hashes are kept
+per buffer and updated incrementally whenever the buffer is modified, so
+tidying the entire view only needs to hash perltidy's output.
+
+Row hashes are stable across processes and stored in arrays of 64-bit
+integers (8 bytes per row), so they may be kept for huge views and written
+to disk as is.
+"""
+
+from __future__ import print_function, unicode_literals
+import array
+import struct
+import sys
+import threading
+import zlib
+
+from .diff import diff_hunks
+
+
+# Type code of arrays of row hashes. Python 2 lacks "Q", its "L" is 64 bits
+# wide on most 64-bit platforms, otherwise hashes are truncated to 32 bits.
+try:
+    ROW_HASH_TYPECODE = str('Q')
+    array.array(ROW_HASH_TYPECODE)
+except (ValueError) as e:
+    ROW_HASH_TYPECODE = str('L')
+
+ROW_HASH_SIZE = array.array(ROW_HASH_TYPECODE).itemsize
+ROW_HASH_MASK = (1 << (8 * ROW_HASH_SIZE)) - 1
+
+# Header of serialized row hashes, followed by the size of a hash in bytes.
+ROW_HASHES_MAGIC = b'PerlTidyRows1'
+
+
+# Return hash of given row (without line ending).
+def hash_row(row):
+    """Returns 64-bit hash of "row", combining CRC-32 and Adler-32 of its UTF-8 encoding.
+
+    Unlike hash(), the result does not change between processes, so it may
+    be persisted.
+    """
+
+    data = row.encode('utf-8', 'replace')
+    return (((zlib.crc32(data) & 0xffffffff) << 32) | (zlib.adler32(data) & 0xffffffff)) & ROW_HASH_MASK
+
+
+# Return hashes of rows of given text.
+def hash_rows(text):
+    """Returns array of hashes of rows of "text", i.e. of text.split('\\n')."""
+
+    return make_row_hashes(hash_row(row) for row in text.split('\n'))
+
+
+# Return array of row hashes containing given hashes.
+def make_row_hashes(hashes=()):
+    return array.array(ROW_HASH_TYPECODE, hashes)
+
+
+# Serialize given array of row hashes.
+def dump_row_hashes(hashes):
+    """Returns bytes containing "hashes" in little-endian byte order, see load_row_hashes()."""
+
+    if sys.byteorder != 'little':
+        hashes = make_row_hashes(hashes)
+        hashes.byteswap()
+    data = hashes.tobytes() if hasattr(hashes, 'tobytes') else hashes.tostring()
+    return ROW_HASHES_MAGIC + struct.pack(str('B'), ROW_HASH_SIZE) + data
+
+
+# Deserialize row hashes serialized by dump_row_hashes().
+def load_row_hashes(data):
+    """Returns array of row hashes, or None, if "data" is malformed or has been written using hashes of another size."""
+
+    header = ROW_HASHES_MAGIC + struct.pack(str('B'), ROW_HASH_SIZE)
+    if not data.startswith(header) or (len(data) - len(header)) % ROW_HASH_SIZE:
+        return None
+
+    hashes = make_row_hashes()
+    if hasattr(hashes, 'frombytes'):
+        hashes.frombytes(data[len(header):])
+    else:
+        hashes.fromstring(data[len(header):])
+    if sys.byteorder != 'little':
+        hashes.byteswap()
+    return hashes
+
+
+# Count common leading and trailing rows given their hashes.
+def count_common_rows(old_hashes, new_hashes):
+    """Returns tuple (leading, trailing) of numbers of rows with equal hashes.
+
+    Leading and trailing rows do not overlap and leave at least one row in
+    between in both "old_hashes" and "new_hashes", so the texts in between
+    are separated from leading and trailing rows by a line ending each.
+    """
+
+    limit = min(len(old_hashes), len(new_hashes)) - 1
+
+    leading = 0
+    while leading < limit and old_hashes[leading] == new_hashes[leading]:
+        leading += 1
+
+    trailing = 0
+    while leading + trailing < limit and old_hashes[-1 - trailing] == new_hashes[-1 - trailing]:
+        trailing += 1
+
+    return leading, trailing
+
+
+# Compute changed hunks between old and new text of an entire view using row
+# hashes.
+def diff_hunks_by_row_hashes(old, new, old_hashes=None, new_hashes=None):
+    """Returns list of hunks transforming "old" into "new", like diff_hunks().
+
+    Rows at the beginning and end of both texts with equal hashes (given or
+    computed via hash_rows()) are skipped without splitting and diffing their
+    text, so only the text in between is diffed. Skipped text is verified to
+    be equal by a single string comparison each nonetheless, falling back to
+    diffing the entire texts, if hashes are outdated.
+    """
+
+    if old == new:
+        return []
+
+    if old_hashes is None:
+        old_hashes = hash_rows(old)
+    if new_hashes is None:
+        new_hashes = hash_rows(new)
+
+    leading, trailing = count_common_rows(old_hashes, new_hashes)
+    if not leading and not trailing:
+        return diff_hunks(old, new)
+
+    # Common rows have equal lengths in both texts, so their offsets can be
+    # determined from "new" alone.
+    begin = 0
+    for row in range(leading):
+        begin = new.index('\n', begin) + 1
+
+    end = len(new)
+    for row in range(trailing):
+        end = new.rindex('\n', 0, end)
+
+    suffix_length = len(new) - end
+    if begin > len(old) - suffix_length or not old.startswith(new[:begin]) or not old.endswith(new[end:]):
+        return diff_hunks(old, new)
+
+    return [(begin + a, begin + b, replacement)
+            for a, b, replacement in diff_hunks(old[begin:len(old) - suffix_length], new[begin:end])]
+
+
+class PerlTidyRowIndex(object):
+
+    """Hashes of all rows of a buffer as of a given change count."""
+
+    def __init__(self, hashes, change_count):
+        self.hashes = hashes
+        self.change_count = change_count
+
+    # Replace hashes of rows "begin" up to and including "end" by given
+    # hashes.
+    def replace_rows(self, begin, end, hashes):
+        if not isinstance(hashes, array.array):
+            hashes = make_row_hashes(hashes)
+        self.hashes[begin:end + 1] = hashes
+
+
+# Row indexes keyed by buffer ID.
+_perltidy_row_indexes = {}
+_perltidy_row_indexes_lock = threading.Lock()
+
+
+# Return row index of buffer with given ID, or None.
+def get_perltidy_row_index(buffer_id):
+    with _perltidy_row_indexes_lock:
+        return _perltidy_row_indexes.get(buffer_id)
+
+
+# Remember row hashes of buffer with given ID as of given change count.
+def set_perltidy_row_index(buffer_id, hashes, change_count):
+    with _perltidy_row_indexes_lock:
+        _perltidy_row_indexes[buffer_id] = PerlTidyRowIndex(hashes, change_count)
+
+
+# Forget row index of buffer with given ID, i.e. when it has been closed or
+# cannot be updated.
+def clear_perltidy_row_index(buffer_id):
+    with _perltidy_row_indexes_lock:
+        _perltidy_row_indexes.pop(buffer_id, None)
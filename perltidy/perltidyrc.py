@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import os.path
+import re
+import threading
+
+from .helpers import PerlTidyNullLogger, find_perltidyrc_in_project, get_perltidyrc_paths_from_args, pp
+
+
+# Return outermost directory in "directories" containing "file_name".
+def find_project_root(file_name, directories):
+    """Returns outermost directory from "directories" containing "file_name", or None."""
+
+    roots = [os.path.abspath(d) for d in directories
+             if os.path.abspath(file_name).startswith(os.path.join(os.path.abspath(d), ''))]
+    if not roots:
+        return None
+
+    return min(roots, key=len)
+
+
+class PerlTidyrcResolver(object):
+
+    """Resolves perltidyrc files per directory and caches results.
+
+    Absolute perltidyrc paths are checked first, in the order given. For files
+    within a project folder, relative perltidyrc names are then searched for
+    upward from the file's directory up to the project folder, so nested
+    sub-projects may have their own perltidyrc. Results are cached per
+    directory. A cached result is reused, as long as the modification time of
+    the resolved perltidyrc is unchanged (a single stat). Changes to project
+    folders or perltidyrc names result in different cache entries.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Return perltidyrc path for given file, or None.
+    def resolve(self, file_name, directories, perltidyrc_paths, logger=PerlTidyNullLogger()):
+        directories = list(directories or [])
+        perltidyrc_paths = list(perltidyrc_paths or [])
+
+        start = os.path.dirname(os.path.abspath(file_name)) if file_name else None
+        key = (start, tuple(directories), tuple(perltidyrc_paths))
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is not None:
+            perltidyrc_path, mtime = entry
+            if self._mtime(perltidyrc_path) == mtime:
+                logger.log(2, 'Using cached perltidyrc: ' + pp(perltidyrc_path))
+                return perltidyrc_path
+
+        perltidyrc_path = self._search(file_name, directories, perltidyrc_paths, logger)
+
+        with self._lock:
+            self._entries[key] = (perltidyrc_path, self._mtime(perltidyrc_path))
+
+        return perltidyrc_path
+
+    # Drop all cached results.
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _search(self, file_name, directories, perltidyrc_paths, logger):
+        relative_paths = [p for p in perltidyrc_paths if not os.path.isabs(p)]
+
+        # Absolute paths take precedence.
+        for perltidyrc_path in perltidyrc_paths:
+            if not os.path.isabs(perltidyrc_path):
+                continue
+            logger.log(2, 'Checking for perltidyrc: ' + pp(perltidyrc_path))
+            if os.path.isfile(perltidyrc_path):
+                logger.log(1, 'Using perltidyrc: ' + pp(perltidyrc_path))
+                return perltidyrc_path
+
+        # Search upward from file's directory up to project root.
+        root = find_project_root(file_name, directories) if file_name else None
+        if root is not None:
+            directory = os.path.dirname(os.path.abspath(file_name))
+
+            while True:
+                for perltidyrc_name in relative_paths:
+                    perltidyrc_path = os.path.join(directory, perltidyrc_name)
+                    logger.log(2, 'Checking for perltidyrc: ' + pp(perltidyrc_path))
+                    if os.path.isfile(perltidyrc_path):
+                        logger.log(1, 'Using perltidyrc: ' + pp(perltidyrc_path))
+                        return perltidyrc_path
+
+                if directory == root or os.path.dirname(directory) == directory:
+                    break
+                directory = os.path.dirname(directory)
+
+        # Fall back to project folders, those containing the file first.
+        if file_name is not None:
+            file_name = os.path.abspath(file_name)
+            directories = [d for d in directories if file_name.startswith(os.path.join(d, ''))] + \
+                [d for d in directories if not file_name.startswith(os.path.join(d, ''))]
+
+        return find_perltidyrc_in_project(directories=directories, perltidyrc_paths=relative_paths, logger=logger)
+
+    def _mtime(self, path):
+        if path is None:
+            return None
+        try:
+            return os.stat(path).st_mtime
+        except (EnvironmentError) as e:
+            return -1
+
+
+# Process-wide perltidyrc resolver.
+_perltidyrc_resolver = PerlTidyrcResolver()
+
+
+# Return perltidyrc path for given file using the process-wide resolver.
+def resolve_perltidyrc(file_name, directories, perltidyrc_paths, logger=PerlTidyNullLogger()):
+    """Returns perltidyrc path to use for file "file_name", or None.
+
+    See PerlTidyrcResolver for details. "file_name" may be None for unsaved
+    views, in which case project folders given in "directories" are searched
+    in order, as done by find_perltidyrc_in_project().
+    """
+
+    return _perltidyrc_resolver.resolve(file_name, directories, perltidyrc_paths, logger=logger)
+
+
+# Drop all cached perltidyrc resolutions.
+def clear_perltidyrc_cache():
+    """Drops all cached results of resolve_perltidyrc()."""
+
+    _perltidyrc_resolver.clear()
+
+
+# Long names of perltidy options by their short names. Options taking a value
+# end in "=". Options not listed here are passed to perltidy as given.
+PERLTIDY_SHORT_NAMES = {
+    'anl': 'add-newlines', 'asbl': 'opening-anonymous-sub-brace-on-new-line', 'asc': 'add-semicolons',
+    'atnl': 'add-terminal-newline', 'aws': 'add-whitespace', 'b': 'backup-and-modify-in-place',
+    'bar': 'opening-brace-always-on-right', 'bbb': 'blanks-before-blocks', 'bbc': 'blanks-before-comments',
+    'bbs': 'blanks-before-subs', 'bbt': 'block-brace-tightness=', 'bbvt': 'block-brace-vertical-tightness=',
+    'bbvtl': 'block-brace-vertical-tightness-list=', 'bext': 'backup-file-extension=',
+    'bl': 'opening-brace-on-new-line', 'bli': 'brace-left-and-indent', 'boa': 'break-at-old-attribute-breakpoints',
+    'boc': 'break-at-old-comma-breakpoints', 'bok': 'break-at-old-keyword-breakpoints',
+    'bol': 'break-at-old-logical-breakpoints', 'bom': 'break-at-old-method-breakpoints',
+    'bot': 'break-at-old-ternary-breakpoints', 'bt': 'brace-tightness=', 'bvt': 'brace-vertical-tightness=',
+    'bvtc': 'brace-vertical-tightness-closing=', 'cab': 'comma-arrow-breakpoints=', 'cb': 'cuddled-blocks',
+    'ce': 'cuddled-else', 'ci': 'continuation-indentation=', 'conv': 'converge', 'csc': 'closing-side-comments',
+    'cscb': 'closing-side-comments-balanced', 'csci': 'closing-side-comment-interval=',
+    'cscl': 'closing-side-comment-list=', 'cscp': 'closing-side-comment-prefix=',
+    'csct': 'closing-side-comment-maximum-text=', 'cscw': 'closing-side-comment-warnings',
+    'cti': 'closing-token-indentation=', 'dac': 'delete-all-comments', 'dbc': 'delete-block-comments',
+    'dnl': 'delete-old-newlines', 'dp': 'delete-pod', 'dsc': 'delete-side-comments', 'dsm': 'delete-semicolons',
+    'dt': 'default-tabsize=', 'dws': 'delete-old-whitespace', 'et': 'entab-leading-whitespace=',
+    'fpsc': 'fixed-position-side-comment=', 'fs': 'format-skipping', 'fsb': 'format-skipping-begin=',
+    'fse': 'format-skipping-end=', 'fws': 'freeze-whitespace', 'hsc': 'hanging-side-comments',
+    'i': 'indent-columns=', 'ibc': 'indent-block-comments', 'icb': 'indent-closing-brace',
+    'icp': 'indent-closing-paren', 'io': 'indent-only', 'iob': 'ignore-old-breakpoints',
+    'isbc': 'indent-spaced-block-comments', 'iscl': 'ignore-side-comment-lengths', 'it': 'iterations=',
+    'kbl': 'keep-old-blank-lines=', 'kis': 'keep-interior-semicolons', 'l': 'maximum-line-length=',
+    'lbl': 'long-block-line-count=', 'lp': 'line-up-parentheses', 'mbl': 'maximum-consecutive-blank-lines=',
+    'mft': 'maximum-fields-per-table=', 'msc': 'minimum-space-to-comment=', 'nsak': 'nospace-after-keyword=',
+    'nwls': 'nowant-left-space=', 'nwrs': 'nowant-right-space=', 'okw': 'outdent-keywords',
+    'okwl': 'outdent-keyword-list=', 'ola': 'outdent-labels', 'olc': 'outdent-long-comments',
+    'ole': 'output-line-ending=', 'oll': 'outdent-long-lines', 'olq': 'outdent-long-quotes',
+    'osbc': 'outdent-static-block-comments', 'otr': 'opening-token-right', 'ple': 'preserve-line-endings',
+    'pt': 'paren-tightness=', 'pvt': 'paren-vertical-tightness=', 'pvtc': 'paren-vertical-tightness-closing=',
+    'q': 'quiet', 'sak': 'space-after-keyword=', 'sbc': 'static-block-comments',
+    'sbcp': 'static-block-comment-prefix=', 'sbl': 'opening-sub-brace-on-new-line',
+    'sbt': 'square-bracket-tightness=', 'sbvt': 'square-bracket-vertical-tightness=',
+    'sbvtc': 'square-bracket-vertical-tightness-closing=', 'sct': 'stack-closing-tokens',
+    'se': 'standard-error-output', 'sfp': 'space-function-paren', 'sfs': 'space-for-semicolon',
+    'sil': 'starting-indentation-level=', 'skp': 'space-keyword-paren', 'sob': 'swallow-optional-blank-lines',
+    'sot': 'stack-opening-tokens', 'ssc': 'static-side-comments', 'sscp': 'static-side-comment-prefix=',
+    'st': 'standard-output', 'sts': 'space-terminal-semicolon', 't': 'tabs', 'tac': 'tee-all-comments',
+    'tbc': 'tee-block-comments', 'tp': 'tee-pod', 'tqw': 'trim-qw', 'tsc': 'tee-side-comments',
+    'tso': 'tight-secret-operators', 'vmll': 'variable-maximum-line-length', 'vt': 'vertical-tightness=',
+    'vtc': 'vertical-tightness-closing=', 'w': 'warning-output', 'wba': 'want-break-after=',
+    'wbb': 'want-break-before=', 'wc': 'whitespace-cycle=', 'wls': 'want-left-space=', 'wn': 'weld-nested-containers',
+    'wrs': 'want-right-space=', 'xci': 'extended-continuation-indentation',
+}
+
+# Known long names of perltidy options, mapped to whether they take a value.
+PERLTIDY_LONG_NAMES = dict([(name.rstrip('='), name.endswith('=')) for name in PERLTIDY_SHORT_NAMES.values()])
+
+# Options, which are abbreviations for lists of other options, as documented
+# in the perltidy manual.
+PERLTIDY_ABBREVIATIONS = {
+    'perl-best-practices': [
+        '-l=78', '-i=4', '-ci=4', '-st', '-se', '-vt=2', '-cti=0', '-pt=1', '-bt=1', '-sbt=1', '-bbt=1', '-nsfs',
+        '-nolq', '-wbb=% + - * / x != == >= <= =~ !~ < > | & = **= += *= &= <<= &&= -= /= |= >>= ||= //= .= %= ^= x='],
+    'gnu-style': ['-lp', '-bl', '-noll', '-pt=2', '-bt=2', '-sbt=2', '-icp'],
+}
+PERLTIDY_SHORT_NAMES.update({'pbp': 'perl-best-practices', 'gnu': 'gnu-style'})
+
+# Maximum nesting of abbreviations.
+PERLTIDY_MAX_ABBREVIATION_DEPTH = 10
+
+
+# Split perltidyrc contents into arguments.
+def split_perltidyrc(text):
+    """Returns tuple (args, abbreviations) for perltidyrc contents "text".
+
+    Comments are removed and arguments split at whitespace, honoring single
+    and double quotes, like perltidy does. Abbreviations defined as
+    "name { -opt1 -opt2 }" are returned as dict mapping their names to their
+    lists of arguments. Raises ValueError, if "text" cannot be parsed.
+    """
+
+    args, abbreviations = [], {}
+    current = None              # arguments of abbreviation being defined
+    current_name = None
+
+    for line in text.splitlines():
+        tokens = []
+        token, quote, has_token = '', None, False
+
+        for char in line:
+            if quote is not None:
+                if char == quote:
+                    quote = None
+                else:
+                    token += char
+            elif char in '"\'':
+                quote, has_token = char, True
+            elif char == '#':
+                break
+            elif char.isspace() or char in '{}':
+                if has_token:
+                    tokens.append(token)
+                    token, has_token = '', False
+                if char in '{}':
+                    tokens.append(char)
+            else:
+                token += char
+                has_token = True
+
+        if quote is not None:
+            raise ValueError('Unterminated quote: ' + line.strip())
+        if has_token:
+            tokens.append(token)
+
+        for token in tokens:
+            if token == '{':
+                if current is not None or not args or args[-1].startswith('-'):
+                    raise ValueError('Unexpected "{"')
+                current, current_name = [], args.pop()
+            elif token == '}':
+                if current is None:
+                    raise ValueError('Unexpected "}"')
+                abbreviations[current_name.lower()] = current
+                current = None
+            elif current is not None:
+                current.append(token)
+            else:
+                args.append(token)
+
+    if current is not None:
+        raise ValueError('Unterminated abbreviation: ' + current_name)
+
+    return args, abbreviations
+
+
+# Parse perltidy arguments into normalized options.
+def parse_perltidy_args(args, abbreviations=None, depth=0):
+    """Returns list of tuples (name, value) of options given in "args".
+
+    Short names of known options are replaced by long names, negations
+    ("-nX", "--noX", "--no-X") result in value False and abbreviations
+    (user-defined in "abbreviations" as returned by split_perltidyrc() as
+    well as "-pbp" and "-gnu") are expanded. Options without value have
+    value True. Unknown options (including abbreviated long names, which
+    cannot be resolved reliably without knowing all options) are kept
+    verbatim as tuples (None, arg). Profile options ("-pro", "-npro") are
+    skipped. Raises ValueError, if "args" cannot be parsed.
+    """
+
+    if depth > PERLTIDY_MAX_ABBREVIATION_DEPTH:
+        raise ValueError('Abbreviations nested too deeply')
+
+    abbreviations = abbreviations or {}
+    options = []
+    args = list(args)
+
+    while args:
+        arg = args.pop(0)
+        m = re.match(r'^--?([A-Za-z0-9][\w-]*)(?:=(.*))?$', arg, re.DOTALL)
+        if not m:
+            raise ValueError('Not an option: ' + arg)
+
+        name, value = m.group(1), m.group(2)
+
+        if name.lower() in abbreviations:
+            options.extend(parse_perltidy_args(abbreviations[name.lower()], abbreviations, depth + 1))
+            continue
+
+        if name in ['pro', 'profile', 'npro', 'noprofile']:
+            continue
+
+        name, negated = resolve_perltidy_option_name(name)
+        if name is None:
+            options.append((None, arg))
+            continue
+
+        if name in PERLTIDY_ABBREVIATIONS and not negated and value is None:
+            options.extend(parse_perltidy_args(PERLTIDY_ABBREVIATIONS[name], abbreviations, depth + 1))
+            continue
+
+        if PERLTIDY_LONG_NAMES.get(name) and not negated:
+            if value is None:
+                if not args:
+                    raise ValueError('Option requires a value: ' + arg)
+                value = args.pop(0)
+            options.append((name, value))
+        elif value is not None:
+            options.append((name, value))
+        else:
+            options.append((name, not negated))
+
+    return options
+
+
+# Return long name of given perltidy option name.
+def resolve_perltidy_option_name(name):
+    """Returns tuple (name, negated) for option name "name" (without dashes).
+
+    Returns (None, False) for unknown names.
+    """
+
+    if name in PERLTIDY_SHORT_NAMES:
+        return PERLTIDY_SHORT_NAMES[name].rstrip('='), False
+    if name in PERLTIDY_LONG_NAMES:
+        return name, False
+
+    # Negated short names.
+    if name.startswith('n') and not PERLTIDY_SHORT_NAMES.get(name[1:], '=').endswith('='):
+        return PERLTIDY_SHORT_NAMES[name[1:]], True
+
+    # Negated long names.
+    for prefix in ['no-', 'no']:
+        rest = name[len(prefix):]
+        if name.startswith(prefix) and PERLTIDY_LONG_NAMES.get(rest) is False:
+            return rest, True
+
+    return None, False
+
+
+# Merge lists of options, later options overriding earlier ones.
+def merge_perltidy_options(*option_lists):
+    """Returns merged list of tuples (name, value) of all "option_lists".
+
+    Each known option is only kept once, with its last value and at the
+    position it has been given last. Unknown options (name None) are all
+    kept in order, so perltidy still sees later ones last.
+    """
+
+    merged = []
+    for options in option_lists:
+        for name, value in options:
+            if name is not None:
+                merged = [option for option in merged if option[0] != name]
+            merged.append((name, value))
+
+    return merged
+
+
+# Format given options as perltidy arguments.
+def format_perltidy_options(options):
+    """Returns list of perltidy arguments for tuples (name, value) in "options"."""
+
+    args = []
+    for name, value in options:
+        if name is None:
+            args.append(value)
+        elif value is True:
+            args.append('--' + name)
+        elif value is False:
+            args.append('--no' + name)
+        else:
+            args.append('--{0}={1}'.format(name, value))
+
+    return args
+
+
+# Parsed perltidyrc files as tuples (mtime, size, options, abbreviations),
+# keyed by path.
+_parsed_perltidyrcs = {}
+_parsed_perltidyrcs_lock = threading.Lock()
+
+
+# Return options and abbreviations given in perltidyrc file.
+def parse_perltidyrc(perltidyrc_path, logger=PerlTidyNullLogger()):
+    """Returns tuple (options, abbreviations) for perltidyrc "perltidyrc_path".
+
+    "options" is a list of tuples (name, value), see parse_perltidy_args(),
+    "abbreviations" maps names of abbreviations defined to their arguments.
+
+    Results are cached as long as modification time and size of the file do
+    not change. Raises EnvironmentError, if the file cannot be read, and
+    ValueError, if it cannot be parsed.
+    """
+
+    st = os.stat(perltidyrc_path)
+
+    with _parsed_perltidyrcs_lock:
+        entry = _parsed_perltidyrcs.get(perltidyrc_path)
+    if entry is not None and entry[:2] == (st.st_mtime, st.st_size):
+        return entry[2], entry[3]
+
+    logger.log(2, 'Parsing perltidyrc: ' + pp(perltidyrc_path))
+    with open(perltidyrc_path, 'rb') as fh:
+        text = fh.read().decode('utf-8', 'replace')
+
+    args, abbreviations = split_perltidyrc(text)
+    options = parse_perltidy_args(args, abbreviations)
+
+    with _parsed_perltidyrcs_lock:
+        _parsed_perltidyrcs[perltidyrc_path] = (st.st_mtime, st.st_size, options, abbreviations)
+
+    return options, abbreviations
+
+
+# Return effective perltidy arguments for given perltidyrc and options.
+def get_effective_perltidy_args(perltidyrc_path, options, logger=PerlTidyNullLogger()):
+    """Returns normalized list of perltidy arguments, or None.
+
+    Options found in perltidyrc "perltidyrc_path" (or, if None, in the
+    perltidyrc perltidy would use given "options") are merged with "options",
+    the latter taking precedence, just like perltidy lets command line
+    options override its perltidyrc. The result starts with "-npro", so
+    perltidy does not read any perltidyrc on its own, and only depends on the
+    effective options, not on formatting or comments of the perltidyrc.
+    Abbreviations defined in the perltidyrc may be used in "options".
+    Returns None, if the perltidyrc cannot be read or parsed, in which case
+    perltidy should be left to read it.
+    """
+
+    if perltidyrc_path is None:
+        perltidyrc_paths = [p for p in get_perltidyrc_paths_from_args(options) if os.path.isfile(p)]
+        perltidyrc_path = perltidyrc_paths[0] if perltidyrc_paths else None
+
+    try:
+        perltidyrc_options, abbreviations = [], {}
+        if perltidyrc_path is not None:
+            perltidyrc_options, abbreviations = parse_perltidyrc(perltidyrc_path, logger=logger)
+        user_options = parse_perltidy_args(options, abbreviations)
+    except (EnvironmentError, ValueError) as e:
+        logger.log(1, 'Unable to parse perltidy options, passing them to perltidy as is: ' + str(e))
+        return None
+
+    return ['-npro'] + format_perltidy_options(merge_perltidy_options(perltidyrc_options, user_options))
+
+
+# Drop all parsed perltidyrc files.
+def clear_parsed_perltidyrc_cache():
+    with _parsed_perltidyrcs_lock:
+        _parsed_perltidyrcs.clear()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import os.path
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .helpers import PerlTidyAbortedError
+
+
+# Return, whether given file is a Perl source file, either by extension or,
+# for files without extension, by shebang line.
+def is_perl_file(path, extensions):
+    """Returns True, if file given in "path" looks like a Perl source file.
+
+    Files are considered Perl source files, if their extension is contained
+    in "extensions", or, if they have no extension at all, if their first line
+    is a shebang line invoking perl.
+    """
+
+    extension = os.path.splitext(path)[1]
+    if extension:
+        return extension in extensions
+
+    try:
+        with open(path, 'rb') as fh:
+            first_line = fh.readline(256)
+    except (EnvironmentError) as e:
+        return False
+
+    return re.match(br'^#!.*\bperl\b', first_line) is not None
+
+
+# Find Perl source files in given directories.
+def find_perl_files(directories, extensions, exclude_dirs=[]):
+    """Yields absolute paths of all Perl source files within "directories".
+
+    Directories named like any entry in "exclude_dirs" will not be descended
+    into. Files found via multiple (nested) directories are yielded once only.
+    """
+
+    seen = set()
+
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted([d for d in dirs if d not in exclude_dirs])
+
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                real_path = os.path.realpath(path)
+                if real_path in seen or not os.path.isfile(path):
+                    continue
+                seen.add(real_path)
+
+                if is_perl_file(path, extensions):
+                    yield path
+
+
+class PerlTidyFileResult(object):
+
+    """Result of tidying a single file."""
+
+    CHANGED = 'changed'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+
+    def __init__(self, path, status, size=0, message=None):
+        self.path = path
+        self.status = status
+        self.size = size
+        self.message = message
+
+
+# Tidy a single file on disk.
+def tidy_file(path, tidy, dry_run=False):
+    """Tidies file given in "path" and returns PerlTidyFileResult.
+
+    "tidy" is called with the path and contents of the file and must return
+    tuple (success, output, error_output, error_hints) like run_perltidy().
+    Files must be encoded in UTF-8. Line endings are preserved. If "dry_run"
+    is True, files are never written to.
+    """
+
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        input = data.decode('utf-8')
+    except (EnvironmentError) as e:
+        return PerlTidyFileResult(path, PerlTidyFileResult.FAILED, message='Unable to read file: ' + repr(e))
+    except (UnicodeDecodeError) as e:
+        return PerlTidyFileResult(path, PerlTidyFileResult.FAILED, message='File is not encoded in UTF-8')
+
+    crlf = '\r\n' in input
+    if crlf:
+        input = input.replace('\r\n', '\n')
+
+    try:
+        success, output, error_output, error_hints = tidy(path, input)
+    except (PerlTidyAbortedError) as e:
+        return PerlTidyFileResult(path, PerlTidyFileResult.FAILED, size=len(data), message=str(e))
+
+    if not success:
+        message = (error_output or '\n'.join(error_hints) or 'Unable to run perltidy').strip()
+        return PerlTidyFileResult(path, PerlTidyFileResult.FAILED, size=len(data), message=message)
+
+    if output == input:
+        return PerlTidyFileResult(path, PerlTidyFileResult.UNCHANGED, size=len(data))
+
+    if not dry_run:
+        if crlf:
+            output = output.replace('\n', '\r\n')
+
+        try:
+            with open(path, 'wb') as fh:
+                fh.write(output.encode('utf-8'))
+        except (EnvironmentError) as e:
+            return PerlTidyFileResult(path, PerlTidyFileResult.FAILED, size=len(data),
+                                      message='Unable to write file: ' + repr(e))
+
+    return PerlTidyFileResult(path, PerlTidyFileResult.CHANGED, size=len(data))
+
+
+class PerlTidyFilesSummary(object):
+
+    """Summary of tidying multiple files."""
+
+    def __init__(self):
+        self.results = []
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    def files(self, status):
+        return [result for result in self.results if result.status == status]
+
+    # Return human readable summary.
+    def format(self, dry_run=False):
+        total_size = sum([result.size for result in self.results])
+        elapsed = max(self.elapsed, 0.001)
+
+        return '{0} files {1}, {2} unchanged, {3} failed. {4} files ({5:.1f} KB) in {6:.2f}s, {7:.1f} files/s, {8:.1f} KB/s'.format(
+            len(self.files(PerlTidyFileResult.CHANGED)), 'would change' if dry_run else 'changed',
+            len(self.files(PerlTidyFileResult.UNCHANGED)), len(self.files(PerlTidyFileResult.FAILED)),
+            len(self.results), total_size / 1024.0, self.elapsed,
+            len(self.results) / elapsed, total_size / 1024.0 / elapsed)
+
+
+# Tidy given files concurrently.
+def tidy_files(paths, tidy, jobs=1, dry_run=False, callback=None):
+    """Tidies all files given in "paths" using "jobs" threads.
+
+    See tidy_file() for "tidy" and "dry_run". "paths" may be any iterable,
+    i.e. a generator returned by find_perl_files(), so tidying starts while
+    files are still being searched for. If given, "callback" is called with
+    each PerlTidyFileResult as soon as a file has been tidied (from worker
+    threads). Returns PerlTidyFilesSummary.
+    """
+
+    summary = PerlTidyFilesSummary()
+    summary_lock = threading.Lock()
+    paths_queue = queue.Queue(maxsize=max(jobs, 1) * 4)
+    started = time.time()
+
+    def work():
+        while True:
+            path = paths_queue.get()
+            if path is None:
+                break
+
+            try:
+                result = tidy_file(path, tidy, dry_run=dry_run)
+            except (Exception) as e:
+                result = PerlTidyFileResult(path, PerlTidyFileResult.FAILED, message=repr(e))
+
+            with summary_lock:
+                summary.add(result)
+            if callback is not None:
+                callback(result)
+
+    threads = []
+    for i in range(max(jobs, 1)):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for path in paths:
+        paths_queue.put(path)
+    for thread in threads:
+        paths_queue.put(None)
+    for thread in threads:
+        thread.join()
+
+    summary.elapsed = time.time() - started
+    return summary
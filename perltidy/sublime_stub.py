@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal stand-in for the Sublime Text API module "sublime".
+
+Provides the few functions used by the perltidy package, so it may be used
+outside of Sublime Text, i.e. by the command line interface.
+"""
+
+from __future__ import print_function, unicode_literals
+import os
+import os.path
+import sys
+
+
+# Return platform name like Sublime Text does.
+def platform():
+    if sys.platform.startswith('win') or sys.platform == 'cygwin':
+        return 'windows'
+    if sys.platform == 'darwin':
+        return 'osx'
+    return 'linux'
+
+
+def version():
+    return ''
+
+
+# Return per-user cache directory.
+def cache_path():
+    if platform() == 'windows':
+        return os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'SublimePerlTidy', 'Cache')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'sublime-perltidy')
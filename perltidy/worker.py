@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent Perl::Tidy worker processes.
+
+Instead of spawning perltidy for every tidy operation (and paying for Perl
+interpreter startup and compilation of Perl::Tidy each time), a worker keeps a
+single Perl interpreter with Perl::Tidy loaded around and feeds it requests
+over its standard input/output using a simple framed protocol:
+
+    Request:  "<argc> <input length>\\n"
+              argc lines, each containing a single perltidy argument
+              <input length> bytes of (UTF-8 encoded) input
+
+    Response: "<error flag> <output length> <error output length>\\n"
+              <output length> bytes of output
+              <error output length> bytes of error output
+
+Upon startup, the worker announces itself with "READY <Perl::Tidy version>",
+or "FAIL <reason>", if Perl::Tidy cannot be loaded.
+"""
+
+from __future__ import print_function, unicode_literals
+import os
+import os.path
+import re
+import sublime
+import subprocess
+import threading
+
+from .helpers import (PerlTidyCapabilities, PerlTidyNullLogger, PerlTidyProcessWatch, get_subprocess_args, pp,
+                      subprocess_safe_args)
+
+
+# Perl code run by worker processes.
+PERLTIDY_WORKER_SCRIPT = r'''
+use strict;
+use warnings;
+
+binmode STDIN;
+binmode STDOUT;
+$| = 1;
+
+if (!eval { require Perl::Tidy; 1 }) {
+    (my $reason = $@) =~ s/\s+/ /g;
+    print 'FAIL ', $reason, "\n";
+    exit 1;
+}
+print 'READY ', $Perl::Tidy::VERSION, "\n";
+
+while (defined(my $header = <STDIN>)) {
+    my ($argc, $length) = $header =~ /^(\d+) (\d+)$/ or exit 2;
+
+    my @argv;
+    for (1 .. $argc) {
+        my $arg = <STDIN>;
+        exit 2 if !defined $arg;
+        chomp $arg;
+        push @argv, $arg;
+    }
+
+    my $source = '';
+    while (length($source) < $length) {
+        read(STDIN, $source, $length - length($source), length($source)) or exit 2;
+    }
+
+    # Only recent versions of Perl::Tidy return an error flag.
+    my ($destination, $stderr, $errorfile, $error) = ('', '', '', 0);
+    my $ok = eval {
+        $error = Perl::Tidy::perltidy(
+            argv        => \@argv,
+            source      => \$source,
+            destination => \$destination,
+            stderr      => \$stderr,
+            errorfile   => \$errorfile,
+        );
+        1;
+    };
+    if (!$ok) {
+        $stderr .= $@;
+        $error = 1;
+    }
+
+    my $error_output = $errorfile . $stderr;
+    for ($destination, $error_output) {
+        utf8::encode($_) if utf8::is_utf8($_);
+    }
+
+    print join(' ', $error ? 1 : 0, length($destination), length($error_output)), "\n";
+    print $destination, $error_output;
+}
+'''
+
+# Number of consecutive worker crashes, after which a worker gives up and
+# lets callers fall back to running perltidy directly.
+PERLTIDY_WORKER_MAX_CRASHES = 3
+
+
+class PerlTidyWorkerError(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return self.value
+
+
+# Return Perl interpreter command, which may be used to load Perl::Tidy for
+# given perltidy command.
+def find_perl_for_perltidy_cmd(cmd):
+    """Returns Perl interpreter command for perltidy command given in "cmd", or None.
+
+    If "cmd" contains more than one element, all elements except the last one
+    (the perltidy script) are considered the Perl interpreter command, as with
+    the Strawberry Perl/ActivePerl defaults on Windows. Otherwise, the Perl
+    interpreter is taken from the shebang line of the perltidy script. Returns
+    None, if no Perl interpreter can be determined, i.e. for batch wrappers or
+    standalone executables.
+    """
+
+    if type(cmd) is not list or len(cmd) == 0:
+        return None
+
+    if len(cmd) > 1:
+        return list(cmd[:-1])
+
+    script = cmd[0]
+    if os.path.splitext(script)[1].lower() in ['.bat', '.cmd', '.exe', '.sh']:
+        return None
+
+    try:
+        with open(script, 'rb') as fh:
+            first_line = fh.readline(1024).decode('utf-8', 'replace')
+    except (EnvironmentError) as e:
+        return None
+
+    m = re.match(r'^#!\s*(\S+)(.*)$', first_line.strip())
+    if not m:
+        return None
+
+    perl_cmd = [m.group(1)] + m.group(2).split()
+    if not [x for x in perl_cmd if re.match(r'^perl[\d.]*(\.exe)?$', os.path.basename(x), re.IGNORECASE)]:
+        return None
+
+    return perl_cmd
+
+
+class PerlTidyWorker(object):
+
+    """Long-lived Perl process with Perl::Tidy loaded, serving tidy requests.
+
+    Worker processes are limited to "memory_limit" MB of memory on POSIX, if
+    given. CPU time limits don't apply, since they would accumulate over all
+    requests served.
+    """
+
+    def __init__(self, cmd, idle_timeout=300, logger=PerlTidyNullLogger(), memory_limit=0):
+        self.cmd = list(cmd)
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self.memory_limit = memory_limit
+        self.version = None
+
+        self._crashes = 0
+        self._disabled = False
+        self._idle_timer = None
+        self._lock = threading.RLock()
+        self._process = None
+
+    # Return, whether worker may be used at all.
+    def is_available(self):
+        return not self._disabled
+
+    # Return, whether worker process is currently running.
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    # Start worker process, unless already running. Raises
+    # PerlTidyWorkerError, if worker could not be started.
+    def start(self):
+        with self._lock:
+            if self.is_running():
+                return
+
+            perl_cmd = find_perl_for_perltidy_cmd(self.cmd)
+            if perl_cmd is None:
+                raise PerlTidyWorkerError('Unable to determine Perl interpreter for ' + pp(self.cmd))
+
+            worker_cmd = perl_cmd + ['-e', PERLTIDY_WORKER_SCRIPT]
+
+            subprocess_args = get_subprocess_args(new_process_group=True, memory_limit=self.memory_limit)
+            subprocess_args['stderr'] = open(os.devnull, 'wb')
+            if sublime.platform() == 'windows':
+                env = dict(os.environ)
+                env['CYGWIN'] = (env.get('CYGWIN', '') + ' nodosfilewarning').strip()
+                env['LANG'] = 'C'
+                subprocess_args['env'] = env
+
+            worker_cmd, subprocess_args = subprocess_safe_args(worker_cmd, subprocess_args)
+            self.logger.log(1, 'Starting perltidy worker: ' + pp(perl_cmd))
+
+            try:
+                self._process = subprocess.Popen(worker_cmd, **subprocess_args)
+                greeting = self._process.stdout.readline().decode('utf-8', 'replace').strip()
+            except (EnvironmentError) as e:
+                self._kill()
+                raise PerlTidyWorkerError('Unable to start perltidy worker: ' + repr(e))
+            finally:
+                subprocess_args['stderr'].close()
+
+            if not greeting.startswith('READY '):
+                self._kill()
+                raise PerlTidyWorkerError('Perl::Tidy not available in worker: ' + (greeting or '<no response>'))
+
+            self.version = greeting[len('READY '):]
+            self.logger.log(1, 'Perl::Tidy worker ready, Perl::Tidy version: ' + self.version)
+
+    # Start worker process and let it tidy a tiny snippet, so everything
+    # Perl::Tidy compiles or initializes lazily is ready before the first real
+    # request. Returns, whether the worker is ready.
+    def warm_up(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            try:
+                self.start()
+                self._request(['-npro', '-ole=unix', '-nst', '-nse'], b'1;\n')
+            except (PerlTidyWorkerError) as e:
+                self.logger.log(1, 'Unable to warm up perltidy worker: ' + str(e))
+                self._kill()
+                return False
+
+            self._start_idle_timer()
+            return True
+
+    # Stop worker process.
+    def stop(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._process is not None:
+                self.logger.log(2, 'Stopping perltidy worker: ' + pp(self.cmd))
+                try:
+                    self._process.stdin.close()
+                except (EnvironmentError) as e:
+                    pass
+                self._kill()
+
+    # Tidy given input using given perltidy arguments. Returns tuple (success,
+    # output, error_output, error_hints) like run_perltidy(), or None, if the
+    # worker is unusable and caller should fall back to running perltidy
+    # directly. Raises PerlTidyAbortedError, if the request takes longer than
+    # "timeout" seconds or is cancelled. The worker is stopped in that case.
+    # Input is passed like run_perltidy() would, given the "capabilities" of
+    # the perltidy command, and the worker is disabled, if it loads another
+    # version of Perl::Tidy than the perltidy command reports.
+    def run(self, args, input, timeout=0, capabilities=PerlTidyCapabilities()):
+        if [x for x in args if '\n' in x or '\r' in x]:
+            return None
+
+        # perltidy writes to our destination and error streams, so output and
+        # error output options must not end up on the worker's stdout.
+        # Non-ASCII input is passed as UTF-8 using "-utf8", like
+        # run_perltidy() does. Leave perltidy versions not supporting "-utf8"
+        # to run_perltidy(), which passes such input via temporary files.
+        args_final = list(args) + ['-ole=unix', '-nst', '-nse']
+        input_bytes = input.encode('utf-8')
+        io_mode = capabilities.get_io_mode(len(input_bytes) == len(input))
+        if io_mode == PerlTidyCapabilities.TEMP_FILES:
+            return None
+        if io_mode == PerlTidyCapabilities.PIPE_UTF8:
+            args_final.append('-utf8')
+
+        with self._lock:
+            self._cancel_idle_timer()
+
+            # Restart worker, if it has crashed. Retry a request once, if the
+            # worker dies while processing it.
+            for attempt in range(2):
+                if self._disabled:
+                    return None
+
+                watch = None
+                try:
+                    self.start()
+                    if not self._matches_version(capabilities.version):
+                        return None
+                    watch = PerlTidyProcessWatch(self._process, timeout=timeout, logger=self.logger)
+                    with watch:
+                        result = self._request(args_final, input_bytes)
+                    if watch.reason is not None:
+                        raise PerlTidyWorkerError('Worker stopped')
+                    self._crashes = 0
+                    self._start_idle_timer()
+                    return result
+                except (PerlTidyWorkerError) as e:
+                    self._kill()
+
+                    # Neither retry nor count requests stopped on purpose.
+                    if watch is not None and watch.reason is not None:
+                        raise watch.error()
+
+                    self.logger.log(1, 'Perl::Tidy worker failed: ' + str(e))
+                    self._crashes += 1
+
+                    # Don't retry starting a worker for commands, which don't
+                    # support it.
+                    if self.version is None or self._crashes >= PERLTIDY_WORKER_MAX_CRASHES:
+                        self.logger.log(1, 'Disabling perltidy worker for ' + pp(self.cmd))
+                        self._disabled = True
+
+        return None
+
+    # Check, whether the worker's Perl::Tidy has given version as reported by
+    # "perltidy -v" (if known). Workers may load another Perl::Tidy than the
+    # perltidy command, i.e. if the perltidy script adds library paths, so
+    # they are disabled in that case.
+    def _matches_version(self, version):
+        if version is None or self.version is None or self.version.lstrip('v') == version.lstrip('v'):
+            return True
+
+        self.logger.log(1, 'Disabling perltidy worker for {0}: Perl::Tidy version {1} differs from perltidy '
+                        'version {2}'.format(pp(self.cmd), self.version, version))
+        self._disabled = True
+        self.stop()
+        return False
+
+    def _request(self, args, input_bytes):
+        self.logger.log(1, 'Running perltidy in worker with arguments: ' + pp(args))
+
+        frame = ['{0} {1}\n'.format(len(args), len(input_bytes)).encode('ascii')]
+        for arg in args:
+            frame.append(arg.encode('utf-8') + b'\n')
+        frame.append(input_bytes)
+
+        try:
+            self._process.stdin.write(b''.join(frame))
+            self._process.stdin.flush()
+
+            header = self._process.stdout.readline().decode('ascii', 'replace')
+            m = re.match(r'^(\d) (\d+) (\d+)$', header.strip())
+            if not m:
+                raise PerlTidyWorkerError('Invalid response from worker: ' + repr(header))
+
+            output = self._read_exactly(int(m.group(2)))
+            error_output = self._read_exactly(int(m.group(3)))
+        except (EnvironmentError, ValueError) as e:
+            raise PerlTidyWorkerError('Worker I/O error: ' + repr(e))
+
+        output = output.decode('utf-8')
+        error_output = error_output.decode('utf-8', 'replace')
+
+        if m.group(1) == '1' and not error_output:
+            error_output = 'Perl::Tidy reported an error, but no error output.\n'
+
+        return not error_output, output, error_output, []
+
+    def _read_exactly(self, length):
+        chunks = []
+        while length > 0:
+            chunk = self._process.stdout.read(length)
+            if not chunk:
+                raise PerlTidyWorkerError('Worker closed its output unexpectedly')
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b''.join(chunks)
+
+    def _kill(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+
+        try:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        except (EnvironmentError) as e:
+            pass
+
+        for fh in [process.stdin, process.stdout]:
+            try:
+                fh.close()
+            except (EnvironmentError) as e:
+                pass
+
+    def _start_idle_timer(self):
+        if self.idle_timeout and self.idle_timeout > 0:
+            self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_idle(self):
+        self.logger.log(2, 'Perl::Tidy worker idle for {0}s, shutting down'.format(self.idle_timeout))
+        self.stop()
+
+
+class PerlTidyWorkerPool(object):
+
+    """Pool of workers for a single perltidy command.
+
+    Workers are created on demand, up to the number of workers requested by
+    callers, or ahead of time using prewarm(), and handed out to one caller at
+    a time.
+    """
+
+    def __init__(self, cmd, idle_timeout=300, logger=PerlTidyNullLogger(), memory_limit=0):
+        self.cmd = list(cmd)
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self.memory_limit = memory_limit
+
+        self._busy = set()
+        self._condition = threading.Condition()
+        self._workers = []
+
+    # Return, whether workers may be used at all. Once a worker turned out to
+    # be unusable, the whole pool will be.
+    def is_available(self):
+        return not [worker for worker in self._workers if not worker.is_available()]
+
+    # Return idle worker, waiting for one to become idle, if "max_workers"
+    # workers are busy already.
+    def acquire(self, max_workers=1):
+        with self._condition:
+            while True:
+                for worker in self._workers:
+                    if worker not in self._busy:
+                        self._busy.add(worker)
+                        return worker
+
+                if len(self._workers) < max(max_workers, 1):
+                    worker = PerlTidyWorker(self.cmd, idle_timeout=self.idle_timeout, logger=self.logger,
+                                            memory_limit=self.memory_limit)
+                    self._workers.append(worker)
+                    self._busy.add(worker)
+                    return worker
+
+                self._condition.wait()
+
+    # Hand worker back to pool.
+    def release(self, worker):
+        with self._condition:
+            self._busy.discard(worker)
+            self._condition.notify()
+
+    # Run perltidy in an idle worker, see PerlTidyWorker.run().
+    def run(self, args, input, max_workers=1, timeout=0, capabilities=PerlTidyCapabilities()):
+        if not self.is_available():
+            return None
+
+        worker = self.acquire(max_workers)
+        try:
+            worker.idle_timeout = self.idle_timeout
+            worker.logger = self.logger
+
+            # Restart worker, if its memory limit has changed.
+            if worker.memory_limit != self.memory_limit:
+                worker.stop()
+                worker.memory_limit = self.memory_limit
+
+            return worker.run(args, input, timeout=timeout, capabilities=capabilities)
+        finally:
+            self.release(worker)
+
+    # Start and warm up workers, until "count" workers are running, so
+    # requests need not wait for Perl and Perl::Tidy to start. Workers busy
+    # or running already are left alone. Returns number of workers started.
+    def prewarm(self, count):
+        if not self.is_available():
+            return 0
+
+        with self._condition:
+            while len(self._workers) < count:
+                self._workers.append(PerlTidyWorker(self.cmd, idle_timeout=self.idle_timeout, logger=self.logger,
+                                                    memory_limit=self.memory_limit))
+            workers = [worker for worker in self._workers[:count]
+                       if worker not in self._busy and not worker.is_running()]
+            self._busy.update(workers)
+
+        started = 0
+        try:
+            for worker in workers:
+                worker.idle_timeout = self.idle_timeout
+                worker.logger = self.logger
+                worker.memory_limit = self.memory_limit
+                if not worker.warm_up():
+                    break
+                started += 1
+        finally:
+            for worker in workers:
+                self.release(worker)
+
+        self.logger.log(1, 'Started {0} perltidy worker(s) for {1}'.format(started, pp(self.cmd)))
+        return started
+
+    # Stop all workers.
+    def stop(self):
+        with self._condition:
+            workers = list(self._workers)
+
+        for worker in workers:
+            worker.stop()
+
+
+# Registry of worker pools, one per distinct perltidy command.
+_perltidy_worker_pools = {}
+_perltidy_worker_pools_lock = threading.Lock()
+
+
+# Return worker pool for given perltidy command, creating it if necessary.
+def get_perltidy_worker_pool(cmd, idle_timeout=300, logger=PerlTidyNullLogger(), memory_limit=0):
+    """Returns PerlTidyWorkerPool for perltidy command given in "cmd".
+
+    Pools are shared process-wide, one per distinct command. Worker processes
+    are started lazily upon first use, unless pre-warmed.
+    """
+
+    key = tuple(cmd)
+    with _perltidy_worker_pools_lock:
+        pool = _perltidy_worker_pools.get(key)
+        if pool is None:
+            pool = PerlTidyWorkerPool(cmd, idle_timeout=idle_timeout, logger=logger, memory_limit=memory_limit)
+            _perltidy_worker_pools[key] = pool
+
+    pool.idle_timeout = idle_timeout
+    pool.logger = logger
+    pool.memory_limit = memory_limit
+    return pool
+
+
+# Tidy input using a persistent worker.
+def run_perltidy_in_worker(cmd, args, input, idle_timeout=300, max_workers=1, logger=PerlTidyNullLogger(),
+                           timeout=0, memory_limit=0, capabilities=PerlTidyCapabilities()):
+    """Run perltidy on "input" in a persistent worker for perltidy command "cmd".
+
+    "args" contains the perltidy arguments to use (without the command
+    itself). Up to "max_workers" workers will be used for "cmd", if called
+    concurrently. Returns tuple (success, output, error_output, error_hints)
+    like run_perltidy(), or None, if no worker is available for "cmd" or its
+    Perl::Tidy version differs from "capabilities.version". Callers should
+    then fall back to run_perltidy(). Raises PerlTidyAbortedError on timeout
+    or cancellation like run_perltidy().
+    """
+
+    pool = get_perltidy_worker_pool(cmd, idle_timeout=idle_timeout, logger=logger, memory_limit=memory_limit)
+    return pool.run(args, input, max_workers=max_workers, timeout=timeout, capabilities=capabilities)
+
+
+# Stop all running workers.
+def stop_perltidy_workers():
+    """Stops all running perltidy worker processes."""
+
+    with _perltidy_worker_pools_lock:
+        pools = list(_perltidy_worker_pools.values())
+        _perltidy_worker_pools.clear()
+
+    for pool in pools:
+        pool.stop()
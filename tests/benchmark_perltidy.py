@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for the PerlTidy tidy pipeline.
+
+Generates reproducible Perl corpora of graded sizes (ASCII and UTF-8, tidied
+as one big region or many small ones) and times each stage of tidying
+separately: perltidy discovery, perltidyrc resolution, argument building,
+process spawn, the first tidy after startup (cold and pre-warmed), tidying
+via pipes and via the persistent worker, and applying the output to a
+buffer. Results are written as JSON, so runs may be compared
+with each other using --compare.
+
+Run from the repository root:
+
+    python tests/benchmark_perltidy.py --output before.json
+    python tests/benchmark_perltidy.py --output after.json --compare before.json
+"""
+
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.base import PerlTidyBase, clear_perltidy_cmd_cache
+from perltidy.capabilities import clear_perltidy_capabilities, get_perltidy_capabilities
+from perltidy.diff import diff_hunks
+from perltidy.helpers import join_perltidy_regions, run_perltidy, split_perltidy_regions
+from perltidy.perltidyrc import clear_perltidyrc_cache
+from perltidy.worker import run_perltidy_in_worker, stop_perltidy_workers
+
+
+CORPUS_SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+
+CORPUS_ENCODINGS = ['ascii', 'utf8']
+
+CORPUS_LAYOUTS = ['single', 'regions']
+
+# Number of regions for layout "regions".
+CORPUS_REGIONS = 50
+
+SUB_TEMPLATE = '''
+# {comment}
+sub {name} {{
+my ( $self, %args ) = @_;
+  my $total=0;
+      for my $item (@{{ $args{{items}} || [] }}) {{
+   if ($item->{{count}}>{number}) {{ $total += $item->{{count}} * {number}; }}
+else {{
+            $total-=1;
+    }}
+  }}
+my %result = ( name => '{string}', total => $total, flags => [ 1, 2, 3 ] );
+  return \\%result;
+}}
+'''
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta', 'kappa']
+
+UTF8_WORDS = ['äöü', 'ÄÖÜß', 'café', 'naïve', 'Ωμέγα', '日本語']
+
+
+# Generate Perl code of (at least) given size in bytes. Corpora are
+# reproducible, since a fixed random seed is used.
+def generate_corpus(size, encoding):
+    rng = random.Random(size)
+    words = WORDS + (UTF8_WORDS if encoding == 'utf8' else [])
+    parts = ['package Benchmark::Corpus;\n\nuse strict;\nuse warnings;\n']
+    length = len(parts[0])
+    index = 0
+
+    while length < size:
+        part = SUB_TEMPLATE.format(
+            comment=' '.join(rng.choice(words) for i in range(6)),
+            name='sub_{0}_{1}'.format(index, rng.choice(WORDS)),
+            number=rng.randint(1, 1000),
+            string=rng.choice(words))
+        parts.append(part)
+        length += len(part.encode('utf-8'))
+        index += 1
+
+    parts.append('\n1;\n')
+    return ''.join(parts)
+
+
+# Split Perl code into (roughly) given number of regions at sub boundaries.
+def split_corpus(corpus, count):
+    subs = corpus.split('\n# ')
+    per_region = max(1, len(subs) // count)
+    regions = []
+
+    for i in range(0, len(subs), per_region):
+        regions.append('\n# '.join(subs[i:i + per_region]))
+
+    return [region if i == 0 else '# ' + region for i, region in enumerate(regions)]
+
+
+class PerlTidyBenchmarkCommand(PerlTidyBase):
+
+    """PerlTidyBase using fixed settings and folders."""
+
+    def __init__(self, settings, folders):
+        self.settings = settings
+        self.folders = folders
+
+    def get_settings(self):
+        return self.settings
+
+    def get_folders(self):
+        return self.folders
+
+
+# Time given function "repeat" times. Returns dict with min/median/max in
+# seconds and the result of the last call.
+def measure(function, repeat):
+    timings = []
+    result = None
+
+    for i in range(repeat):
+        started = time.time()
+        result = function()
+        timings.append(time.time() - started)
+
+    return summarize(timings), result
+
+
+# Returns dict with min/median/max of given timings in seconds.
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'max': timings[-1],
+    }
+
+
+# Apply perltidy output to a buffer the way PerlTidyCommand does: only
+# changed lines are replaced, back to front.
+def apply_output(buffer, output):
+    for begin, end, replacement in reversed(diff_hunks(buffer, output)):
+        buffer = buffer[:begin] + replacement + buffer[end:]
+    return buffer
+
+
+class PerlTidyBenchmark(object):
+
+    def __init__(self, perltidy_cmd, options, repeat):
+        self.perltidy_cmd = perltidy_cmd
+        self.options = options
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, stage, timing, **kwargs):
+        entry = dict(kwargs)
+        entry['stage'] = stage
+        entry.update(timing)
+        self.results.append(entry)
+        print('{0:<28} {1:<32} median {2:9.4f}s  min {3:9.4f}s  max {4:9.4f}s'.format(
+            stage, kwargs.get('corpus', ''), timing['median'], timing['min'], timing['max']))
+
+    # Stages not depending on corpora.
+    def run_setup_stages(self):
+        project = tempfile.mkdtemp()
+        try:
+            nested = os.path.join(project, 'lib', 'Benchmark', 'Corpus')
+            os.makedirs(nested)
+            with open(os.path.join(project, '.perltidyrc'), 'wb') as fh:
+                fh.write(b'-l=100\n')
+            file_name = os.path.join(nested, 'Module.pm')
+
+            settings = {'perltidy_cmd': self.perltidy_cmd, 'perltidy_options': self.options}
+            command = PerlTidyBenchmarkCommand(settings, [project])
+            command.load_settings()
+
+            def find_perltidy(cold):
+                if cold:
+                    clear_perltidy_cmd_cache()
+                command.load_settings()
+                return command.find_perltidy()
+
+            self.record('discovery_cold', measure(lambda: find_perltidy(True), self.repeat)[0])
+            self.record('discovery_warm', measure(lambda: find_perltidy(False), self.repeat)[0])
+
+            def build_args(cold):
+                if cold:
+                    clear_perltidyrc_cache()
+                return command.build_perltidy_args(file_name=file_name)
+
+            self.record('rc_resolution_and_args_cold', measure(lambda: build_args(True), self.repeat)[0])
+            self.record('rc_resolution_and_args_warm', measure(lambda: build_args(False), self.repeat)[0])
+
+            self.args = command.build_perltidy_args(file_name=file_name)
+            self.cmd = command.find_perltidy()
+
+            self.record('spawn', measure(lambda: run_perltidy(self.cmd + self.args, ''), self.repeat)[0])
+
+            # Time the first tidy after startup with everything memoized
+            # dropped, either cold or after warming up like plugin_loaded()
+            # does, not counting the warm up itself.
+            first_tidy_settings = dict(settings, perltidy_cache_enabled=False, perltidy_fingerprints_enabled=False)
+            first_tidy_input = generate_corpus(1024, 'ascii')
+
+            def first_tidy(prewarm):
+                stop_perltidy_workers()
+                clear_perltidy_cmd_cache()
+                clear_perltidyrc_cache()
+                clear_perltidy_capabilities()
+
+                first = PerlTidyBenchmarkCommand(first_tidy_settings, [project])
+                first.load_settings()
+                if prewarm:
+                    cmd, thread = first.warm_up(file_name=file_name)
+                    thread.join()
+
+                started = time.time()
+                first.load_settings()
+                first.find_perltidy()
+                success, output, error_output, error_hints = first.tidy_text(
+                    first_tidy_input, first.build_perltidy_args(file_name=file_name))
+                if not success:
+                    raise RuntimeError('Unable to tidy: {0}'.format(error_output or error_hints))
+                return time.time() - started
+
+            self.record('first_tidy_cold', summarize([first_tidy(False) for i in range(self.repeat)]))
+            self.record('first_tidy_prewarmed', summarize([first_tidy(True) for i in range(self.repeat)]))
+            stop_perltidy_workers()
+        finally:
+            shutil.rmtree(project)
+
+    # Stages for a single corpus.
+    def run_corpus_stages(self, size, encoding, layout):
+        corpus = generate_corpus(size, encoding)
+        name = '{0}KB-{1}-{2}'.format(size // 1024, encoding, layout)
+        info = {'corpus': name, 'size': len(corpus.encode('utf-8')), 'encoding': encoding, 'layout': layout}
+
+        if layout == 'regions':
+            inputs = split_corpus(corpus, CORPUS_REGIONS)
+            input, separator = join_perltidy_regions(inputs)
+        else:
+            inputs = [corpus]
+            input, separator = corpus, None
+
+        def finish(result):
+            success, output, error_output, error_hints = result
+            if not success:
+                raise RuntimeError('Unable to tidy corpus {0}: {1}'.format(name, error_output or error_hints))
+            if separator is None:
+                return [output]
+            return split_perltidy_regions(output, separator, len(inputs))
+
+        timing, outputs = measure(lambda: finish(run_perltidy(self.cmd + self.args, input)), self.repeat)
+        self.record('tidy_pipe', timing, **info)
+
+        def tidy_in_worker():
+            result = run_perltidy_in_worker(self.cmd, self.args, input)
+            if result is None:
+                raise RuntimeError('perltidy worker not available')
+            return finish(result)
+
+        try:
+            run_perltidy_in_worker(self.cmd, self.args, '')     # start worker
+            self.record('tidy_worker', measure(tidy_in_worker, self.repeat)[0], **info)
+        except (RuntimeError) as e:
+            print('Skipping tidy_worker: {0}'.format(e))
+
+        def apply_outputs():
+            return [apply_output(region, output) for region, output in zip(inputs, outputs)]
+
+        self.record('apply', measure(apply_outputs, self.repeat)[0], **info)
+
+    def report(self):
+        return {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'perltidy_cmd': self.cmd,
+            'perltidy_version': get_perltidy_capabilities(self.cmd).version,
+            'perltidy_args': self.args,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': self.results,
+        }
+
+
+# Print relative changes of median timings compared to a previous report.
+def compare(report, previous):
+    key = lambda entry: (entry['stage'], entry.get('corpus', ''))
+    previous_results = dict((key(entry), entry) for entry in previous['results'])
+
+    print('\nComparison with previous run (median, >1.00 is slower):')
+    for entry in report['results']:
+        old = previous_results.get(key(entry))
+        if old is None or not old['median']:
+            continue
+        print('{0:<28} {1:<32} {2:9.4f}s -> {3:9.4f}s  x{4:.2f}'.format(
+            entry['stage'], entry.get('corpus', ''), old['median'], entry['median'],
+            entry['median'] / old['median']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PerlTidy tidy pipeline.')
+    parser.add_argument('--perltidy', help='perltidy command to use (default: search PATH)')
+    parser.add_argument('--options', default='-pbp', help='perltidy options (default: %(default)s)')
+    parser.add_argument('--sizes', default=','.join([str(size // 1024) for size in CORPUS_SIZES]),
+                        help='comma separated corpus sizes in KB (default: %(default)s)')
+    parser.add_argument('--encodings', default=','.join(CORPUS_ENCODINGS),
+                        help='comma separated corpus encodings (default: %(default)s)')
+    parser.add_argument('--layouts', default=','.join(CORPUS_LAYOUTS),
+                        help='comma separated corpus layouts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage (default: %(default)s)')
+    parser.add_argument('--output', help='write JSON report to given file')
+    parser.add_argument('--compare', help='compare with JSON report given')
+    args = parser.parse_args()
+
+    benchmark = PerlTidyBenchmark(args.perltidy, args.options.split(), args.repeat)
+    try:
+        benchmark.run_setup_stages()
+        if benchmark.cmd is None:
+            parser.error('perltidy not found, please use --perltidy')
+
+        for size in [int(size) * 1024 for size in args.sizes.split(',')]:
+            for encoding in args.encodings.split(','):
+                for layout in args.layouts.split(','):
+                    benchmark.run_corpus_stages(size, encoding, layout)
+    finally:
+        stop_perltidy_workers()
+
+    report = benchmark.report()
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(report, json.load(fh))
+
+
+if __name__ == '__main__':
+    main()
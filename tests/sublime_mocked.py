@@ -8,3 +8,56 @@ def platform():
         return "windows"
 
     return "linux"
+
+
+HIDDEN = 128
+
+# Callbacks scheduled via set_timeout(), run by run_timeouts().
+timeouts = []
+status_messages = []
+
+
+def version():
+    return '3211'
+
+
+def set_timeout(callback, delay=0):
+    timeouts.append(callback)
+
+
+# Run callbacks scheduled via set_timeout() so far.
+def run_timeouts():
+    callbacks = timeouts[:]
+    del timeouts[:]
+    for callback in callbacks:
+        callback()
+
+
+def status_message(message):
+    status_messages.append(message)
+
+
+def active_window():
+    return None
+
+
+class Region(object):
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, point):
+        return self.begin() <= point <= self.end()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+
+class TextCommand(object):
+
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(object):
+
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(object):
+    pass
+
+
+class EventListener(object):
+    pass
+
+
+class ViewEventListener(object):
+    pass
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.base import *
+from nose.tools import assert_equal, assert_false, assert_true
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class PerlTidyTestCommand(PerlTidyBase):
+
+    def __init__(self, settings, logger):
+        self.settings = settings
+        self.logger = logger
+
+    def get_settings(self):
+        return self.settings
+
+    def get_folders(self):
+        return []
+
+    def log(self, level, message):
+        self.logger.log(level, message)
+
+    def log_level(self):
+        return self.logger.log_level()
+
+
+class TestPerlTidyBase(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        clear_perltidy_cmd_cache()
+
+    def tearDown(self):
+        clear_perltidy_cmd_cache()
+        shutil.rmtree(self.temp_dir)
+
+    def test_find_perltidy_memoized(self):
+        perltidy = os.path.join(self.temp_dir, 'perltidy')
+        with open(perltidy, 'wb') as f:
+            f.write(b'#!/usr/bin/perl\n')
+
+        settings = {'perltidy_cmd': perltidy}
+        assert_equal(PerlTidyTestCommand(settings, self.logger).find_perltidy(), [perltidy])
+
+        # Further commands must reuse the discovered command.
+        self.logger.clear_log_buffer()
+        assert_equal(PerlTidyTestCommand(settings, self.logger).find_perltidy(), [perltidy])
+        assert_true('Using previously found perltidy' in self.logger.get_log_buffer())
+        assert_false('Checking for perltidy' in self.logger.get_log_buffer())
+
+        # Vanished commands must be discovered again.
+        os.remove(perltidy)
+        self.logger.clear_log_buffer()
+        PerlTidyTestCommand(settings, self.logger).find_perltidy()
+        assert_true('Checking for perltidy' in self.logger.get_log_buffer())
+
+    def test_tidy_text_skips_tidy_input(self):
+        calls = []
+
+        class PerlTidyCountingCommand(PerlTidyTestCommand):
+
+            def execute_perltidy(self, args, input):
+                calls.append(input)
+                return True, input.lstrip(), '', []
+
+        settings = {'perltidy_cmd': ['perltidy'], 'perltidy_cache_enabled': False}
+        command = PerlTidyCountingCommand(settings, self.logger)
+        command.load_settings()
+        command._perltidy_cmd = ['perltidy']
+        command.get_fingerprint_index().clear()
+
+        # Output of previous runs must not be tidied again.
+        assert_equal(command.tidy_text('  use strict;\n', []), (True, 'use strict;\n', '', []))
+        assert_equal(command.tidy_text('use strict;\n', []), (True, 'use strict;\n', '', []))
+        assert_equal(calls, ['  use strict;\n'])
+
+        # Unless options change.
+        command.tidy_text('use strict;\n', ['-l=100'])
+        assert_equal(calls, ['  use strict;\n', 'use strict;\n'])
+
+    def test_tidy_text_streams_chunks(self):
+        calls = []
+
+        class PerlTidyStreamingCommand(PerlTidyTestCommand):
+
+            def get_capabilities(self):
+                return PerlTidyCapabilities(version='20230309')
+
+            def execute_perltidy(self, args, input):
+                calls.append(('execute', input))
+                return True, input, '', []
+
+            def stream_perltidy(self, args, chunks):
+                calls.append(('stream', list(chunks)))
+                return True, 'output', '', []
+
+        settings = {'perltidy_cmd': ['perltidy'], 'perltidy_streaming_threshold': 100}
+        command = PerlTidyStreamingCommand(settings, self.logger)
+        command.load_settings()
+        command._perltidy_cmd = ['perltidy']
+
+        assert_false(command.should_stream(99))
+        assert_true(command.should_stream(100))
+
+        # Chunks bypass cache and fingerprints.
+        assert_equal(command.tidy_text(iter(['a', 'b']), ['-pbp']), (True, 'output', '', []))
+        assert_equal(calls, [('stream', ['a', 'b'])])
+
+        # Streaming is disabled with threshold 0 or for old perltidy versions.
+        settings['perltidy_streaming_threshold'] = 0
+        command.load_settings()
+        assert_false(command.should_stream(10 ** 9))
+
+        settings['perltidy_streaming_threshold'] = 100
+        command.load_settings()
+        command.get_capabilities = lambda: PerlTidyCapabilities(version='20101217')
+        assert_false(command.should_stream(10 ** 9))
+
+    def test_tidy_on_save_delay(self):
+        settings = {'perltidy_tidy_on_save_debounce': 0.25}
+        command = PerlTidyTestCommand(settings, self.logger)
+        command.load_settings()
+
+        # Fractional debounce intervals are waited for in milliseconds,
+        # rounded up.
+        assert_equal(command.get_tidy_on_save_delay(100.0, now=100.0), 250)
+        assert_equal(command.get_tidy_on_save_delay(100.0, now=100.1), 150)
+        assert_equal(command.get_tidy_on_save_delay(100.0, now=100.2499), 1)
+        assert_equal(command.get_tidy_on_save_delay(100.0, now=100.25), 0)
+        assert_equal(command.get_tidy_on_save_delay(0), 0)
+
+        settings['perltidy_tidy_on_save_debounce'] = 0
+        command.load_settings(reload=True)
+        assert_equal(command.get_tidy_on_save_delay(100.0, now=100.0), 0)
+
+    def test_tidy_inputs_batches_top_level_regions(self):
+        calls = []
+
+        # Indent by nesting depth and align "=" of adjacent lines up to the
+        # next comment, like perltidy.
+        def tidy(input):
+            rows = []
+            depth = 0
+            for line in input.splitlines():
+                code = line.strip()
+                indent = '    ' * (depth - (code[:1] in ')}'))
+                rows.append((indent, code.split('=', 1)) if not code.startswith('#') else (indent, None))
+                depth += len([c for c in code if c in '({']) - len([c for c in code if c in ')}'])
+
+            output = []
+            for i, (indent, parts) in enumerate(rows):
+                if parts is None or len(parts) == 1:
+                    output.append(indent + input.splitlines()[i].strip())
+                    continue
+                group = [i]
+                for j in (-1, 1):
+                    k = i + j
+                    while 0 <= k < len(rows) and rows[k][1] is not None and len(rows[k][1]) == 2:
+                        group.append(k)
+                        k += j
+                width = max(len(rows[k][1][0].strip()) for k in group)
+                output.append(indent + parts[0].strip().ljust(width) + ' = ' + parts[1].strip())
+            return '\n'.join(output) + '\n'
+
+        class PerlTidyBatchingCommand(PerlTidyTestCommand):
+
+            def execute_perltidy(self, args, input):
+                calls.append(input)
+                return True, tidy(input), '', []
+
+        settings = {'perltidy_cmd': ['perltidy'], 'perltidy_cache_enabled': False}
+        command = PerlTidyBatchingCommand(settings, self.logger)
+        command.load_settings()
+        command._perltidy_cmd = ['perltidy']
+        command.get_fingerprint_index().clear()
+
+        # Alignment-sensitive regions are tidied at once, unbalanced regions
+        # on their own, with the same result as tidying all regions one by
+        # one.
+        inputs = ['my $a=1;\n', 'foo(\n', 'my $bbbb=2;\n', '1);\n', 'if ($x) {\n  bar();\n}\n']
+        outputs, errors = command.tidy_inputs(inputs, [], ['Region {0}'.format(i) for i in range(len(inputs))])
+        assert_equal(outputs, [tidy(input) for input in inputs])
+        assert_equal(errors, [])
+        assert_equal(len(calls), 3)
+        assert_equal([input in calls[0] for input in inputs], [True, False, True, False, True])
+
+    def test_tidy_inputs_matches_perltidy(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        class PerlTidyPathCommand(PerlTidyTestCommand):
+
+            def execute_perltidy(self, args, input):
+                return run_perltidy(cmd + ['-npro', '-pbp', '-nst'] + args, input)
+
+        settings = {'perltidy_cmd': cmd, 'perltidy_cache_enabled': False}
+        command = PerlTidyPathCommand(settings, self.logger)
+        command.load_settings()
+        command._perltidy_cmd = cmd
+        command.get_fingerprint_index().clear()
+
+        # Tidying regions at once must neither align nor indent code across
+        # regions.
+        inputs = ['my $a = 1;    # a\n', 'my $bbbbbb = 2; # b\n', 'my %h = (\n', 'a => 1,\n',
+                  'bbbb => 2);\n', 'if ($x) {\nfoo();\n}\n']
+        outputs, errors = command.tidy_inputs(inputs, [], ['Region {0}'.format(i) for i in range(len(inputs))])
+        expected = []
+        for input in inputs:
+            success, output, error_output, error_hints = command.execute_perltidy([], input)
+            expected.append(output if success else None)
+        assert_equal(outputs, expected)
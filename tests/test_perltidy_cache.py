@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.cache import *
+from nose.tools import assert_equal, assert_false, assert_not_equal, assert_is_none, assert_true
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class TestPerlTidyResultCache(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_make_perltidy_cache_key(self):
+        key = make_perltidy_cache_key('use strict;', ['perltidy', '-pbp'], 'abc', '20130922')
+        assert_equal(key, make_perltidy_cache_key('use strict;', ['perltidy', '-pbp'], 'abc', '20130922'))
+
+        # Every component must be part of the key.
+        assert_not_equal(key, make_perltidy_cache_key('use warnings;', ['perltidy', '-pbp'], 'abc', '20130922'))
+        assert_not_equal(key, make_perltidy_cache_key('use strict;', ['perltidy', '-l=120'], 'abc', '20130922'))
+        assert_not_equal(key, make_perltidy_cache_key('use strict;', ['perltidy', '-pbp'], 'def', '20130922'))
+        assert_not_equal(key, make_perltidy_cache_key('use strict;', ['perltidy', '-pbp'], 'abc', '20140101'))
+        assert_not_equal(key, make_perltidy_cache_key('use strict;', ['perltidy', '-pbp', ''], 'abc', '20130922'))
+
+    def test_lru_eviction(self):
+        cache = PerlTidyResultCache(max_size=10, logger=self.logger)
+        cache.put('a', '1234')
+        cache.put('b', '1234')
+        assert_equal(cache.get('a'), '1234')            # "b" is now least recently used
+
+        cache.put('c', '1234')
+        assert_is_none(cache.get('b'))
+        assert_equal(cache.get('a'), '1234')
+        assert_equal(cache.get('c'), '1234')
+        assert_equal(cache.size, 8)
+
+        # Entries exceeding the budget are never cached.
+        cache.put('d', '12345678901')
+        assert_is_none(cache.get('d'))
+
+        assert_equal((cache.hits, cache.misses), (3, 2))
+        assert_true('hits: 3, misses: 2' in self.logger.get_log_buffer())
+
+        # Budget is measured in bytes of UTF-8 encoded output.
+        cache = PerlTidyResultCache(max_size=10, logger=self.logger)
+        cache.put('a', 'äöü')
+        assert_equal(cache.size, 6)
+        cache.put('b', 'äöü')
+        assert_is_none(cache.get('a'))
+        assert_equal(cache.size, 6)
+
+    def test_persistent_cache(self):
+        cache_dir = os.path.join(self.temp_dir, 'results')
+        cache = PerlTidyResultCache(cache_dir=cache_dir, logger=self.logger)
+        cache.put('a', 'use utf8; $foo = "äöü";\n')
+
+        # A fresh cache must find the entry on disk.
+        cache = PerlTidyResultCache(cache_dir=cache_dir, logger=self.logger)
+        assert_equal(cache.get('a'), 'use utf8; $foo = "äöü";\n')
+
+        # Disk budget must be enforced.
+        cache = PerlTidyResultCache(cache_dir=cache_dir, max_disk_size=0, logger=self.logger)
+        cache.put('b', 'use strict;\n')
+        assert_equal(os.listdir(cache_dir), [])
+
+        # Disk usage is tracked across writes, evicting least recently used
+        # entries once over budget.
+        cache = PerlTidyResultCache(cache_dir=cache_dir, max_disk_size=30, logger=self.logger)
+        cache.put('a', 'äöü äöü\n')
+        os.utime(os.path.join(cache_dir, 'a'), (0, 0))
+        cache.put('b', 'use strict;\n')
+        assert_equal(sorted(os.listdir(cache_dir)), ['a', 'b'])
+        cache.put('b', 'use strict;\n')
+        assert_equal(sorted(os.listdir(cache_dir)), ['a', 'b'])
+        cache.put('c', '1234567;\n')
+        assert_equal(sorted(os.listdir(cache_dir)), ['b', 'c'])
+
+        cache.clear(disk=True)
+        assert_is_none(cache.get('a'))
+
+
+class TestPerlTidyFingerprintIndex(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_lru_eviction(self):
+        index = PerlTidyFingerprintIndex(max_entries=2, logger=self.logger)
+        index.add('a')
+        index.add('b')
+        assert_true(index.contains('a'))                # "b" is now least recently used
+        index.add('c')
+
+        assert_true(index.contains('a'))
+        assert_false(index.contains('b'))
+        assert_true(index.contains('c'))
+
+    def test_persistence(self):
+        path = os.path.join(self.temp_dir, 'PerlTidy', 'fingerprints')
+        index = PerlTidyFingerprintIndex(max_entries=2, path=path, save_delay=60, logger=self.logger)
+        index.add('a')
+        index.add('b')
+        index.add('c')
+        index.save()
+
+        # Index must be loaded from disk by new instances, bounded by the
+        # (new) maximum number of entries.
+        index = PerlTidyFingerprintIndex(max_entries=1, path=path, logger=self.logger)
+        assert_false(index.contains('b'))
+        assert_true(index.contains('c'))
+
+        index.clear()
+        assert_false(PerlTidyFingerprintIndex(path=path, logger=self.logger).contains('c'))
+
+        # Pending changes must be saved on flush, without waiting for the
+        # delayed save.
+        index = PerlTidyFingerprintIndex(path=path, save_delay=60, logger=self.logger)
+        index.add('d')
+        index.flush()
+        assert_true(PerlTidyFingerprintIndex(path=path, logger=self.logger).contains('d'))
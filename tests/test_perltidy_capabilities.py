@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import json
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.capabilities import *
+from perltidy.helpers import find_perltidy_in_path, run_perltidy
+from nose.tools import assert_equal, assert_false, assert_true
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+# Fake perltidy supporting given long option names, dumped like perltidy does,
+# and echoing its arguments and input with CRLF line endings, unless
+# "-ole=unix" is given. Each run is counted in file "runs".
+FAKE_PERLTIDY = '''import os, sys
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'runs'), 'a') as fh:
+    fh.write('run\\n')
+if '-v' in sys.argv:
+    sys.stdout.write('This is perltidy, v{version}\\n')
+elif '--dump-long-names' in sys.argv:
+    sys.stdout.write('# Command line long names (passed to GetOptions)\\n' +
+                     '# =s takes a mandatory string\\n' + '\\n'.join({options}) + '\\n')
+else:
+    newline = '\\n' if '-ole=unix' in sys.argv else '\\r\\n'
+    sys.stdout.write(' '.join(sys.argv[1:]) + newline + sys.stdin.read())
+'''
+
+
+class TestPerlTidyCapabilities(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cache', 'capabilities.json')
+        clear_perltidy_capabilities()
+
+    def tearDown(self):
+        clear_perltidy_capabilities()
+        shutil.rmtree(self.temp_dir)
+
+    def write_perltidy(self, version='20230309',
+                       options=('character-encoding=s', 'output-line-ending=s', 'standard-output!')):
+        script = os.path.join(self.temp_dir, 'perltidy.py')
+        with open(script, 'w') as fh:
+            fh.write(FAKE_PERLTIDY.format(version=version, options=repr(list(options))))
+        return [sys.executable, script]
+
+    def count_runs(self):
+        with open(os.path.join(self.temp_dir, 'runs')) as fh:
+            return len(fh.readlines())
+
+    def test_probe_perltidy_capabilities(self):
+        capabilities = probe_perltidy_capabilities(self.write_perltidy(), logger=self.logger)
+        assert_equal(capabilities.version, '20230309')
+        assert_true(capabilities.startup_time >= 0)
+        assert_true(capabilities.supports('utf8'))
+        assert_false(capabilities.supports('assert-tidy'))
+        assert_true(capabilities.supports('unprobed-option'))
+        assert_equal(capabilities.get_io_mode(False), PerlTidyCapabilities.PIPE_UTF8)
+        assert_true(capabilities.supports_streaming())
+
+        # "-utf8" is an abbreviation, which perltidy doesn't dump, so it is
+        # supported along with "--character-encoding".
+        capabilities = probe_perltidy_capabilities(self.write_perltidy(options=('output-line-ending=s',)),
+                                                   logger=self.logger)
+        assert_false(capabilities.supports('utf8'))
+        assert_equal(capabilities.get_io_mode(False), PerlTidyCapabilities.TEMP_FILES)
+
+        # Without options, support for "-utf8" depends on the version.
+        capabilities = probe_perltidy_capabilities(self.write_perltidy('20101217', ()), logger=self.logger)
+        assert_equal(capabilities.options, None)
+        assert_false(capabilities.supports('utf8'))
+        assert_equal(capabilities.get_io_mode(True), PerlTidyCapabilities.PIPE)
+        assert_equal(capabilities.get_io_mode(False), PerlTidyCapabilities.TEMP_FILES)
+
+    def test_probe_perltidy_in_path(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        # Recent perltidy versions must pipe UTF-8 and support streaming.
+        capabilities = probe_perltidy_capabilities(cmd, logger=self.logger)
+        assert_true(capabilities.supports('utf8'))
+        assert_equal(capabilities.get_io_mode(False), PerlTidyCapabilities.PIPE_UTF8)
+        assert_true(capabilities.supports_streaming())
+
+    def test_get_perltidy_capabilities(self):
+        cmd = self.write_perltidy()
+        capabilities = get_perltidy_capabilities(cmd, path=self.path, logger=self.logger)
+        assert_equal(self.count_runs(), 2)
+        assert_true(get_perltidy_capabilities(cmd, path=self.path) is capabilities)
+        assert_equal(len(json.load(open(self.path))), 1)
+
+        # Later sessions use capabilities stored on disk.
+        clear_perltidy_capabilities()
+        assert_equal(get_perltidy_capabilities(cmd, path=self.path).to_dict(), capabilities.to_dict())
+        assert_equal(self.count_runs(), 2)
+
+        # Changed perltidy executables are probed again.
+        cmd = self.write_perltidy('20240202.01')
+        assert_equal(get_perltidy_capabilities(cmd, path=self.path).version, '20240202.01')
+        assert_equal(self.count_runs(), 4)
+
+    def test_run_perltidy_with_capabilities(self):
+        cmd = self.write_perltidy()
+        capabilities = get_perltidy_capabilities(cmd)
+
+        success, output, error_output, error_hints = run_perltidy(cmd, 'äöü', capabilities=capabilities)
+        assert_equal(output, '-ole=unix -utf8\näöü')
+
+        # Without "-ole", line endings are converted.
+        capabilities = PerlTidyCapabilities(options={'output-line-ending': False, 'character-encoding': True})
+        success, output, error_output, error_hints = run_perltidy(cmd, 'use strict;', capabilities=capabilities)
+        assert_equal(output, '\nuse strict;')
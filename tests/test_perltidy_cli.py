@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.cli import *
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase, is_windows
+
+
+# Fake perltidy removing leading whitespace.
+FAKE_PERLTIDY = '''#!{0}
+import sys
+if '-v' in sys.argv:
+    sys.stdout.write('This is perltidy, v20230309\\n')
+    sys.exit(0)
+data = sys.stdin.read()
+if 'SYNTAXERROR' in data:
+    sys.stderr.write('syntax error at line 1\\n')
+    sys.exit(1)
+sys.stdout.write(''.join(line.lstrip(' ') for line in data.splitlines(True)))
+'''
+
+
+class TestPerlTidyCli(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        if is_windows():
+            raise SkipTest('Fake perltidy requires shebang support')
+
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.perltidy = os.path.join(self.temp_dir, 'perltidy')
+        with open(self.perltidy, 'wb') as fh:
+            fh.write(FAKE_PERLTIDY.format(sys.executable).encode('utf-8'))
+        os.chmod(self.perltidy, stat.S_IRWXU)
+
+        self.project = os.path.join(self.temp_dir, 'project')
+        os.makedirs(os.path.join(self.project, 'lib'))
+        self.tidy_file = self.write_file('lib/Tidy.pm', 'use strict;\n')
+        self.untidy_file = self.write_file('lib/Untidy.pm', 'use strict;\n  use warnings;\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.project, name)
+        with open(path, 'wb') as fh:
+            fh.write(content.encode('utf-8'))
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as fh:
+            return fh.read().decode('utf-8')
+
+    def run_cli(self, *args):
+        return main(['--perltidy', self.perltidy, '--folder', self.project, '-q', '-j', '2'] + list(args))
+
+    def test_check(self):
+        assert_equal(self.run_cli('--check', self.project), 1)
+        assert_equal(self.read_file(self.untidy_file), 'use strict;\n  use warnings;\n')
+        assert_equal(self.run_cli('--check', self.tidy_file), 0)
+
+    def test_tidy(self):
+        assert_equal(self.run_cli(self.project), 0)
+        assert_equal(self.read_file(self.untidy_file), 'use strict;\nuse warnings;\n')
+        assert_equal(self.run_cli('--check', self.project), 0)
+
+    def test_failure(self):
+        self.write_file('lib/Broken.pm', 'SYNTAXERROR\n')
+        assert_equal(self.run_cli('--check', self.project), 2)
+
+    def test_load_settings_file(self):
+        path = self.write_file('Foo.sublime-project', '{"folders": [], "settings": {"perltidy_options": ["-gnu"]}}')
+        assert_equal(load_settings_file(path), {'perltidy_options': ['-gnu']})
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import sys
+import time
+import sublime_mocked
+import sublime_plugin_mocked
+sys.modules['sublime'] = sublime_mocked
+sys.modules['sublime_plugin'] = sublime_plugin_mocked
+
+from PerlTidyCommand import PerlTidyApplyCommand, PerlTidyCommand
+from nose.tools import assert_equal, assert_true
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class PerlTidyTestSettings(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class PerlTidyTestWindow(object):
+
+    def folders(self):
+        return []
+
+
+class PerlTidyTestSelection(list):
+
+    def add(self, region):
+        self.append(region)
+
+    def clear(self):
+        del self[:]
+
+
+# Just enough of a Sublime Text view for tidying on save, running commands
+# right away and recording saves.
+class PerlTidyTestView(object):
+
+    def __init__(self, text, settings):
+        self.text = text
+        self.commands = []
+        self.status = {}
+        self.regions = {}
+        self._change_count = 0
+        self._settings = PerlTidyTestSettings(settings)
+        self._sel = PerlTidyTestSelection([sublime_mocked.Region(0)])
+
+    def id(self):
+        return 1
+
+    def buffer_id(self):
+        return 1
+
+    def file_name(self):
+        return '/tmp/Foo.pm'
+
+    def settings(self):
+        return self._settings
+
+    def window(self):
+        return PerlTidyTestWindow()
+
+    def size(self):
+        return len(self.text)
+
+    def change_count(self):
+        return self._change_count
+
+    def substr(self, region):
+        return self.text[region.begin():region.end()]
+
+    def replace(self, edit, region, text):
+        self.text = self.text[:region.begin()] + text + self.text[region.end():]
+        self._change_count += 1
+
+    def sel(self):
+        return self._sel
+
+    def show_at_center(self, point):
+        pass
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+    def add_regions(self, key, regions, *args):
+        self.regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return self.regions.get(key, [])
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def run_command(self, name, args=None):
+        self.commands.append(name)
+        if name == 'perl_tidy_apply':
+            PerlTidyApplyCommand(self).run(None, **args)
+
+
+class TestPerlTidyCommand(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        del sublime_mocked.timeouts[:]
+        del sublime_mocked.status_messages[:]
+
+    def tidy_on_save(self, view, modify=False):
+        command = PerlTidyCommand(view)
+        command.load_settings()
+        command.start_timer()
+        command.tidy_inputs = lambda inputs, args, descriptions: ([input.lstrip() for input in inputs], [])
+
+        region = sublime_mocked.Region(0, view.size())
+        command.tidy_in_background([region], [view.substr(region)], [], [None], True, budget=0, on_save=True,
+                                   whole_view=True)
+
+        # Results arrive after the budget, when the view may have been
+        # modified in the meantime.
+        if modify:
+            view.replace(None, sublime_mocked.Region(view.size()), '1;\n')
+        for i in range(500):
+            sublime_mocked.run_timeouts()
+            if view.commands:
+                break
+            time.sleep(0.01)
+
+    def test_tidy_on_save_late_result(self):
+        settings = {'perltidy_cache_enabled': False, 'perltidy_fingerprints_enabled': False,
+                    'perltidy_incremental_persistent': False}
+
+        view = PerlTidyTestView('  use strict;\n', settings)
+        self.tidy_on_save(view)
+        assert_equal(view.text, 'use strict;\n')
+        assert_equal(view.commands, ['perl_tidy_apply', 'save'])
+
+        # Discarded results must not save newer modifications.
+        view = PerlTidyTestView('  use strict;\n', settings)
+        self.tidy_on_save(view, modify=True)
+        assert_equal(view.text, '  use strict;\n1;\n')
+        assert_equal(view.commands, ['perl_tidy_apply'])
+        assert_true('PerlTidy: View modified while tidying, result discarded' in sublime_mocked.status_messages)
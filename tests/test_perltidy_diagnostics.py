@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import sys
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.diagnostics import *
+from nose.tools import assert_equal
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+ERROR_OUTPUT = '''1:	To save a full .LOG file rerun with -g
+3:	Unexpected '}' ... perhaps a missing ';' before it?
+7:	final indentation level: 1
+
+Final nesting depth of '{'s is 1
+The most recent un-matched '{' is on line 5
+5: sub foo {
+           ^
+12: my $x = ( 1, 2;
+              ^
+'''
+
+
+class TestPerlTidyDiagnostics(PerlTidyTestCase):
+
+    def test_parse_perltidy_diagnostics(self):
+        # Unnumbered lines without line references are ignored. Marker lines
+        # give the column of the diagnostic for the line echoed before.
+        assert_equal(parse_perltidy_diagnostics(ERROR_OUTPUT), [
+            PerlTidyDiagnostic(1, None, 'info', 'To save a full .LOG file rerun with -g'),
+            PerlTidyDiagnostic(3, None, 'error', "Unexpected '}' ... perhaps a missing ';' before it?"),
+            PerlTidyDiagnostic(7, None, 'warning', 'final indentation level: 1'),
+            PerlTidyDiagnostic(5, 8, 'error', "The most recent un-matched '{' is on line 5"),
+            PerlTidyDiagnostic(12, 10, 'error', 'Syntax error'),
+        ])
+
+        # Code echoes without marker lines are regular messages.
+        assert_equal(parse_perltidy_diagnostics('4: some warning\n'),
+                     [PerlTidyDiagnostic(4, None, 'warning', 'some warning')])
+        assert_equal(parse_perltidy_diagnostics(''), [])
+
+    def test_iter_perltidy_diagnostics_is_lazy(self):
+        error_output = ''.join(['{0}:\tsome warning\n'.format(i + 1) for i in range(10000)])
+        diagnostics = iter_perltidy_diagnostics(error_output)
+        assert_equal(next(diagnostics).line, 1)
+        assert_equal(len(list(diagnostics)), 9999)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import random
+import sys
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+import perltidy.diff
+from perltidy.diff import *
+from nose.tools import assert_equal
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+def apply_hunks(old, hunks):
+    for begin, end, replacement in reversed(hunks):
+        old = old[:begin] + replacement + old[end:]
+    return old
+
+
+class TestPerlTidyDiff(PerlTidyTestCase):
+
+    def test_split_lines(self):
+        assert_equal(split_lines(''), [])
+        assert_equal(split_lines('a\nb'), ['a\n', 'b'])
+        assert_equal(split_lines('a\n\x0cb\n'), ['a\n', '\x0cb\n'])
+
+    def test_diff_line_ranges(self):
+        rng = random.Random(42)
+        old_max_cost = perltidy.diff.MAX_SEQUENCE_MATCHER_COST
+
+        # Force splitting at unique lines, so both strategies are exercised.
+        try:
+            for max_cost in [old_max_cost, 4]:
+                perltidy.diff.MAX_SEQUENCE_MATCHER_COST = max_cost
+
+                for i in range(50):
+                    old = [rng.choice('abcdefghij') + '\n' for k in range(rng.randint(0, 60))]
+                    new = [line if rng.random() < 0.7 else rng.choice('abcdefghijklmnop') + '\n' for line in old]
+                    new.insert(rng.randint(0, len(new)), 'inserted\n')
+
+                    result = list(old)
+                    for i1, i2, j1, j2 in reversed(diff_line_ranges(old, new)):
+                        result[i1:i2] = new[j1:j2]
+                    assert_equal(result, new)
+
+                    ranges = diff_line_ranges(old, new)
+                    assert_equal(ranges, sorted(ranges))
+        finally:
+            perltidy.diff.MAX_SEQUENCE_MATCHER_COST = old_max_cost
+
+    def test_diff_hunks(self):
+        old = 'use strict;\nsub foo {\n  return 1;\n}\n\nsub bar {\n    return 2;\n}\n'
+        new = 'use strict;\n\nsub foo {\n    return 1;\n}\n\nsub bar {\n    return 2;\n}\n'
+
+        assert_equal(diff_hunks(old, old), [])
+
+        hunks = diff_hunks(old, new)
+        assert_equal(apply_hunks(old, hunks), new)
+
+        # Only changed lines must be replaced.
+        assert_equal(hunks, [(12, 12, '\n'), (22, 34, '    return 1;\n')])
+
+        # Missing trailing newline.
+        assert_equal(apply_hunks('a;\n  b;', diff_hunks('a;\n  b;', 'a;\nb;\n')), 'a;\nb;\n')
+
+    def test_map_offset(self):
+        old = 'sub foo {\n  return 1;\n}\nfoo();\n'
+        new = '\nsub foo {\n    return 1;\n}\nfoo();\n'
+        hunks = diff_hunks(old, new)
+
+        # Offsets before, after and within changed lines.
+        assert_equal(map_offset(old, hunks, 0), 1)
+        assert_equal(map_offset(old, hunks, old.index('foo();')), new.index('foo();'))
+        assert_equal(map_offset(old, hunks, old.index('return')), new.index('return'))
+        assert_equal(map_offset(old, hunks, old.index('1;')), new.index('1;'))
+        assert_equal(map_offset(old, hunks, old.index('return') - 1), new.index('return') - 3)
+        assert_equal(map_offset(old, hunks, len(old)), len(new))
+
+        # Deleted lines.
+        hunks = diff_hunks('a;\nb;\nc;\n', 'a;\nc;\n')
+        assert_equal(map_offset('a;\nb;\nc;\n', hunks, 4), 3)
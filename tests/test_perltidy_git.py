@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.git import *
+from perltidy.helpers import PerlTidyAbortedError, cancel_perltidy_processes
+from nose.tools import assert_equal, assert_false, assert_is_none, assert_true
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase, is_windows
+
+
+class TestPerlTidyGit(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def git(self, *args):
+        try:
+            subprocess.check_call(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] + list(args),
+                                  cwd=self.temp_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except (EnvironmentError) as e:
+            raise SkipTest('git not found in PATH')
+
+    def write_file(self, name, text):
+        path = os.path.join(self.temp_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fh:
+            fh.write(text.encode('utf-8'))
+        return path
+
+    def test_get_git_head_text(self):
+        path = self.write_file('Foo.pm', 'package Foo;\n')
+
+        # Not within a git repository.
+        assert_is_none(get_git_head_text(path, logger=self.logger))
+
+        # Within a git repository without commits, or not tracked.
+        self.git('init', '-q')
+        assert_is_none(get_git_head_text(path, logger=self.logger))
+
+        nested = self.write_file(os.path.join('lib', 'Bär.pm'), 'package Bär;\r\n\r\n1;\r\n')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'Initial')
+        self.write_file('Foo.pm', 'package Foo;\n\n1;\n')
+        assert_equal(get_git_head_text(path, logger=self.logger), 'package Foo;\n')
+        assert_equal(get_git_head_text(nested, logger=self.logger), 'package Bär;\n\n1;\n')
+
+        untracked = self.write_file('Untracked.pm', '1;\n')
+        assert_is_none(get_git_head_text(untracked, logger=self.logger))
+
+        # git not found.
+        assert_is_none(get_git_head_text(path, git_cmd=os.path.join(self.temp_dir, 'no-git'), logger=self.logger))
+
+    def test_get_git_head_text_aborted(self):
+        if is_windows():
+            raise SkipTest('Scripts in place of git are not supported on Windows')
+
+        path = self.write_file('Foo.pm', 'package Foo;\n')
+        git_cmd = self.write_file('slow-git', '#!{0}\nimport time\ntime.sleep(30)\n'.format(sys.executable))
+        os.chmod(git_cmd, stat.S_IRWXU)
+
+        # git timing out must not be mistaken for files not tracked by git.
+        started = time.time()
+        try:
+            get_git_head_text(path, git_cmd=git_cmd, logger=self.logger, timeout=0.5)
+            assert_true(False, 'PerlTidyAbortedError not raised')
+        except (PerlTidyAbortedError) as e:
+            assert_equal(e.reason, PerlTidyAbortedError.TIMEOUT)
+        assert_true(time.time() - started < 10)
+
+        # Same for cancelling.
+        errors = []
+
+        def run():
+            try:
+                get_git_head_text(path, git_cmd=git_cmd, logger=self.logger)
+            except (PerlTidyAbortedError) as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        for i in range(100):
+            if cancel_perltidy_processes():
+                break
+            time.sleep(0.05)
+        thread.join(10)
+
+        assert_false(thread.is_alive())
+        assert_equal([e.reason for e in errors], [PerlTidyAbortedError.CANCELLED])
@@ -6,11 +6,15 @@
 from __future__ import print_function, unicode_literals
 import sys
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
 import sublime_mocked
 sys.modules['sublime'] = sublime_mocked
 
 from perltidy.helpers import *
-from nose.tools import assert_equal, assert_regexp_matches, assert_true, assert_false, assert_raises, assert_is_none
+from nose.tools import assert_equal, assert_not_equal, assert_regexp_matches, assert_true, assert_false, assert_raises, assert_is_none
 from nose.plugins.skip import SkipTest
 
 
@@ -204,11 +208,267 @@ class TestPerlTidyHelpers(PerlTidyTestCase):
                      'C:\ThisCommandDoesNotExist'], logger=self.logger, cmd_source='user'))
         assert_regexp_matches(self.logger.get_log_buffer(), r'specified\ in\ user\ setting')
 
+    def test_get_perltidyrc_paths_from_args(self):
+        assert_equal(get_perltidyrc_paths_from_args(['-pbp', '-pro=/tmp/perltidyrc']), ['/tmp/perltidyrc'])
+        assert_equal(get_perltidyrc_paths_from_args(['--profile=/tmp/perltidyrc', '-pbp']), ['/tmp/perltidyrc'])
+        assert_equal(get_perltidyrc_paths_from_args(['-pro=/tmp/perltidyrc', '-npro']), [])
+        assert_equal(get_perltidyrc_paths_from_args(['-pbp']), get_perltidy_default_rc_paths())
+
+    def test_get_perltidyrc_fingerprint(self):
+        temp_dir = tempfile.mkdtemp()
+        perltidyrc_path = os.path.join(temp_dir, 'perltidyrc')
+
+        fingerprint = get_perltidyrc_fingerprint([perltidyrc_path])
+        with open(perltidyrc_path, 'wb') as f:
+            f.write("-l=120\n".encode('ascii'))
+        assert_not_equal(fingerprint, get_perltidyrc_fingerprint([perltidyrc_path]))
+
+        fingerprint = get_perltidyrc_fingerprint([perltidyrc_path])
+        assert_equal(fingerprint, get_perltidyrc_fingerprint([perltidyrc_path]))
+
+        shutil.rmtree(temp_dir)
+
+    def test_join_split_perltidy_regions(self):
+        inputs = ['  use strict;', '  use warnings;\n', '']
+        input, separator = join_perltidy_regions(inputs)
+        assert_equal(input.count(separator), 3)
+
+        # Simulate perltidy output with re-indented separators and additional
+        # blank lines.
+        output = input.replace('  use', 'use').replace('# ' + separator, '\n    # ' + separator)
+        assert_equal(split_perltidy_regions(output, separator, 3), ['use strict;\n', 'use warnings;\n', ''])
+
+        # Trailing blank lines of inputs are kept.
+        inputs = ['sub a {\n  1;\n}\n\n', 'sub b {\n  2;\n}\n']
+        input, separator = join_perltidy_regions(inputs)
+        output = input.replace('  ', '    ').replace('\n\n', '\n')
+        assert_equal(split_perltidy_regions(output, separator, 2, inputs),
+                     ['sub a {\n    1;\n}\n\n', 'sub b {\n    2;\n}\n'])
+
+        # Separators swallowed by perltidy must be detected.
+        assert_is_none(split_perltidy_regions(output, separator, 4))
+        assert_is_none(split_perltidy_regions(output.replace('# ' + separator, '', 1), separator, 3))
+
+    def test_perltidy_supports_utf8(self):
+        assert_true(perltidy_supports_utf8(None))
+        assert_true(perltidy_supports_utf8('unknown'))
+        assert_true(perltidy_supports_utf8('20120701'))
+        assert_true(perltidy_supports_utf8('20230309.03'))
+        assert_false(perltidy_supports_utf8('20101217'))
+
+    def test_perltidy_timer(self):
+        clear_perltidy_timing_stats()
+
+        timer = PerlTidyTimer()
+        with timer.span('spawn'):
+            pass
+        with timer.span('communicate'):
+            pass
+        with timer.span('spawn'):
+            pass
+        assert_equal(timer.stages, ['spawn', 'communicate'])
+        assert_regexp_matches(timer.format(), r'^spawn \d+\.\dms, communicate \d+\.\dms, total \d+\.\dms$')
+
+        timer.finish(self.logger, 1)
+        assert_true('Timings: spawn' in self.logger.get_log_buffer())
+        assert_equal([stats[:2] for stats in get_perltidy_timing_stats()],
+                     [('spawn', 1), ('communicate', 1), ('total', 1)])
+
+        for i in range(PERLTIDY_TIMING_SAMPLES + 10):
+            record_perltidy_timing('spawn', i / 1000.0)
+        stage, samples, p50, p95, maximum = get_perltidy_timing_stats()[0]
+        assert_equal((stage, samples), ('spawn', PERLTIDY_TIMING_SAMPLES))
+        assert_true(p50 <= p95 <= maximum)
+        assert_equal(maximum, (PERLTIDY_TIMING_SAMPLES + 9) / 1000.0)
+        assert_true(format_perltidy_timing_stats().startswith('Stage'))
+
+        # Null timers must not record anything.
+        clear_perltidy_timing_stats()
+        timer = PerlTidyNullTimer()
+        with timer.span('spawn'):
+            pass
+        timer.finish(self.logger, 1)
+        assert_equal(get_perltidy_timing_stats(), [])
+
     def test_is_ascii_safe_string(self):
         assert_equal(True, is_ascii_safe_string(input='foobarbaz'))
         assert_equal(False, is_ascii_safe_string(input='äöü'))
 
 
+# Tests for stopping perltidy, using Python scripts in place of perltidy.
+class TestPerlTidyHelpersProcesses(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.orig_tempdir = tempfile.tempdir
+
+    def tearDown(self):
+        tempfile.tempdir = self.orig_tempdir
+        shutil.rmtree(self.temp_dir)
+
+    def write_script(self, code):
+        script = os.path.join(self.temp_dir, 'perltidy.py')
+        with open(script, 'w') as fh:
+            fh.write('import sys, time\n' + code + '\n')
+        return [sys.executable, script]
+
+    def test_run_perltidy_timeout(self):
+        cmd = self.write_script('sys.stdout.write("partial"); sys.stdout.flush(); time.sleep(30)')
+
+        # Temporary files must be removed, even if perltidy is stopped.
+        tempfile.tempdir = os.path.join(self.temp_dir, 'tmp')
+        os.mkdir(tempfile.tempdir)
+
+        started = time.time()
+        for version in ['20230309', '20101217']:
+            try:
+                capabilities = PerlTidyCapabilities(version=version)
+                run_perltidy(cmd, 'äöü', logger=self.logger, capabilities=capabilities, timeout=0.5)
+                assert_true(False, 'PerlTidyAbortedError not raised')
+            except (PerlTidyAbortedError) as e:
+                assert_equal(e.reason, PerlTidyAbortedError.TIMEOUT)
+                assert_true(str(e).startswith('perltidy timed out after 0.5s'))
+        assert_true(time.time() - started < 10)
+        assert_equal(os.listdir(tempfile.tempdir), [])
+
+        # Runs finishing in time are unaffected.
+        cmd = self.write_script('sys.stdout.write(sys.stdin.read())')
+        assert_equal(run_perltidy(cmd, 'use strict;', timeout=5), (True, 'use strict;', '', []))
+
+    def test_cancel_perltidy_processes(self):
+        cmd = self.write_script('time.sleep(30)')
+        errors = []
+
+        def run():
+            try:
+                run_perltidy(cmd, 'use strict;')
+            except (PerlTidyAbortedError) as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        cancellations = get_perltidy_cancellations()
+        for i in range(100):
+            if cancel_perltidy_processes():
+                break
+            time.sleep(0.05)
+        thread.join(10)
+
+        assert_false(thread.is_alive())
+        assert_equal([e.reason for e in errors], [PerlTidyAbortedError.CANCELLED])
+        assert_true(get_perltidy_cancellations() > cancellations)
+        assert_equal(cancel_perltidy_processes(), 0)
+
+    def test_get_subprocess_args_new_process_group(self):
+        if is_windows():
+            raise SkipTest('Process groups are not supported on Windows')
+
+        # Python 3 starts new sessions without running Python code in the
+        # child, which is unsafe in the presence of threads.
+        subprocess_args = get_subprocess_args(new_process_group=True)
+        assert_equal('preexec_fn' in subprocess_args, PY2)
+        assert_true('preexec_fn' in get_subprocess_args(new_process_group=True, cpu_limit=1))
+        assert_false('preexec_fn' in get_subprocess_args())
+
+        cmd, subprocess_args = subprocess_safe_args(self.write_script('import os; print(os.getpgid(0))'),
+                                                    subprocess_args)
+        p = subprocess.Popen(cmd, **subprocess_args)
+        output, error_output = p.communicate()
+        assert_equal(int(output), p.pid)
+
+    def test_run_perltidy_cpu_limit(self):
+        if is_windows():
+            raise SkipTest('Resource limits are not supported on Windows')
+
+        cmd = self.write_script('sys.stdout.write("partial"); sys.stdout.flush()\nwhile True: pass')
+        success, output, error_output, error_hints = run_perltidy(cmd, 'use strict;', cpu_limit=1, timeout=30)
+        assert_false(success)
+        assert_regexp_matches(error_output, r'^perltidy was terminated by signal \d+')
+        assert_true('"perltidy_cpu_limit"' in error_hints[0])
+
+    def test_run_perltidy_streaming(self):
+        cmd = self.write_script('stdin = getattr(sys.stdin, "buffer", sys.stdin)\n' +
+                                'stdout = getattr(sys.stdout, "buffer", sys.stdout)\n' +
+                                'stdout.write(" ".join(sys.argv[1:]).encode("utf-8") + b"\\n" + stdin.read())')
+
+        # Multi-byte characters are split across reads.
+        chunks = ['äöü' * 100000, 'use strict;\n'] * 3
+        success, output, error_output, error_hints = run_perltidy_streaming(cmd, iter(chunks), logger=self.logger)
+        assert_true(success)
+        assert_equal(''.join(output), '-ole=unix -utf8\n' + ''.join(chunks))
+
+        # Failing to produce chunks stops perltidy.
+        def abort():
+            yield 'use strict;\n'
+            raise PerlTidyAbortedError('view has been modified while tidying', PerlTidyAbortedError.CANCELLED)
+
+        assert_raises(PerlTidyAbortedError, run_perltidy_streaming, cmd, abort(), logger=self.logger)
+
+        cmd = self.write_script('sys.stderr.write("1: syntax error\\n")')
+        success, output, error_output, error_hints = run_perltidy_streaming(cmd, iter(chunks), logger=self.logger)
+        assert_false(success)
+        assert_equal(error_output, '1: syntax error\n')
+
+    def test_run_perltidy_streaming_timeout(self):
+        cmd = self.write_script('time.sleep(30)')
+
+        started = time.time()
+        try:
+            run_perltidy_streaming(cmd, iter(['use strict;\n'] * 1000), logger=self.logger, timeout=0.5)
+            assert_true(False, 'PerlTidyAbortedError not raised')
+        except (PerlTidyAbortedError) as e:
+            assert_equal(e.reason, PerlTidyAbortedError.TIMEOUT)
+        assert_true(time.time() - started < 10)
+
+
+class TestPerlTidyScheduler(PerlTidyTestCase):
+
+    def test_scheduler(self):
+        scheduler = PerlTidyScheduler(concurrency=1, max_queued=2, logger=self.logger)
+        release = threading.Event()
+        finished = threading.Event()
+        order = []
+
+        def job(name, wait=False):
+            def run():
+                order.append(name)
+                if wait:
+                    release.wait(10)
+                if name == 'last':
+                    finished.set()
+            return run
+
+        # Further jobs are queued while the first one runs.
+        assert_true(scheduler.submit('view1', job('first', wait=True)))
+        assert_true(scheduler.submit('view2', job('superseded'), on_superseded=lambda: order.append('dropped')))
+        assert_true(scheduler.submit('view3', job('last')))
+        assert_true(scheduler.is_queued('view2'))
+        assert_false(scheduler.is_queued('view1'))
+
+        # Queued jobs of the same view are superseded, full queues reject jobs.
+        assert_true(scheduler.submit('view2', job('newer')))
+        assert_equal(order, ['first', 'dropped'])
+        assert_false(scheduler.submit('view4', job('rejected')))
+
+        # Jobs of focused views run first.
+        assert_true(scheduler.promote('view2'))
+        assert_false(scheduler.promote('view4'))
+
+        release.set()
+        finished.wait(10)
+        assert_true(finished.is_set())
+        assert_equal(order, ['first', 'dropped', 'newer', 'last'])
+
+        stats = scheduler.get_stats()
+        assert_equal([stats[k] for k in ['submitted', 'started', 'superseded', 'rejected', 'max_queued', 'queued']],
+                     [5, 3, 1, 1, 2, 0])
+        assert_true('3 started, 1 superseded, 1 rejected' in scheduler.format_stats())
+
+        assert_equal(PerlTidyScheduler(concurrency=0).get_concurrency(), get_cpu_count())
+
+
 # Tests, which will be run on Windows platforms only.
 class TestPerlTidyHelpersWindows(PerlTidyTestCase):
 
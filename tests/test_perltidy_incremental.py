@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import re
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.helpers import find_perltidy_in_path, get_perltidyrc_fingerprint, run_perltidy
+from perltidy.incremental import *
+from perltidy.linehash import ROW_HASH_SIZE, ROW_HASHES_MAGIC, hash_rows
+from nose.tools import assert_equal, assert_is_none
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+PERL_MODULE = '''package Foo;
+
+use strict;
+use warnings;
+
+# Say hello.
+sub hello {
+    my ($name) = @_;
+    print "Hello {$name}\\n";
+    return;
+}
+
+sub heredoc {
+    print <<"EOT";
+sub not_a_sub {
+EOT
+    return;
+}
+
+=head1 NAME
+
+sub not_a_sub_either
+
+=cut
+
+sub goodbye {
+    print "Goodbye\\n";
+}
+
+1;
+'''
+
+
+# Tidy function mimicking perltidy for the purpose of these tests: reindents
+# lines by brace depth and collapses consecutive blank lines.
+def fake_tidy(text):
+    lines = []
+    depth = 0
+    in_heredoc = False
+
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if in_heredoc or stripped.startswith('=') or not stripped.endswith((';', '{', '}')):
+            in_heredoc = (in_heredoc or '<<' in line) and stripped != 'EOT'
+            lines.append(line)
+            continue
+        if '<<' in line:
+            in_heredoc = True
+        if stripped.startswith('}'):
+            depth -= 1
+        lines.append('    ' * depth + stripped)
+        if stripped.endswith('{'):
+            depth += 1
+
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def tidy_changed_blocks(old, new, tidy):
+    output = new
+    for begin, end in reversed(find_changed_blocks(old, new)):
+        output = output[:begin] + tidy(output[begin:end]) + output[end:]
+    return output
+
+
+class TestPerlTidyIncremental(PerlTidyTestCase):
+
+    def test_find_top_level_blocks(self):
+        lines = PERL_MODULE.splitlines(True)
+        blocks = find_top_level_blocks(lines)
+        assert_equal([lines[i].rstrip('\n') for i in blocks], ['package Foo;', '# Say hello.', 'sub heredoc {',
+                                                                'sub goodbye {'])
+
+        # Nested subs and subs not preceded by blank lines are not blocks.
+        lines = ['{\n', 'sub nested {\n', '}\n', '}\n', '\n', 'sub foo {}\n', 'sub bar {}\n']
+        assert_equal(find_top_level_blocks(lines), [0, 5])
+
+        # Unbalanced braces stop the scan.
+        lines = ['}\n', '\n', 'sub foo {}\n']
+        assert_equal(find_top_level_blocks(lines), [0])
+
+    def test_find_top_level_statements(self):
+        lines = PERL_MODULE.splitlines(True)
+        statements = find_top_level_statements(lines)
+        assert_equal([lines[i].rstrip('\n') for i in statements], ['package Foo;', '', 'use warnings;', '', '', '',
+                                                                    ''])
+        assert_equal([lines[i + 1].rstrip('\n') for i in statements[1:]], ['use strict;', '', '# Say hello.',
+                                                                             'sub heredoc {', '=head1 NAME', '1;'])
+
+        # Statements continued on following lines, within parentheses or
+        # here-documents are not split.
+        lines = ['if ($x) {\n', '}\n', 'else {\n', '}\n', 'my %h = (\n', 'a => 1,\n', ');\n', 'print <<EOT;\n',
+                 'x;\n', 'EOT\n', 'foo()\n', '  or die;\n', '1;\n']
+        assert_equal(find_top_level_statements(lines), [0, 4, 7, 10, 12])
+
+    def test_is_top_level_perl_code(self):
+        assert_equal(is_top_level_perl_code(PERL_MODULE.splitlines(True)), True)
+        assert_equal(is_top_level_perl_code([]), True)
+        assert_equal(is_top_level_perl_code(['# comment\n', '\n']), True)
+        assert_equal(is_top_level_perl_code(['my %h = (a => 1);\n', 'print <<EOT;\n', 'x\n', 'EOT\n']), True)
+
+        # Unbalanced, unterminated or continued statements.
+        assert_equal(is_top_level_perl_code(['sub foo {\n', '1;\n']), False)
+        assert_equal(is_top_level_perl_code(['1;\n', '}\n']), False)
+        assert_equal(is_top_level_perl_code(['my $x = 1\n']), False)
+        assert_equal(is_top_level_perl_code(['else {\n', '}\n']), False)
+        assert_equal(is_top_level_perl_code(['print <<EOT;\n', 'x\n']), False)
+        assert_equal(is_top_level_perl_code(['1;\n', '=head1 NAME\n']), False)
+
+    def test_find_changed_blocks(self):
+        assert_equal(find_changed_blocks(PERL_MODULE, PERL_MODULE), [])
+
+        new = PERL_MODULE.replace('    print "Goodbye', '  print "Goodbye')
+        begin, end = find_changed_blocks(PERL_MODULE, new)[0]
+        assert_equal(new[begin:end], 'sub goodbye {\n  print "Goodbye\\n";\n}\n\n1;\n')
+
+        # Adjacent blocks are merged.
+        new = PERL_MODULE.replace('  return;\n}\n\n=head1', 'return;\n}\n\n=head1').replace(
+            '    print "Goodbye', 'print "Goodbye')
+        assert_equal(len(find_changed_blocks(PERL_MODULE, new)), 1)
+
+        # Removing lines between blocks affects both of them.
+        new = PERL_MODULE.replace('\n# Say hello.\n', '\n')
+        assert_equal(len(find_changed_blocks(PERL_MODULE, new)), 1)
+
+        # Old text may be given as row hashes.
+        new = PERL_MODULE.replace('    print "Goodbye', '  print "Goodbye')
+        assert_equal(find_changed_blocks(hash_rows(PERL_MODULE), new), find_changed_blocks(PERL_MODULE, new))
+        assert_equal(find_changed_blocks(hash_rows(PERL_MODULE), PERL_MODULE), [])
+
+        # Adding a line ending at the end only changes the last block.
+        begin, end = find_changed_blocks(hash_rows(PERL_MODULE.rstrip()), PERL_MODULE)[0]
+        assert_equal(PERL_MODULE[begin:end], 'sub goodbye {\n    print "Goodbye\\n";\n}\n\n1;\n')
+
+    def test_find_changed_statements(self):
+        new = PERL_MODULE.replace('use warnings;', 'use  warnings;').replace('1;', '1 ;')
+        ranges = find_changed_blocks(PERL_MODULE, new, find_top_level_statements)
+        assert_equal([new[begin:end] for begin, end in ranges], ['use  warnings;\n', '\n1 ;\n'])
+
+        # Changes within subs affect the entire sub.
+        new = PERL_MODULE.replace('    print "Goodbye', '  print "Goodbye')
+        begin, end = find_changed_blocks(PERL_MODULE, new, find_top_level_statements)[0]
+        assert_equal(new[begin:end], '\n=head1 NAME\n\nsub not_a_sub_either\n\n=cut\n\n' +
+                     'sub goodbye {\n  print "Goodbye\\n";\n}\n')
+
+    def test_incremental_tidy_matches_full_tidy(self):
+        old = fake_tidy(PERL_MODULE)
+        assert_equal(old, PERL_MODULE)
+
+        edits = [
+            ('    my ($name) = @_;', 'my ($name) = @_;\n\n\n  my $x = 1;'),
+            ('    print "Goodbye\\n";', 'print "Goodbye\\n";'),
+            ('\n# Say hello.\n', '\n'),
+            ('1;\n', 'sub added {\nreturn 1;\n}\n\n1;\n'),
+        ]
+        new = old
+        for search, replacement in edits:
+            new = new.replace(search, replacement, 1)
+            assert_equal(tidy_changed_blocks(old, new, fake_tidy), fake_tidy(new))
+
+    def test_incremental_tidy_matches_full_tidy_with_perltidy(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        def tidy(text):
+            success, output, error_output, error_hints = run_perltidy(cmd + ['-npro', '-pbp', '-nst'], text)
+            assert_equal(success, True)
+            return output
+
+        old = tidy(PERL_MODULE)
+        new = old.replace('    print "Goodbye\\n";', 'print   "Goodbye\\n"  ;').replace(
+            '    my ($name) = @_;', 'my ($name)=@_;')
+        assert_equal(tidy_changed_blocks(old, new, tidy), tidy(new))
+
+    def test_perltidy_baseline(self):
+        set_perltidy_baseline(1, hash_rows('text'), ['-pbp'])
+        assert_equal(get_perltidy_baseline(1, ['-pbp']), hash_rows('text'))
+        assert_is_none(get_perltidy_baseline(1, ['-gnu']))
+
+        clear_perltidy_baseline(1)
+        assert_is_none(get_perltidy_baseline(1, ['-pbp']))
+
+        # Baselines of other perltidy versions are discarded.
+        set_perltidy_baseline(1, hash_rows('text'), ['-pbp'], perltidy_version='20230309')
+        assert_equal(get_perltidy_baseline(1, ['-pbp'], perltidy_version='20230309'), hash_rows('text'))
+        assert_is_none(get_perltidy_baseline(1, ['-pbp'], perltidy_version='20240202'))
+        clear_perltidy_baseline(1)
+
+    def test_perltidy_baseline_perltidyrc_edited(self):
+        directory = tempfile.mkdtemp()
+        try:
+            perltidyrc_path = os.path.join(directory, '.perltidyrc')
+            with open(perltidyrc_path, 'w') as fh:
+                fh.write('-i=4\n')
+            args = ['-pro={0}'.format(perltidyrc_path)]
+            fingerprint = get_perltidyrc_fingerprint([perltidyrc_path])
+
+            set_perltidy_baseline(1, hash_rows(PERL_MODULE), args, fingerprint, '20230309')
+            save_perltidy_baseline(1, '/tmp/Foo.pm', directory)
+            assert_equal(get_perltidy_baseline(1, args, fingerprint, '20230309'), hash_rows(PERL_MODULE))
+
+            with open(perltidyrc_path, 'w') as fh:
+                fh.write('-i=2\n')
+            fingerprint = get_perltidyrc_fingerprint([perltidyrc_path])
+            assert_is_none(get_perltidy_baseline(1, args, fingerprint, '20230309'))
+
+            # Same for baselines loaded from disk.
+            assert_equal(load_perltidy_baseline(2, '/tmp/Foo.pm', directory), True)
+            assert_is_none(get_perltidy_baseline(2, args, fingerprint, '20230309'))
+        finally:
+            clear_perltidy_baseline(1)
+            clear_perltidy_baseline(2)
+            shutil.rmtree(directory)
+
+    def test_perltidy_baseline_persistent(self):
+        directory = tempfile.mkdtemp()
+        try:
+            set_perltidy_baseline(1, hash_rows(PERL_MODULE), ['-pbp'], 'fingerprint', '20230309')
+            save_perltidy_baseline(1, '/tmp/Foo.pm', directory)
+            clear_perltidy_baseline(1)
+
+            assert_equal(load_perltidy_baseline(2, '/tmp/Bar.pm', directory), False)
+            assert_equal(load_perltidy_baseline(2, '/tmp/Foo.pm', directory), True)
+            assert_equal(get_perltidy_baseline(2, ['-pbp'], 'fingerprint', '20230309'), hash_rows(PERL_MODULE))
+            assert_is_none(get_perltidy_baseline(2, ['-pbp']))
+
+            # Hashes take 8 bytes per row on disk (on 64-bit platforms).
+            path = get_perltidy_baseline_path('/tmp/Foo.pm', directory)
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            header_size = data.index(b'\n') + 1 + len(ROW_HASHES_MAGIC) + 1
+            assert_equal(len(data) - header_size, ROW_HASH_SIZE * len(hash_rows(PERL_MODULE)))
+
+            # Truncated files are ignored.
+            with open(path, 'wb') as fh:
+                fh.write(data[:-3])
+            assert_equal(load_perltidy_baseline(3, '/tmp/Foo.pm', directory), False)
+        finally:
+            clear_perltidy_baseline(2)
+            shutil.rmtree(directory)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import random
+import sys
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.linehash import *
+from nose.tools import assert_equal, assert_is_none
+from test_perltidy_diff import apply_hunks
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class TestPerlTidyLineHash(PerlTidyTestCase):
+
+    def test_hash_rows(self):
+        assert_equal(len(hash_rows('')), 1)
+        assert_equal(len(hash_rows('a\nb\n')), 3)
+        assert_equal(list(hash_rows('a\nb')), [hash_row('a'), hash_row('b')])
+
+        # Hashes are stable across processes and take 8 bytes per row.
+        assert_equal(hash_row('print "Hello";'), hash_row('print "Hello";'))
+        assert_equal(hash_row('a'), (0xe8b7be43 << 32 | 0x00620062) & ROW_HASH_MASK)
+        assert_equal(hash_rows('a\nb').itemsize, ROW_HASH_SIZE)
+
+    def test_dump_row_hashes(self):
+        hashes = hash_rows('my $x = 1;\n\nprint "\u00e4";\n')
+        assert_equal(load_row_hashes(dump_row_hashes(hashes)), hashes)
+        assert_equal(len(dump_row_hashes(hashes)), len(ROW_HASHES_MAGIC) + 1 + 4 * ROW_HASH_SIZE)
+        assert_is_none(load_row_hashes(b'garbage'))
+        assert_is_none(load_row_hashes(dump_row_hashes(hashes)[:-1]))
+
+    def test_count_common_rows(self):
+        assert_equal(count_common_rows([1, 2, 3, 4], [1, 2, 5, 4]), (2, 1))
+        assert_equal(count_common_rows([1, 2, 3], [1, 2, 3]), (2, 0))
+        assert_equal(count_common_rows([1, 2], [1, 3, 3, 2]), (1, 0))
+        assert_equal(count_common_rows([1], [1]), (0, 0))
+
+    def test_diff_hunks_by_row_hashes(self):
+        rng = random.Random(42)
+        for i in range(200):
+            old_rows = ['    {0};'.format(rng.randint(0, 9)) for j in range(rng.randint(0, 30))]
+            new_rows = [row.strip() if rng.random() < 0.2 else row for row in old_rows]
+            if rng.random() < 0.5:
+                new_rows.insert(rng.randint(0, len(new_rows)), 'new;')
+            old, new = '\n'.join(old_rows) + '\n', '\n'.join(new_rows) + '\n'
+
+            hunks = diff_hunks_by_row_hashes(old, new)
+            assert_equal(apply_hunks(old, hunks), new)
+
+            # Outdated hashes must not result in wrong hunks.
+            hunks = diff_hunks_by_row_hashes(old, new, hash_rows(new), hash_rows(new))
+            assert_equal(apply_hunks(old, hunks), new)
+
+        # Only rows in between common leading and trailing rows are diffed.
+        old = 'a;\n  b;\nc;\n'
+        assert_equal(diff_hunks_by_row_hashes(old, 'a;\nb;\nc;\n'), [(3, 7, 'b;')])
+
+    def test_row_index(self):
+        set_perltidy_row_index(1, hash_rows('a\nb\nc'), 5)
+        index = get_perltidy_row_index(1)
+        assert_equal(index.change_count, 5)
+
+        index.replace_rows(1, 1, hash_rows('x\ny'))
+        assert_equal(index.hashes, hash_rows('a\nx\ny\nc'))
+
+        clear_perltidy_row_index(1)
+        assert_is_none(get_perltidy_row_index(1))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.helpers import find_perltidy_in_path, run_perltidy
+from perltidy.perltidyrc import *
+from nose.tools import assert_equal, assert_false, assert_is_none, assert_raises, assert_true
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class TestPerlTidyrcResolver(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        os.makedirs(os.path.join(self.temp_dir, 'project', 'sub', 'lib'))
+        self.project = os.path.join(self.temp_dir, 'project')
+        self.file_name = os.path.join(self.project, 'sub', 'lib', 'Foo.pm')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_perltidyrc(self, path):
+        with open(path, 'wb') as f:
+            f.write(b'-l=100\n')
+        return path
+
+    def test_find_project_root(self):
+        directories = [os.path.join(self.project, 'sub'), self.project, self.temp_dir + 'x']
+        assert_equal(find_project_root(self.file_name, directories), self.project)
+        assert_is_none(find_project_root(self.file_name, [os.path.join(self.project, 'su')]))
+
+    def test_resolve_upward(self):
+        resolver = PerlTidyrcResolver()
+        assert_is_none(resolver.resolve(self.file_name, [self.project], ['.perltidyrc']))
+
+        # Closest perltidyrc wins, but cached negative results are reused.
+        root_rc = self.write_perltidyrc(os.path.join(self.project, '.perltidyrc'))
+        sub_rc = self.write_perltidyrc(os.path.join(self.project, 'sub', '.perltidyrc'))
+        assert_is_none(resolver.resolve(self.file_name, [self.project], ['.perltidyrc']))
+
+        resolver.clear()
+        assert_equal(resolver.resolve(self.file_name, [self.project], ['.perltidyrc']), sub_rc)
+        assert_equal(resolver.resolve(os.path.join(self.project, 'Bar.pm'), [self.project], ['.perltidyrc']),
+                     root_rc)
+
+        # Cached results must be invalidated, if resolved perltidyrc vanishes.
+        os.remove(sub_rc)
+        assert_equal(resolver.resolve(self.file_name, [self.project], ['.perltidyrc']), root_rc)
+
+    def test_resolve_fallback(self):
+        resolver = PerlTidyrcResolver()
+        other = os.path.join(self.temp_dir, 'other')
+        os.makedirs(other)
+        other_rc = self.write_perltidyrc(os.path.join(other, 'perltidyrc'))
+
+        # Files outside of projects and unsaved views use any project folder.
+        assert_equal(resolver.resolve(None, [self.project, other], ['.perltidyrc', 'perltidyrc']), other_rc)
+        assert_equal(resolver.resolve(self.file_name, [self.project, other], ['perltidyrc']), other_rc)
+
+        # Absolute paths are honored.
+        assert_equal(resolver.resolve(self.file_name, [self.project], [other_rc]), other_rc)
+
+        # Absolute paths take precedence over closer perltidyrc files, in the
+        # order given.
+        self.write_perltidyrc(os.path.join(self.project, 'sub', '.perltidyrc'))
+        missing_rc = os.path.join(other, 'missing')
+        assert_equal(resolver.resolve(self.file_name, [self.project], ['.perltidyrc', missing_rc, other_rc]),
+                     other_rc)
+
+
+class TestPerlTidyrcParser(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.perltidyrc_path = os.path.join(self.temp_dir, '.perltidyrc')
+        clear_parsed_perltidyrc_cache()
+
+    def tearDown(self):
+        clear_parsed_perltidyrc_cache()
+        shutil.rmtree(self.temp_dir)
+
+    def write_perltidyrc(self, contents):
+        with open(self.perltidyrc_path, 'wb') as f:
+            f.write(contents)
+
+    def test_split_perltidyrc(self):
+        args, abbreviations = split_perltidyrc(
+            '# comment\n-l=100  # side comment\n-wbb="% + #"\nsane { -i=4\n -ci=2 }\n-sane\n')
+        assert_equal(args, ['-l=100', '-wbb=% + #', '-sane'])
+        assert_equal(abbreviations, {'sane': ['-i=4', '-ci=2']})
+
+        assert_raises(ValueError, split_perltidyrc, '-wbb="=\n')
+        assert_raises(ValueError, split_perltidyrc, 'sane { -i=4\n')
+        assert_raises(ValueError, split_perltidyrc, '-i=4 }\n')
+
+    def test_parse_perltidy_args(self):
+        assert_equal(parse_perltidy_args(['-l=100', '--indent-columns=2', '-l', '80', '-nolq', '--no-tabs',
+                                          '--nocuddled-else', '-nst']),
+                     [('maximum-line-length', '100'), ('indent-columns', '2'), ('maximum-line-length', '80'),
+                      ('outdent-long-quotes', False), ('tabs', False), ('cuddled-else', False),
+                      ('standard-output', False)])
+
+        # Unknown options and abbreviated long names are kept verbatim.
+        assert_equal(parse_perltidy_args(['--maximum-fields=3', '-xyz=1', '-nxyz', '--no-xyz']),
+                     [(None, '--maximum-fields=3'), (None, '-xyz=1'), (None, '-nxyz'), (None, '--no-xyz')])
+
+        # Abbreviations are expanded, profile options skipped.
+        assert_equal(parse_perltidy_args(['-pro=/tmp/perltidyrc', '-sane', '-npro'], {'sane': ['-gnu', '-i=2']}),
+                     [('line-up-parentheses', True), ('opening-brace-on-new-line', True),
+                      ('outdent-long-lines', False), ('paren-tightness', '2'), ('brace-tightness', '2'),
+                      ('square-bracket-tightness', '2'), ('indent-closing-paren', True), ('indent-columns', '2')])
+        assert_equal(dict(parse_perltidy_args(['-pbp']))['maximum-line-length'], '78')
+
+        assert_raises(ValueError, parse_perltidy_args, ['l=100'])
+        assert_raises(ValueError, parse_perltidy_args, ['-l'])
+        assert_raises(ValueError, parse_perltidy_args, ['-loop'], {'loop': ['-loop']})
+
+    def test_effective_perltidy_args(self):
+        # Options override perltidyrc files, like on perltidy's command line.
+        self.write_perltidyrc(b'-l=100 # wide\n-nst\n-xyz\n')
+        assert_equal(get_effective_perltidy_args(self.perltidyrc_path, ['-l=80', '-i=2', '-xyz']),
+                     ['-npro', '--nostandard-output', '-xyz', '--maximum-line-length=80', '--indent-columns=2',
+                      '-xyz'])
+
+        # Formatting and comments of perltidyrc files do not matter.
+        args = get_effective_perltidy_args(self.perltidyrc_path, ['-pbp'])
+        self.write_perltidyrc(b'--maximum-line-length=100\n\n--nostandard-output # see above\n  -xyz\n')
+        os.utime(self.perltidyrc_path, (1, 1))
+        assert_equal(get_effective_perltidy_args(self.perltidyrc_path, ['-pbp']), args)
+
+        # Parsed perltidyrc files are reused, until they change.
+        self.logger.clear_log_buffer()
+        get_effective_perltidy_args(self.perltidyrc_path, ['-pbp'], logger=self.logger)
+        assert_false('Parsing perltidyrc' in self.logger.get_log_buffer())
+
+        # perltidy is left to read perltidyrc files, which cannot be parsed.
+        self.write_perltidyrc(b'-l=100 }\n')
+        assert_is_none(get_effective_perltidy_args(self.perltidyrc_path, ['-pbp']))
+        assert_is_none(get_effective_perltidy_args(os.path.join(self.temp_dir, 'missing'), ['-pbp']))
+        assert_equal(get_effective_perltidy_args(None, ['-i=2', '-npro']), ['-npro', '--indent-columns=2'])
+
+    def test_effective_perltidy_args_match_perltidy(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        # perltidy must tidy the same using effective options as when reading
+        # the perltidyrc on its own.
+        self.write_perltidyrc(b'# house style\n-l=60 -i=2\n-nbbc\nsane { -ce -nolq }\n-sane\n-bt=2 -sbt=2\n')
+        input = ('sub  f { my ($a,$b)=@_; if ($a) { print "a"; } else { print {$fh} "b", "c", $b->{x}; } '
+                 'my %h = ( alpha => 1, beta => [ 1, 2, 3 ], gamma => { x => 1 } ); return %h; }\n')
+
+        for options in [[], ['-pbp'], ['-l=100', '-i=4', '-nce'], ['-pbp', '-nce', '-kgb']]:
+            args = get_effective_perltidy_args(self.perltidyrc_path, options)
+            expected = run_perltidy(cmd + options + ['-pro=' + self.perltidyrc_path], input, logger=self.logger)
+            result = run_perltidy(cmd + args, input, logger=self.logger)
+            assert_true(expected[0])
+            assert_equal(result[1], expected[1])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.project import *
+from nose.tools import assert_equal, assert_false, assert_true
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+# Fake perltidy, which strips leading whitespace from every line.
+def fake_tidy(path, input):
+    if 'SYNTAXERROR' in input:
+        return False, None, 'syntax error\n', []
+    return True, '\n'.join([line.lstrip() for line in input.split('\n')]), '', []
+
+
+class TestPerlTidyProject(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+        self.write_file('lib/Foo.pm', 'package Foo;\n  1;\n')
+        self.write_file('lib/Bar.pm', 'package Bar;\n1;\n')
+        self.write_file('script/foo', '#!/usr/bin/env perl\r\n  print "äöü";\r\n')
+        self.write_file('script/foo.sh', '#!/bin/sh\n  echo\n')
+        self.write_file('t/broken.t', 'SYNTAXERROR\n')
+        self.write_file('blib/lib/Foo.pm', 'package Foo;\n  1;\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.temp_dir, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+
+    def read_file(self, name):
+        with open(os.path.join(self.temp_dir, *name.split('/')), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def test_is_perl_file(self):
+        assert_true(is_perl_file(os.path.join(self.temp_dir, 'lib', 'Foo.pm'), ['.pm']))
+        assert_false(is_perl_file(os.path.join(self.temp_dir, 'lib', 'Foo.pm'), ['.pl']))
+        assert_true(is_perl_file(os.path.join(self.temp_dir, 'script', 'foo'), []))
+        assert_false(is_perl_file(os.path.join(self.temp_dir, 'script', 'foo.sh'), ['.pm']))
+        assert_false(is_perl_file(os.path.join(self.temp_dir, 'nonexistant'), ['.pm']))
+
+    def test_find_perl_files(self):
+        # Nested directories must not yield files twice.
+        files = list(find_perl_files([self.temp_dir, os.path.join(self.temp_dir, 'lib')], ['.pm', '.t'], ['blib']))
+        expected = [os.path.join(self.temp_dir, *name.split('/'))
+                    for name in ['lib/Bar.pm', 'lib/Foo.pm', 'script/foo', 't/broken.t']]
+        assert_equal(files, expected)
+
+    def test_tidy_files(self):
+        files = find_perl_files([self.temp_dir], ['.pm', '.t'], ['blib'])
+        results = []
+
+        # Dry run must not modify any files.
+        summary = tidy_files(files, fake_tidy, jobs=3, dry_run=True, callback=results.append)
+        assert_equal(len(results), 4)
+        assert_equal(len(summary.files(PerlTidyFileResult.CHANGED)), 2)
+        assert_equal(len(summary.files(PerlTidyFileResult.UNCHANGED)), 1)
+        assert_equal(len(summary.files(PerlTidyFileResult.FAILED)), 1)
+        assert_equal(self.read_file('lib/Foo.pm'), 'package Foo;\n  1;\n')
+        assert_true('2 files would change, 1 unchanged, 1 failed' in summary.format(dry_run=True))
+
+        # Line endings must be preserved.
+        files = find_perl_files([self.temp_dir], ['.pm', '.t'], ['blib'])
+        summary = tidy_files(files, fake_tidy, jobs=2)
+        assert_equal(self.read_file('lib/Foo.pm'), 'package Foo;\n1;\n')
+        assert_equal(self.read_file('script/foo'), '#!/usr/bin/env perl\r\nprint "äöü";\r\n')
+        assert_equal(self.read_file('blib/lib/Foo.pm'), 'package Foo;\n  1;\n')
+        assert_equal(summary.files(PerlTidyFileResult.FAILED)[0].message, 'syntax error')
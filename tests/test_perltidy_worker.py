@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import sublime_mocked
+sys.modules['sublime'] = sublime_mocked
+
+from perltidy.capabilities import probe_perltidy_capabilities
+from perltidy.helpers import PerlTidyCapabilities, find_perltidy_in_path, run_perltidy
+from perltidy.worker import *
+from nose.tools import assert_equal, assert_false, assert_is_none, assert_true
+from nose.plugins.skip import SkipTest
+from test_perltidy_helpers import PerlTidyTestCase
+
+
+class TestPerlTidyWorker(PerlTidyTestCase):
+
+    def setUp(self):
+        PerlTidyTestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        stop_perltidy_workers()
+        shutil.rmtree(self.temp_dir)
+
+    def write_script(self, filename, first_line):
+        path = os.path.join(self.temp_dir, filename)
+        with open(path, 'wb') as f:
+            f.write((first_line + "\nprint 'Hello world';\n").encode('ascii'))
+        return path
+
+    def test_find_perl_for_perltidy_cmd(self):
+        assert_is_none(find_perl_for_perltidy_cmd(None))
+        assert_is_none(find_perl_for_perltidy_cmd([]))
+
+        # Explicit Perl interpreter.
+        cmd = ['C:\\Perl64\\bin\\perl.exe', 'C:\\Perl64\\site\\bin\\perltidy']
+        assert_equal(find_perl_for_perltidy_cmd(cmd), ['C:\\Perl64\\bin\\perl.exe'])
+
+        # Perl interpreter from shebang line.
+        script = self.write_script('perltidy', '#!/usr/bin/perl -w')
+        assert_equal(find_perl_for_perltidy_cmd([script]), ['/usr/bin/perl', '-w'])
+        script = self.write_script('perltidy-env', '#!/usr/bin/env perl')
+        assert_equal(find_perl_for_perltidy_cmd([script]), ['/usr/bin/env', 'perl'])
+
+        # No Perl interpreter.
+        script = self.write_script('perltidy-sh', '#!/bin/sh')
+        assert_is_none(find_perl_for_perltidy_cmd([script]))
+        script = self.write_script('perltidy.bat', '@echo off')
+        assert_is_none(find_perl_for_perltidy_cmd([script]))
+        assert_is_none(find_perl_for_perltidy_cmd([os.path.join(self.temp_dir, 'nonexistant')]))
+
+    def test_run_perltidy_in_worker_unavailable(self):
+        # Workers, which cannot be started, must be disabled, so callers fall
+        # back to run_perltidy().
+        script = self.write_script('perltidy-sh', '#!/bin/sh')
+        assert_is_none(run_perltidy_in_worker([script], ['-pbp'], 'use strict;', logger=self.logger))
+        assert_false(get_perltidy_worker_pool([script]).is_available())
+
+    def test_get_perltidy_worker_pool(self):
+        pool = get_perltidy_worker_pool(['/usr/bin/perltidy'], idle_timeout=10)
+        assert_true(pool is get_perltidy_worker_pool(['/usr/bin/perltidy'], idle_timeout=20))
+        assert_equal(pool.idle_timeout, 20)
+
+        stop_perltidy_workers()
+        assert_false(pool is get_perltidy_worker_pool(['/usr/bin/perltidy']))
+
+    def test_perltidy_worker_pool_acquire(self):
+        pool = PerlTidyWorkerPool(['/usr/bin/perltidy'])
+
+        # Workers must be created up to max_workers and reused afterwards.
+        first = pool.acquire(max_workers=2)
+        second = pool.acquire(max_workers=2)
+        assert_false(first is second)
+        assert_false(first.is_running())
+
+        pool.release(first)
+        assert_true(pool.acquire(max_workers=2) is first)
+
+    def test_perltidy_worker_pool_prewarm(self):
+        script = self.write_script('perltidy-sh', '#!/bin/sh')
+        assert_equal(PerlTidyWorkerPool([script], logger=self.logger).prewarm(2), 0)
+
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        pool = get_perltidy_worker_pool(cmd, logger=self.logger)
+        assert_equal(pool.prewarm(2), 2)
+        assert_equal(len([worker for worker in pool._workers if worker.is_running()]), 2)
+
+        # Running workers are not started again, but serve requests right away.
+        assert_equal(pool.prewarm(2), 0)
+        success, output, error_output, error_hints = pool.run(['-npro'], 'use strict;\n')
+        assert_true(success)
+        assert_equal(len(pool._workers), 2)
+
+    def test_run_perltidy_in_worker_non_ascii(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        # Non-ASCII input must be tidied the same by workers and perltidy.
+        capabilities = probe_perltidy_capabilities(cmd, logger=self.logger)
+        input = 'my  $gr\u00fc\u00dfe = "\u00e4\u00f6\u00fc \u20ac";   my $x = [ "\u00e9t\u00e9", 1 ];\n'
+        expected = run_perltidy(cmd + ['-npro'], input, logger=self.logger, capabilities=capabilities)
+        result = run_perltidy_in_worker(cmd, ['-npro'], input, logger=self.logger, capabilities=capabilities)
+        assert_true(expected[0])
+        assert_equal(result, expected)
+
+    def test_run_perltidy_in_worker_version_mismatch(self):
+        cmd = find_perltidy_in_path()
+        if cmd is None:
+            raise SkipTest('perltidy not found in PATH')
+
+        # Workers loading another Perl::Tidy than perltidy reports are not
+        # used.
+        capabilities = PerlTidyCapabilities(version='19990101')
+        assert_is_none(run_perltidy_in_worker(cmd, ['-npro'], '1;\n', logger=self.logger, capabilities=capabilities))
+        assert_false(get_perltidy_worker_pool(cmd).is_available())
+
+    def test_run_perltidy_in_worker_old_perltidy(self):
+        perl = [os.path.join(path, 'perl') for path in os.environ['PATH'].split(os.pathsep)
+                if os.path.isfile(os.path.join(path, 'perl'))]
+        if not perl:
+            raise SkipTest('perl not found in PATH')
+
+        # Old versions of Perl::Tidy return nothing, which must not be taken
+        # as error, while exceptions still are.
+        os.mkdir(os.path.join(self.temp_dir, 'Perl'))
+        with open(os.path.join(self.temp_dir, 'Perl', 'Tidy.pm'), 'w') as fh:
+            fh.write("package Perl::Tidy;\nour $VERSION = '20101217';\n"
+                     "sub perltidy { my %args = @_; die \"Broken\\n\" if ${$args{source}} =~ /die/; "
+                     "${$args{destination}} = ${$args{source}}; return; }\n1;\n")
+        cmd = [perl[0], '-I' + self.temp_dir, self.write_script('perltidy', '#!/usr/bin/perl')]
+
+        capabilities = PerlTidyCapabilities(version='20101217')
+        assert_equal(run_perltidy_in_worker(cmd, ['-npro'], '1;\n', logger=self.logger, capabilities=capabilities),
+                     (True, '1;\n', '', []))
+        assert_equal(run_perltidy_in_worker(cmd, ['-npro'], 'die;\n', logger=self.logger, capabilities=capabilities),
+                     (False, '', 'Broken\n', []))